@@ -2,15 +2,23 @@
 import os
 import logging
 import asyncio
+import functools
+import secrets
+import time
 from dotenv import load_dotenv
 from telegram import Update
+from telegram.error import RetryAfter, NetworkError
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters
-from pydub import AudioSegment
-from azure_stt import AzureGrader
-from homework_manager import HomeworkManager
-from user_manager import UserManager
-import tempfile
-import difflib
+from registry import get_user_manager, get_homework_renderer, get_grader, get_async_sheets, get_archive, close_async_clients
+from grading_pool import GradingPool, GradingQueueFull, GradingSuperseded
+from audio_utils import SilenceGate
+from pipeline import grade_pcm, record_score, prepare_pcm, format_score, NO_SPEECH, SUPERSEDED, APPROXIMATE_NOTE
+from streaming import streaming_enabled, file_url, stream_and_grade, close_client
+from broadcast import Broadcaster, BroadcastJob
+from persistence import SqlitePersistence
+from get_cf_url import find_tunnel_url
+from metrics import Trace, register_gauge, start_metrics_server, observe, observe_trimmed
+from grading_queue import SqliteJobQueue
 import pytz
 import datetime
 
@@ -23,12 +31,19 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+# Worker pool for blocking conversion/grading work (GRADING_WORKERS, GRADING_QUEUE_SIZE)
+grading_pool = GradingPool()
+register_gauge("jdoit_gradings_pending", "Gradings running or waiting for a worker.", lambda: grading_pool.pending)
+
+# DEPLOY_MODE=sharded: gradings go to grading_worker.py processes through this queue
+grading_queue = None
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat_id = update.effective_chat.id
     
     # Register user via UserManager
-    user_manager = UserManager()
+    user_manager = get_user_manager()
     is_new = user_manager.register_user(chat_id)
     
     msg = f"안녕하세요 {user.first_name}님! J_Doit_homework_bot입니다. 🇰🇷\n"
@@ -51,39 +66,27 @@ async def send_homework_now(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     
     try:
-        user_manager = UserManager()
-        hw_manager = HomeworkManager()
+        user_manager = get_user_manager()
+        renderer = get_homework_renderer()
         
         # Get user progress
         progress = user_manager.get_user_progress(chat_id)
         current_day = progress.get("current_day", 1)
         
-        # Fetch homework for current day (returns a LIST now)
-        hw_list = hw_manager.get_homework(day=current_day)
+        # Pre-rendered messages for the current day (shared by all users on that day)
+        # Catalog refresh (if stale) is awaited, so other chats keep being served meanwhile
+        bundle = await renderer.render_async(current_day, style="command", sheets=get_async_sheets())
         
-        if hw_list:
+        if bundle:
             # Store ALL candidate texts for implicit reply matching
-            candidates = [entry['text'] for entry in hw_list if entry.get('text')]
-            context.user_data['homework_candidates'] = candidates
+            context.user_data['homework_candidates'] = list(bundle.candidates)
             
             # Reset single last_homework (optional, but good for clarity)
             context.user_data['last_homework'] = None 
             
-            await update.message.reply_text(f"📚 [Day {current_day}] 오늘의 숙제는 총 {len(hw_list)}개 입니다.")
-            
-            # Iterate and send each homework
-            for idx, hw in enumerate(hw_list, 1):
-                hw_text = hw.get('text', '')
-                audio_url = hw.get('audio_url')
-                
-                msg = f"#{idx}. 다음 문장을 읽어주세요:\n\n\"{hw_text}\""
-                if audio_url:
-                    msg += f"\n\n🎧 참고 오디오: {audio_url}"
-                
+            for msg in bundle.messages:
                 await update.message.reply_text(msg)
             
-            await update.message.reply_text("💡 팁: 위 문장 중 아무거나 골라서 읽어주시면, 자동으로 찾아서 채점해드립니다!")
-            
             # Advance progress AFTER sending (assuming checking sent is enough)
             user_manager.advance_user_day(chat_id)
             
@@ -99,72 +102,59 @@ async def run_daily_homework(context: ContextTypes.DEFAULT_TYPE):
     """매일 정해진 시간에 모든 유저에게 숙제 발송"""
     logging.info("Running daily homework job...")
     
-    user_manager = UserManager()
-    hw_manager = HomeworkManager()
+    user_manager = get_user_manager()
+    renderer = get_homework_renderer()
     
-    # Load all users (assuming we can iterate them, otherwise we need get_all_users() in user_manager)
-    # Since user_manager.users is a dict loaded from json, we can access it directly or add a method.
-    # Let's verify accessing .users directly is safe if instance is fresh.
-    # UserManager loads on init.
+    # Re-read the store: the web app may have registered or advanced users since
+    all_users = list((await asyncio.to_thread(user_manager.refresh_users)).items())
     
-    all_users = user_manager.users
+    # 1. Collect every user's message bundle (rendered once per day, not per user)
+    trace = Trace("daily_homework", users=len(all_users))
+    with trace.stage("daily_render"):
+        await renderer.hw_manager.ensure_catalog_async(get_async_sheets())
+        jobs = _collect_daily_jobs(context, renderer, all_users)
     
-    for chat_id_str, user_data in all_users.items():
-        chat_id = int(chat_id_str)
+    # 2. Fan out concurrently within Telegram's rate limits
+    with trace.stage("daily_broadcast"):
+        report = await Broadcaster(context.bot).run(jobs)
+    trace.log(jobs=len(jobs))
+    logging.info(f"Daily homework finished: {report}")
+
+def _collect_daily_jobs(context, renderer, all_users):
+    jobs = []
+    for chat_id_str, user_data in all_users:
+        try:
+            chat_id = int(chat_id_str)
+        except ValueError:
+            continue  # Web-only users have no Telegram chat
         current_day = user_data.get("current_day", 1)
         
-        try:
-            hw_list = hw_manager.get_homework(day=current_day)
-            
-            if hw_list:
-                # We can't update context.user_data for all users easily in a job unless we use job context or application.user_data?
-                # Actually, context.user_data is available if we passed a specific user's context, but here we are in a global job.
-                # However, application.persistence or user_data is accessible if persistance is set up.
-                # Without persistence, context.user_data might be volatile or tricky to access by key.
-                # BUT, we can just send the message. The fallback logic in handle_voice might fail if it relies ONLY on context.user_data.
-                # CRITICAL: We need a way to store candidates for implicit reply.
-                # 'context.application.user_data[chat_id]' is the standard way.
-                
-                # Fetch user_data for this user
-                user_context_data = context.application.user_data[chat_id]
-                
-                candidates = [entry['text'] for entry in hw_list if entry.get('text')]
-                user_context_data['homework_candidates'] = candidates
-                user_context_data['last_homework'] = None
-                
-                await context.bot.send_message(chat_id=chat_id, text=f"🔔 [알림] 오늘의 숙제가 도착했습니다! (Day {current_day})")
-                await context.bot.send_message(chat_id=chat_id, text=f"📚 총 {len(hw_list)}개의 문장이 준비되었습니다.")
-
-                for idx, hw in enumerate(hw_list, 1):
-                    hw_text = hw.get('text', '')
-                    audio_url = hw.get('audio_url')
-                    
-                    msg = f"#{idx}. 다음 문장을 읽어주세요:\n\n\"{hw_text}\""
-                    if audio_url:
-                        msg += f"\n\n🎧 참고 오디오: {audio_url}"
-                    
-                    await context.bot.send_message(chat_id=chat_id, text=msg)
-                
-                await context.bot.send_message(chat_id=chat_id, text="💡 아무 문장이나 읽어서 음성 메시지로 보내주세요!")
-                
-                # Advance day
-                user_manager.advance_user_day(chat_id)
-                logging.info(f"Sent homework to {chat_id} (Day {current_day})")
-            
-            else:
-                # No homework means done? Silent or notify? Let's stay silent to avoid spam, or verify intent.
-                # User asked for "모든 과정을 수료하셨습니다" on exception, maybe send once?
-                # For now, let's just log.
-                logging.info(f"No homework for {chat_id} (Day {current_day})")
-                
-        except Exception as e:
-            logging.error(f"Failed to send daily homework to {chat_id}: {e}")
+        bundle = renderer.render(current_day, style="daily", refresh=False)
+        if not bundle:
+            # No homework means done? Stay silent to avoid spam, just log.
+            logging.info(f"No homework for {chat_id} (Day {current_day})")
+            continue
+        
+        # Store candidates for implicit reply matching ('application.user_data[chat_id]' is the standard way)
+        user_context_data = context.application.user_data[chat_id]
+        user_context_data['homework_candidates'] = list(bundle.candidates)
+        user_context_data['last_homework'] = None
+        # Jobs don't go through an Update, so tell persistence this user_data changed
+        context.application.mark_data_for_update_persistence(user_ids=chat_id)
+        
+        jobs.append(BroadcastJob(chat_id, bundle.messages, on_success=functools.partial(_on_daily_homework_sent, current_day)))
+    return jobs
+
+def _on_daily_homework_sent(current_day, chat_id):
+    # Advance day only once the whole bundle was delivered
+    get_user_manager().advance_user_day(chat_id)
+    logging.info(f"Sent homework to {chat_id} (Day {current_day})")
 
 async def test_scheduler_job(context: ContextTypes.DEFAULT_TYPE):
     """봇 실행 직후 작동 확인을 위한 1회성 테스트 Job"""
     logging.info("🧪 Testing Scheduler...")
     # Send a message to the first user found or log
-    user_manager = UserManager()
+    user_manager = get_user_manager()
     if user_manager.users:
         first_user = list(user_manager.users.keys())[0]
         await context.bot.send_message(chat_id=first_user, text="✅ [System] 봇이 재실행되었습니다. 스케줄러가 정상 작동 중입니다.")
@@ -178,23 +168,10 @@ async def set_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
             
         new_day = int(context.args[0])
-        user_manager = UserManager()
+        user_manager = get_user_manager()
         
-        # Update logic
-        str_id = str(chat_id)
-        if str_id in user_manager.users:
-            # Update local DB
-            user_manager.users[str_id]["current_day"] = new_day
-            user_manager.save_users()
-            
-            # Sync to Google Sheet (Important!)
-            # We reuse the last_homework_date or just today's date if None
-            last_date = user_manager.users[str_id].get("last_homework_date")
-            if not last_date:
-                last_date = datetime.date.today().isoformat()
-            
-            user_manager.sync_to_sheet(str_id, new_day, last_date)
-            
+        # Updates the local DB and syncs to the Google Sheet
+        if user_manager.set_user_day(chat_id, new_day):
             await update.message.reply_text(f"🔄 진도가 {new_day}일차로 변경되었습니다!\n'/homework'를 입력하면 해당 진도의 숙제가 나옵니다.")
         else:
             await update.message.reply_text("먼저 /start를 눌러 등록해주세요.")
@@ -207,7 +184,7 @@ async def set_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """내 진도 확인"""
     chat_id = update.effective_chat.id
-    user_manager = UserManager()
+    user_manager = get_user_manager()
     progress = user_manager.get_user_progress(chat_id)
     day = progress.get('current_day', 1)
     await update.message.reply_text(f"ℹ️ 현재 회원님의 진도는 [Day {day}] 입니다.")
@@ -216,6 +193,7 @@ async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 1. Determine Reference Text
     ref_text = None
+    from_last_homework = False
     if update.message.caption:
         ref_text = update.message.caption
     elif update.message.reply_to_message and update.message.reply_to_message.text:
@@ -232,8 +210,7 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             # Legacy fallback
             ref_text = context.user_data.get('last_homework')
-            if ref_text:
-                 await update.message.reply_text(f"💡 최근 숙제 문장으로 평가합니다.")
+            from_last_homework = bool(ref_text)
     
     if not ref_text and not context.user_data.get('homework_candidates'):
         await update.message.reply_text(
@@ -242,120 +219,317 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    status_msg = await update.message.reply_text(f"🎧 분석 중... \n문장: \"{ref_text}\"")
+    # Take this chat's place in line before the first await, so voice notes are
+    # graded (and answered) in the order they arrived, not the order our replies finish
+    try:
+        turn = grading_pool.reserve(update.effective_chat.id, ref_text)
+    except GradingQueueFull:
+        await update.message.reply_text("⏳ 지금 채점 요청이 많습니다. 잠시 후 다시 보내주세요.")
+        return
 
-    # 2. Download Voice File
     try:
-        voice_file = await update.message.voice.get_file()
-        
-        # Use temp files to avoid clutter/conflicts
-        with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as ogg_temp:
-            ogg_path = ogg_temp.name
-        
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as wav_temp:
-            wav_path = wav_temp.name
-            
-        await voice_file.download_to_drive(ogg_path)
-        
-        # 3. Convert OGG to WAV (16kHz, Mono) using pydub
+        if from_last_homework:
+            await update.message.reply_text(f"💡 최근 숙제 문장으로 평가합니다.")
+        status_msg = await update.message.reply_text(f"🎧 분석 중... \n문장: \"{ref_text}\"")
+    except BaseException:
+        turn.release()
+        raise
+
+    # Everything needed to grade (or resume grading after a restart) without the Update
+    job = {
+        "chat_id": update.effective_chat.id,
+        "file_id": update.message.voice.file_id,
+        "file_unique_id": update.message.voice.file_unique_id,
+        "ref_text": ref_text,
+        "candidates": [] if ref_text else list(context.user_data.get('homework_candidates', []))
+    }
+    await run_grading_job(context.application, job, status_msg, turn)
+
+async def run_grading_job(application, job, status_msg, turn=None):
+    """
+    Grades one submission. The job stays recorded in persistence until it finishes.
+    `turn` is the chat lane place reserved when the message arrived (resumed jobs reserve one here).
+    """
+    if grading_queue is not None:
         try:
-            sound = AudioSegment.from_ogg(ogg_path)
-            sound = sound.set_frame_rate(16000).set_channels(1)
-            sound.export(wav_path, format="wav")
-            
+            # Submits in arrival order; the SQLite queue keeps that order per chat
+            async with grading_pool.chat_turn(job["chat_id"], job["ref_text"], turn=turn):
+                await queue_grading_job(job, status_msg)
+        except GradingSuperseded:
+            await report_result(status_msg.edit_text, job, dict(SUPERSEDED))
+        except GradingQueueFull:
+            await status_msg.edit_text("⏳ 지금 채점 요청이 많습니다. 잠시 후 다시 보내주세요.")
+        return
+
+    persistence = application.persistence
+    job_id = persistence.add_pending_job(job) if isinstance(persistence, SqlitePersistence) else None
+    trace = Trace("grading", chat_id=job["chat_id"])
+    status = "error"
+    try:
+        # One grading at a time per chat, in order; a re-recording of the same sentence replaces a waiting one
+        async with grading_pool.chat_turn(job["chat_id"], job["ref_text"], turn=turn):
+            async with grading_pool.slot():
+                trace.mark("queue_wait")
+                status = await grade_voice(application.bot, job, status_msg, trace)
+    except GradingSuperseded:
+        status = await report_result(status_msg.edit_text, job, dict(SUPERSEDED), trace)
+    except GradingQueueFull:
+        status = "rejected"
+        logging.warning(f"Grading queue full ({grading_pool.pending} pending)")
+        await status_msg.edit_text("⏳ 지금 채점 요청이 많습니다. 잠시 후 다시 보내주세요.")
+    finally:
+        trace.log(status=status)
+        if job_id:
+            persistence.remove_pending_job(job_id)
+
+async def queue_grading_job(job, status_msg):
+    """
+    Sharded mode: hands the submission to the worker processes; deliver_grading_results posts it.
+    SQLite calls run on grading_pool, since workers writing to the queue can make them wait.
+    """
+    limit = int(os.getenv("SHARDED_QUEUE_LIMIT", "200"))
+    if await grading_pool.run(grading_queue.depth) >= limit:
+        logging.warning(f"Grading queue full ({limit} queued)")
+        await status_msg.edit_text("⏳ 지금 채점 요청이 많습니다. 잠시 후 다시 보내주세요.")
+        return
+    if job["ref_text"]:
+        # Same sentence re-recorded: the waiting one is answered with SUPERSEDED by deliver_grading_results
+        await grading_pool.run(grading_queue.supersede, job["chat_id"], job["ref_text"], SUPERSEDED)
+    await grading_pool.run(grading_queue.submit, {**job, "message_id": status_msg.message_id, "submitted_at": time.time()})
+
+async def deliver_grading_results(context: ContextTypes.DEFAULT_TYPE):
+    """Posts results finished by the grading workers (runs every RESULT_POLL_INTERVAL seconds)."""
+    for job_id, job, res in await grading_pool.run(grading_queue.take_results):
+        edit = functools.partial(context.bot.edit_message_text, chat_id=job["chat_id"], message_id=job["message_id"])
+        try:
+            status = await report_result(edit, job, res)
+        except (RetryAfter, NetworkError) as e:
+            # Flood limit or network trouble: keep the result and post it on a later round
+            logging.warning(f"Delaying grading result {job_id} for {job['chat_id']}: {e}")
+            await grading_pool.run(grading_queue.release_result, job_id)
+            continue
         except Exception as e:
-            logging.error(f"Conversion Error: {e}")
-            await status_msg.edit_text("⚠️ 오디오 변환 실패. 서버에 ffmpeg가 설치되어 있는지 확인해주세요.")
-            return
-            
-        # 4. Grade using Azure
-        key = os.getenv("AZURE_SPEECH_KEY")
-        region = os.getenv("AZURE_SPEECH_REGION")
-        
-        if not key or not region:
-             await status_msg.edit_text("⚠️ 서버 설정 오류: Azure Key/Region이 설정되지 않았습니다.")
-             return
+            status = "error"
+            logging.error(f"Failed to deliver grading result {job_id} to {job['chat_id']}: {e}")
+        await grading_pool.run(grading_queue.mark_delivered, job_id)
+        observe("grading_total", time.time() - job["submitted_at"], status)
 
-        grader = AzureGrader(key, region)
+async def purge_grading_queue(context: ContextTypes.DEFAULT_TYPE):
+    await grading_pool.run(grading_queue.purge)
+
+async def resume_pending_gradings(context: ContextTypes.DEFAULT_TYPE):
+    """재시작 전에 끝나지 못한 채점을 이어서 처리 (context.job.data: jobs taken before polling started)"""
+    jobs = context.job.data or []
+    if jobs:
+        logging.info(f"Resuming {len(jobs)} unfinished gradings")
+    for job in jobs:
+        try:
+            status_msg = await context.bot.send_message(chat_id=job["chat_id"], text="🔄 서버가 재시작되어 채점을 이어갑니다...")
+        except Exception as e:
+            logging.error(f"Failed to resume grading for {job['chat_id']}: {e}")
+            continue
+        context.application.create_task(run_grading_job(context.application, job, status_msg))
+
+async def grade_voice(bot, job, status_msg, trace=None):
+    """
+    Downloads, converts and grades a voice message. Blocking steps run on grading_pool.
+    Returns the outcome ("success", "no_match", "error") for logging.
+    """
+    trace = trace or Trace("grading", chat_id=job["chat_id"])
+    ref_text = job["ref_text"]
+    candidates = job["candidates"]
+    try:
+        # Long-lived grader: one SpeechConfig and pre-connected recognizers for every grading
+        grader = get_grader()
+        if grader is None:
+             await status_msg.edit_text("⚠️ 서버 설정 오류: Azure Key/Region이 설정되지 않았습니다.")
+             return "error"
         
-        # 4-1. Match Candidate if ref_text is missing
+        # Match Candidate if ref_text is missing (one Speech session for both)
         if not ref_text:
+            if not candidates:
+                await status_msg.edit_text("⚠️ 비교할 숙제 목록이 없습니다.")
+                return "error"
             status_msg = await status_msg.edit_text("🎧 문장 확인 중...")
+
+        # Resent voice note: answered from the cache on either path, before any download
+        reference = ref_text or list(candidates)
+        cached = grader.cached_for_file(job.get("file_unique_id"), reference)
+        if cached is not None:
+            logging.info(f"Grading cache hit for file {job['file_unique_id']}, skipping download and Speech call.")
+            return await report_result(status_msg.edit_text, job, cached, trace)
+
+        # 2. Streaming: recognition starts while the file is still downloading
+        streamed = await stream_grade_voice(bot, job, grader, trace) if streaming_enabled() and grader.supports_streaming else None
+
+        if streamed is not None:
+            res, pcm = streamed
+        else:
+            # 3. Buffered: download, decode OGG/Opus to 16kHz mono PCM in memory, then grade
+            with trace.stage("download"):
+                voice_file = await bot.get_file(job["file_id"])
+                ogg_bytes = await voice_file.download_as_bytearray()
             
-            # Recognize simple text first
-            spoken_text = grader.recognize_simple(wav_path)
-            
-            if spoken_text:
-                candidates = context.user_data.get('homework_candidates', [])
-                if candidates:
-                    # Find best match
-                    matches = difflib.get_close_matches(spoken_text, candidates, n=1, cutoff=0.1) # cutoff 0.1 is very loose, we want 'best'
-                    if matches:
-                        ref_text = matches[0]
-                        await status_msg.edit_text(f"💡 인식된 문장: \"{ref_text}\" 로 평가합니다.")
-                    else:
-                        # If no match found, maybe just pick the first one? Or fail?
-                        # Let's pick the first one as fallback to give SOME feedack
-                        ref_text = candidates[0]
-                        await status_msg.edit_text(f"❓ 문장을 찾지 못해 첫 번째 숙제로 평가합니다: \"{ref_text}\"")
-                else:
-                     await status_msg.edit_text("⚠️ 비교할 숙제 목록이 없습니다.")
-                     return
-            else:
-                 await status_msg.edit_text("⚠️ 음성을 명확히 인식하지 못했습니다.")
-                 return
-
-        res = grader.grade(wav_path, ref_text)
-        
-        # 5. Send Result
-        if res['status'] == 'success':
-            s = res['scores']
-            
-            # Format Score Message
-            score_emoji = "🏆" if s['pronunciation'] >= 90 else ("🙂" if s['pronunciation'] >= 70 else "💪")
-            
-            msg = (f"{score_emoji} **평가 결과**\n"
-                   f"📊 종합 점수: **{s['pronunciation']:.0f}점**\n\n"
-                   f"🎯 정확도: {s['accuracy']:.0f} | 🌊 유창성: {s['fluency']:.0f}\n"
-                   f"🧩 완결성: {s['completeness']:.0f}\n\n"
-                   f"📝 인식된 발음:\n\"{res['recognized_text']}\"")
-            
-            # Error Highlights
-            errors = [w for w in res['word_details'] if w['error_type'] != 'None']
-            if errors:
-                msg += "\n\n⚠️ **피드백**:"
-                for e in errors:
-                    etype = e['error_type']
-                    if etype == "Mispronunciation": etype = "❌ 발음"
-                    elif etype == "Omission": etype = "🗑 누락"
-                    elif etype == "Insertion": etype = "➕ 추임새"
-                    msg += f"\n- {e['word']}: {etype}"
-            
-            await status_msg.edit_text(msg, parse_mode='Markdown')
-            
-            # 6. Save Score to Google Sheet
             try:
-                user_manager = UserManager()
-                chat_id = update.effective_chat.id
-                pronunciation_score = s['pronunciation']
-                user_manager.update_user_score(chat_id, pronunciation_score)
-                logging.info(f"Updated score for {chat_id}: {pronunciation_score}")
+                with trace.stage("decode"):
+                    pcm, trimmed = await grading_pool.run(prepare_pcm, ogg_bytes, "ogg")
+                
             except Exception as e:
-                logging.error(f"Failed to save score: {e}")
-            
-        else:
-             await status_msg.edit_text(f"😥 평가 실패: {res.get('message', 'Unknown Error')}")
+                logging.error(f"Conversion Error: {e}")
+                await status_msg.edit_text("⚠️ 오디오 변환 실패. 서버에 soundfile(libsndfile) 또는 ffmpeg가 설치되어 있는지 확인해주세요.")
+                return "error"
+
+            trace.fields["trimmed"] = f"{trimmed:.2f}s"
+            if not pcm:
+                # Nothing but silence: don't spend a Speech call on it
+                return await report_result(status_msg.edit_text, job, dict(NO_SPEECH), trace)
+
+            # 4. Grade using Azure
+            with trace.stage("grade"):
+                res = await grading_pool.run(grade_pcm, grader, pcm, ref_text, candidates)
+
+        grader.remember_file(job.get("file_unique_id"), reference, res)
+
+        # Opt-in archive for re-grading later (ARCHIVE_DIR)
+        archive = get_archive()
+        if archive is not None and res['status'] != 'error':
+            await grading_pool.run(
+                archive.add, pcm, res,
+                source="bot", chat_id=job["chat_id"], ref_text=ref_text, candidates=candidates, grader=grader.name
+            )
+
+        return await report_result(status_msg.edit_text, job, res, trace)
 
     except Exception as e:
         logging.error(f"Bot Error: {e}")
         await status_msg.edit_text("⚠️ 처리 중 오류가 발생했습니다.")
-        
-    finally:
-        # Cleanup
-        if 'ogg_path' in locals() and os.path.exists(ogg_path):
-            os.remove(ogg_path)
-        if 'wav_path' in locals() and os.path.exists(wav_path):
-            os.remove(wav_path)
+        return "error"
+
+async def report_result(edit, job, res, trace=None):
+    """
+    Posts a grading result by editing the status message and saves the score.
+    `edit` is an async callable like Message.edit_text.
+    """
+    trace = trace or Trace("grading", chat_id=job["chat_id"])
+    ref_text = job["ref_text"]
+    if not ref_text and res['status'] == 'success':
+        ref_text = res['reference_text']
+        await edit(f"💡 인식된 문장: \"{ref_text}\" 로 평가합니다.")
+    elif res['status'] == 'no_match':
+        # Don't guess: grading against the wrong sentence gives a misleading score
+        await edit(
+            f"❓ 어느 문장을 읽으셨는지 확실하지 않습니다.\n"
+            f"인식된 발음: \"{res['recognized_text']}\"\n\n"
+            f"읽으신 숙제 문장 메시지에 답장(Reply)으로 음성을 다시 보내주세요."
+        )
+        return "no_match"
+    elif res['status'] == 'superseded':
+        await edit(res['message'])
+        return "superseded"
+
+    # 5. Send Result
+    if res['status'] == 'success':
+        s = res['scores']
+
+        # Format Score Message
+        score_emoji = "🏆" if s['pronunciation'] >= 90 else ("🙂" if s['pronunciation'] >= 70 else "💪")
+
+        msg = (f"{score_emoji} **평가 결과**\n"
+               f"📊 종합 점수: **{format_score(res, 'pronunciation')}점**\n\n"
+               f"🎯 정확도: {format_score(res, 'accuracy')} | 🌊 유창성: {format_score(res, 'fluency')}\n"
+               f"🧩 완결성: {format_score(res, 'completeness')}\n\n"
+               f"📝 인식된 발음:\n\"{res['recognized_text']}\"")
+        if res.get('approximate_scores'):
+            msg += f"\n\n_{APPROXIMATE_NOTE}_"
+
+        # Error Highlights
+        errors = [w for w in res['word_details'] if w['error_type'] != 'None']
+        if errors:
+            msg += "\n\n⚠️ **피드백**:"
+            for e in errors:
+                etype = e['error_type']
+                if etype == "Mispronunciation": etype = "❌ 발음"
+                elif etype == "Omission": etype = "🗑 누락"
+                elif etype == "Insertion": etype = "➕ 추임새"
+                msg += f"\n- {e['word']}: {etype}"
+
+        await edit(msg, parse_mode='Markdown')
+
+        # 6. Save Score to Google Sheet
+        try:
+            with trace.stage("score_write"):
+                record_score(get_user_manager(), job["chat_id"], res)
+            logging.info(f"Updated score for {job['chat_id']}: {s['pronunciation']}")
+        except Exception as e:
+            logging.error(f"Failed to save score: {e}")
+        return "success"
+
+    else:
+         await edit(f"😥 평가 실패: {res.get('message', 'Unknown Error')}")
+         return "error"
+
+async def stream_grade_voice(bot, job, grader, trace):
+    """Grades over the streaming path; returns (result, pcm), or None to fall back to the buffered path."""
+    ref_text, candidates = job["ref_text"], job["candidates"]
+    try:
+        url = await file_url(bot, job["file_id"])
+        if not url:
+            return None
+        sink = grader.open_stream()
+        gate = SilenceGate()
+        with trace.stage("stream_grade"):
+            res, _ = await stream_and_grade(
+                grading_pool.run, url, sink,
+                lambda audio: grade_pcm(grader, audio, ref_text, candidates),
+                gate
+            )
+    except Exception as e:
+        logging.warning(f"Streaming grading failed, falling back to buffered download: {e}")
+        return None
+
+    observe_trimmed(gate.trimmed_seconds)
+    trace.fields["trimmed"] = f"{gate.trimmed_seconds:.2f}s"
+    if not gate.has_speech:
+        # The recognizer only got an empty stream; report silence instead of its NoMatch
+        return dict(NO_SPEECH), b""
+
+    grader.remember(sink.pcm, ref_text or list(candidates), res)
+    return res, bytes(sink.pcm)
+
+async def close_http_clients(application):
+    await close_client()
+    await close_async_clients()
+
+def run_webhook_mode(app):
+    """
+    Receives updates over HTTPS push instead of getUpdates polling.
+
+    WEBHOOK_URL is the public base URL; if unset, the trycloudflare URL is read
+    from the cloudflared log (CF_LOG_FILE) written by the tunnel scripts, e.g.
+    `python run_cf.py 8443`. Telegram signs requests with WEBHOOK_SECRET.
+    """
+    port = int(os.getenv("WEBHOOK_PORT", "8443"))
+    base_url = os.getenv("WEBHOOK_URL")
+    if not base_url:
+        base_url, _ = find_tunnel_url(os.getenv("CF_LOG_FILE", "cf_new.log"), timeout=30)
+        if not base_url:
+            print("❌ Error: WEBHOOK_URL is not set and no tunnel URL was found in the cloudflared log")
+            exit(1)
+
+    # Telegram accepts A-Z, a-z, 0-9, _ and - in the secret token
+    secret = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    url_path = os.getenv("WEBHOOK_PATH", "telegram")
+
+    print(f"🌍 Webhook: {base_url.rstrip('/')}/{url_path} -> localhost:{port}")
+    app.run_webhook(
+        listen=os.getenv("WEBHOOK_LISTEN", "127.0.0.1"),
+        port=port,
+        url_path=url_path,
+        webhook_url=f"{base_url.rstrip('/')}/{url_path}",
+        secret_token=secret,
+        max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+        allowed_updates=Update.ALL_TYPES
+    )
 
 if __name__ == '__main__':
     load_dotenv()
@@ -365,14 +539,34 @@ if __name__ == '__main__':
         print("❌ Error: TELEGRAM_TOKEN is missing in .env")
         exit(1)
         
-    app = ApplicationBuilder().token(token).build()
+    # Webhook mode: BOT_MODE=webhook (see run_webhook_mode); default is long polling
+    mode = os.getenv("BOT_MODE", "polling").lower()
+    
+    # Keeps user_data (homework candidates) and unfinished gradings across restarts
+    persistence = SqlitePersistence(os.getenv("BOT_STATE_DB", "bot_state.db"))
+    # Taken now, before any update arrives, so live submissions are never resumed as leftovers
+    leftover_jobs = persistence.pop_pending_jobs(max_age=3600, created_before=time.time())
+    builder = ApplicationBuilder().token(token).persistence(persistence).post_shutdown(close_http_clients)
+    
+    # Bounded number of updates processed at the same time
+    concurrent_updates = os.getenv("CONCURRENT_UPDATES", "32" if mode == "webhook" else "")
+    if concurrent_updates:
+        builder = builder.concurrent_updates(int(concurrent_updates))
+    app = builder.build()
+    
+    # Prometheus-style /metrics on METRICS_PORT (off when unset)
+    start_metrics_server()
+    
+    # Open the Speech connections now so the first grading doesn't pay for it
+    get_grader()
     
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("homework", send_homework_now))
     app.add_handler(CommandHandler("setday", set_day))
     app.add_handler(CommandHandler("set", set_day))
     app.add_handler(CommandHandler("myinfo", my_info))
-    app.add_handler(MessageHandler(filters.VOICE, handle_voice))
+    # block=False: gradings run as tasks so commands and other chats stay responsive
+    app.add_handler(MessageHandler(filters.VOICE, handle_voice, block=False))
     
     # Scheduler Setup
     job_queue = app.job_queue
@@ -381,8 +575,22 @@ if __name__ == '__main__':
     target_time = datetime.time(hour=20, minute=0, second=0, tzinfo=KST)
     job_queue.run_repeating(run_daily_homework, interval=86400, first=target_time)
     
-    # 2. Startup Test (10 seconds after start)
+    # 2. Resume gradings interrupted by the last shutdown
+    job_queue.run_once(resume_pending_gradings, when=1, data=leftover_jobs)
+    
+    # Sharded deployment: grading runs in grading_worker.py processes (DEPLOY_MODE=sharded)
+    if os.getenv("DEPLOY_MODE", "single").lower() == "sharded":
+        grading_queue = SqliteJobQueue()
+        register_gauge("jdoit_grading_queue_depth", "Jobs queued or leased in the sharded grading queue.", grading_queue.depth)
+        job_queue.run_repeating(deliver_grading_results, interval=float(os.getenv("RESULT_POLL_INTERVAL", "0.5")), first=1)
+        job_queue.run_repeating(purge_grading_queue, interval=3600, first=60)
+    
+    # 3. Startup Test (10 seconds after start)
     job_queue.run_once(test_scheduler_job, when=10)
     
-    print(f"🤖 Telegram Bot Started... (Daily Job at {target_time})")
-    app.run_polling()
+    print(f"🤖 Telegram Bot Started... (Daily Job at {target_time}, mode: {mode})")
+    if mode == "webhook":
+        run_webhook_mode(app)
+    else:
+        app.run_polling()
+    grading_pool.shutdown()
@@ -1,34 +1,93 @@
-
 import streamlit as st
 import os
-import tempfile
 import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import subprocess
-from homework_manager import HomeworkManager
-from user_manager import UserManager
-from azure_stt import AzureGrader
-import difflib
+from pipeline import process_submission, format_score, APPROXIMATE_NOTE
+from registry import get_grader, get_user_manager, get_homework_manager, get_archive
 
 # 1. Init & Config
 st.set_page_config(page_title="J-DoIt Speaking Practice", page_icon="🎤")
-load_dotenv()
-
-# Initialize Managers
-if 'user_manager' not in st.session_state:
-    st.session_state.user_manager = UserManager()
-if 'hw_manager' not in st.session_state:
-    st.session_state.hw_manager = HomeworkManager()
 
-# Azure Config
-AZURE_KEY = os.getenv("AZURE_SPEECH_KEY")
-AZURE_REGION = os.getenv("AZURE_SPEECH_REGION")
+# Everything below survives reruns: the script re-executes on every widget
+# interaction, but config, managers, the grader and homework are built once.
+
+@st.cache_resource
+def load_config():
+    load_dotenv()
+    # Fallback to Streamlit Secrets if env vars are missing
+    key = os.getenv("AZURE_SPEECH_KEY") or st.secrets.get("AZURE_SPEECH_KEY")
+    region = os.getenv("AZURE_SPEECH_REGION") or st.secrets.get("AZURE_SPEECH_REGION")
+    return key, region
+
+@st.cache_resource
+def load_managers():
+    return get_user_manager(), get_homework_manager()
+
+@st.cache_resource
+def load_grader(key, region):
+    # Long-lived grader with warm recognizers (None when no grader is configured)
+    return get_grader(key, region)
+
+@st.cache_resource
+def grading_executor():
+    # Gradings run here, so a rerun mid-grading doesn't cancel or repeat the Speech call
+    return ThreadPoolExecutor(max_workers=int(os.getenv("GRADING_WORKERS", "4")), thread_name_prefix="web-grading")
+
+@st.cache_data(ttl=float(os.getenv("HOMEWORK_CACHE_TTL", "300")), show_spinner=False)
+def load_homework(day):
+    return load_managers()[1].get_homework(day=day)
+
+def submit_grading(audio_bytes, candidates):
+    """Starts grading in the background; returns the Future (one per recording)."""
+    grader = load_grader(AZURE_KEY, AZURE_REGION)
+    return grading_executor().submit(
+        process_submission, audio_bytes, grader, None, list(candidates),
+        chat_id=st.session_state.get("user_id"), archive=get_archive(), source="web"
+    )
+
+# Recordings whose results are kept for re-rendering, per session
+RESULTS_HISTORY = 20
+
+@st.fragment(run_every=1.0)
+def wait_for_grading(future):
+    """Polls the grading without holding the script thread; reruns the page once it is done."""
+    if future.done():
+        st.rerun()
+    st.info("🎧 채점 중입니다... 잠시만 기다려주세요.")
+
+def collect_result(future):
+    try:
+        return future.result()
+    except Exception as e:
+        # Decode failures come back as error results (see process_submission); this is the grader
+        return {"status": "error", "message": f"채점 서버 오류: {e}"}
+
+def show_result(res):
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("종합 점수", format_score(res, 'pronunciation'), delta_color="normal")
+    col2.metric("정확도", format_score(res, 'accuracy'))
+    col3.metric("유창성", format_score(res, 'fluency'))
+    col4.metric("완결성", format_score(res, 'completeness'))
+    if res.get('approximate_scores'):
+        st.caption(APPROXIMATE_NOTE)
+    
+    # Feedback
+    errors = [w for w in res['word_details'] if w['error_type'] != 'None']
+    if errors:
+        st.warning("🧐 **피드백**")
+        for e in errors:
+            etype = e['error_type']
+            if etype == "Mispronunciation": etype = "❌ 발음"
+            elif etype == "Omission": etype = "🗑 누락"
+            elif etype == "Insertion": etype = "➕ 추임새"
+            st.write(f"- **{e['word']}**: {etype}")
+    else:
+        st.success("완벽합니다! 👏")
 
-# Fallback to Streamlit Secrets if env vars are missing
-if not AZURE_KEY and "AZURE_SPEECH_KEY" in st.secrets:
-    AZURE_KEY = st.secrets["AZURE_SPEECH_KEY"]
-if not AZURE_REGION and "AZURE_SPEECH_REGION" in st.secrets:
-    AZURE_REGION = st.secrets["AZURE_SPEECH_REGION"]
+AZURE_KEY, AZURE_REGION = load_config()
+user_manager, _ = load_managers()
 
 # 2. Sidebar - User Login
 st.sidebar.title("🔐 로그인")
@@ -39,7 +98,7 @@ if user_id:
     st.session_state.user_id = user_id
     
     # Get User Progress
-    progress = st.session_state.user_manager.get_user_progress(user_id)
+    progress = user_manager.get_user_progress(user_id)
     current_day = progress.get('current_day', 1)
     
     st.sidebar.success(f"환영합니다! \n현재 진도: **Day {current_day}**")
@@ -53,7 +112,7 @@ else:
 st.title(f"📅 Day {current_day} 연습하기")
 
 # Fetch Homework
-hw_list = st.session_state.hw_manager.get_homework(day=current_day)
+hw_list = load_homework(current_day)
 
 if not hw_list:
     st.success("🎉 모든 과정을 수료하셨습니다! 더 이상 숙제가 없습니다.")
@@ -79,85 +138,46 @@ st.write("위 문장 중 하나를 골라 읽어주세요.")
 audio_value = st.audio_input("녹음하기 (마이크 아이콘 클릭)")
 
 if audio_value:
-    # Save raw audio to temp file
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_audio:
-        tmp_audio.write(audio_value.read())
-        raw_path = tmp_audio.name
-
-    # Convert to 16k Mono WAV using ffmpeg (Azure requirement)
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as converted_audio:
-        tmp_filename = converted_audio.name
-    
-    try:
-        subprocess.run(["ffmpeg", "-i", raw_path, "-ac", "1", "-ar", "16000", tmp_filename, "-y"], check=True)
-    except Exception as e:
-        st.error(f"Audio conversion failed: {e}")
-        tmp_filename = raw_path # Fallback
-    finally:
-        if os.path.exists(raw_path):
-            os.remove(raw_path)
-
-    # Grade
-    if not AZURE_KEY or not AZURE_REGION:
-        st.error("Azure 설정이 되어있지 않습니다. .env 파일을 확인해주세요.")
+    audio_bytes = audio_value.getvalue()
+    audio_hash = hashlib.sha256(audio_bytes).hexdigest()
+    # Results by recording, so reruns only re-render
+    results = st.session_state.setdefault("results", {})
+    pending = st.session_state.setdefault("pending_gradings", {})
+
+    if audio_hash not in results:
+        # Azure, or the offline engine when only LOCAL_ASR_MODEL is configured
+        if load_grader(AZURE_KEY, AZURE_REGION) is None:
+            st.error("Azure 설정이 되어있지 않습니다. .env 파일을 확인해주세요.")
+            st.stop()
+
+        if audio_hash not in pending:
+            pending[audio_hash] = submit_grading(audio_bytes, candidates)
+
+        future = pending[audio_hash]
+        if not future.done():
+            wait_for_grading(future)
+            st.stop()
+
+        res = collect_result(pending.pop(audio_hash))
+        results[audio_hash] = res
+        while len(results) > RESULTS_HISTORY:
+            results.pop(next(iter(results)))
+
+        if res['status'] == 'success':
+            # Update User Score & Progress once per recording
+            user_manager.update_user_score(user_id, res['scores']['pronunciation'])
+            user_manager.advance_user_day(user_id)
+            st.toast("진도가 업데이트되었습니다! 내일 또 만나요 👋")
+            time.sleep(2)
+            st.rerun()
+
+    res = results[audio_hash]
+    if res['status'] == 'success':
+        st.info(f"💡 인식된 문장: **{res['reference_text']}**")
+        show_result(res)
+        
+    elif res['status'] == 'no_match':
+        st.warning(f"⚠️ 어느 문장을 읽으셨는지 확실하지 않습니다. (인식: \"{res['recognized_text']}\")\n\n위 문장 중 하나를 정확히 읽고 다시 녹음해주세요.")
+
     else:
-        with st.spinner("🎧 채점 중입니다... 잠시만 기다려주세요."):
-            grader = AzureGrader(AZURE_KEY, AZURE_REGION)
-            
-            # 1. Recognize Text first to match homework
-            spoken_text = grader.recognize_simple(tmp_filename)
-            
-            target_text = None
-            if spoken_text:
-                matches = difflib.get_close_matches(spoken_text, candidates, n=1, cutoff=0.1)
-                if matches:
-                    target_text = matches[0]
-                    st.info(f"💡 인식된 문장: **{target_text}**")
-                else:
-                    st.warning("⚠️ 문장을 찾지 못했습니다. 첫 번째 문장으로 평가합니다.")
-                    target_text = candidates[0]
-            else:
-                st.error("목소리가 잘 들리지 않습니다. 다시 녹음해주세요.")
-                target_text = candidates[0] # Fallback
-            
-            # 2. Detailed Grading
-            res = grader.grade(tmp_filename, target_text)
-
-            if res['status'] == 'success':
-                scores = res['scores']
-                final_score = scores['pronunciation']
-                
-                # Update User Score & Progress
-                st.session_state.user_manager.update_user_score(user_id, final_score)
-                st.session_state.user_manager.advance_user_day(user_id)
-                
-                # UI Result
-                col1, col2, col3, col4 = st.columns(4)
-                col1.metric("종합 점수", f"{final_score:.0f}", delta_color="normal")
-                col2.metric("정확도", f"{scores['accuracy']:.0f}")
-                col3.metric("유창성", f"{scores['fluency']:.0f}")
-                col4.metric("완결성", f"{scores['completeness']:.0f}")
-                
-                # Feedback
-                errors = [w for w in res['word_details'] if w['error_type'] != 'None']
-                if errors:
-                    st.warning("🧐 **피드백**")
-                    for e in errors:
-                        etype = e['error_type']
-                        if etype == "Mispronunciation": etype = "❌ 발음"
-                        elif etype == "Omission": etype = "🗑 누락"
-                        elif etype == "Insertion": etype = "➕ 추임새"
-                        st.write(f"- **{e['word']}**: {etype}")
-                else:
-                    st.success("완벽합니다! 👏")
-                    
-                st.toast("진도가 업데이트되었습니다! 내일 또 만나요 👋")
-                time.sleep(2)
-                st.rerun()
-                
-            else:
-                st.error(f"평가 실패: {res.get('message')}")
-            
-    # Cleanup
-    if os.path.exists(tmp_filename):
-        os.remove(tmp_filename)
+        st.error(f"평가 실패: {res.get('message')}")
@@ -0,0 +1,104 @@
+import os
+import asyncio
+import logging
+import httpx
+import google.auth.transport.requests
+import sheets_auth
+
+SHEETS_API = "https://sheets.googleapis.com/v4/spreadsheets"
+DRIVE_API = "https://www.googleapis.com/drive/v3/files"
+
+class AsyncSheetsClient:
+    """
+    Minimal asyncio Google Sheets client for reads made from bot handlers.
+
+    gspread blocks the event loop for the whole HTTP round trip. This client
+    keeps one keep-alive httpx.AsyncClient and limits concurrent requests with
+    a semaphore (SHEETS_MAX_CONCURRENCY), so sheet reads overlap with Telegram
+    I/O. Quota (429) and server errors are retried with exponential backoff,
+    like SheetWriteBuffer.
+    """
+
+    RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, credentials=None, max_concurrency=None, timeout=30.0, max_retries=4):
+        self.credentials = credentials or sheets_auth.load_credentials()
+        self.max_concurrency = max_concurrency or int(os.getenv("SHEETS_MAX_CONCURRENCY", "4"))
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._spreadsheet_ids = {}  # title -> id
+
+        # Created lazily so they bind to the running loop
+        self._client = None
+        self._semaphore = None
+        self._token_lock = None
+
+    def _get_client(self):
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._token_lock = asyncio.Lock()
+        return self._client
+
+    async def _auth_header(self):
+        if not self.credentials.valid:
+            async with self._token_lock:
+                if not self.credentials.valid:
+                    # google-auth refreshes synchronously; keep it off the loop
+                    await asyncio.to_thread(self.credentials.refresh, google.auth.transport.requests.Request())
+        return {"Authorization": f"Bearer {self.credentials.token}"}
+
+    async def _request(self, method, url, **kwargs):
+        client = self._get_client()
+        delay = 1.0
+        for attempt in range(1, self.max_retries + 1):
+            headers = await self._auth_header()
+            async with self._semaphore:
+                response = await client.request(method, url, headers=headers, **kwargs)
+            if response.status_code not in self.RETRYABLE_STATUS or attempt == self.max_retries:
+                response.raise_for_status()
+                return response.json()
+            logging.warning(f"Sheets API error {response.status_code}, retrying in {delay:.0f}s ({attempt}/{self.max_retries})")
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    async def spreadsheet_id(self, title):
+        """Looks a spreadsheet up by title (like gspread's client.open) and remembers its id."""
+        if title not in self._spreadsheet_ids:
+            escaped = title.replace("\\", "\\\\").replace("'", "\\'")
+            data = await self._request("GET", DRIVE_API, params={
+                "q": f"name = '{escaped}' and mimeType = 'application/vnd.google-apps.spreadsheet' and trashed = false",
+                "fields": "files(id,name)",
+                "includeItemsFromAllDrives": "true",
+                "supportsAllDrives": "true"
+            })
+            files = data.get("files", [])
+            if not files:
+                raise LookupError(f"Spreadsheet not found: {title}")
+            self._spreadsheet_ids[title] = files[0]["id"]
+        return self._spreadsheet_ids[title]
+
+    async def get_values(self, spreadsheet_id, range_name):
+        """Returns the cell values of `range_name` (e.g. "Homework") as a list of rows."""
+        data = await self._request(
+            "GET", f"{SHEETS_API}/{spreadsheet_id}/values/{range_name}",
+            params={"valueRenderOption": "UNFORMATTED_VALUE", "majorDimension": "ROWS"}
+        )
+        return data.get("values", [])
+
+    async def get_all_records(self, spreadsheet_id, worksheet):
+        """Rows of a worksheet as dicts keyed by the header row, like gspread's get_all_records()."""
+        values = await self.get_values(spreadsheet_id, worksheet)
+        if not values:
+            return []
+        header, rows = values[0], values[1:]
+        return [
+            {key: (row[i] if i < len(row) else "") for i, key in enumerate(header)}
+            for row in rows
+        ]
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
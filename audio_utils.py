@@ -0,0 +1,323 @@
+import io
+import os
+import wave
+import struct
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Azure Speech expects 16kHz, 16bit, mono PCM
+TARGET_RATE = 16000
+SAMPLE_WIDTH = 2
+CHANNELS = 1
+
+# Energy VAD: 20ms frames louder than VAD_THRESHOLD_DBFS count as speech
+VAD_FRAME = TARGET_RATE * 20 // 1000
+VAD_THRESHOLD_DBFS = float(os.getenv("VAD_THRESHOLD_DBFS", "-45"))
+# Kept around the speech so soft onsets and word endings survive
+VAD_PADDING_SECONDS = 0.25
+# Clips with less speech than this are rejected before grading
+MIN_SPEECH_SECONDS = 0.2
+
+try:
+    import soundfile as sf
+except ImportError:  # soundfile (libsndfile >= 1.0.29) decodes Ogg/Opus in-process
+    sf = None
+
+try:
+    import opuslib
+except Exception:  # opuslib (needs libopus) enables the streaming voice path
+    opuslib = None
+
+
+def detect_format(data):
+    """Guesses the container from the first bytes ('ogg', 'wav' or None)."""
+    if data[:4] == b"OggS":
+        return "ogg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return "wav"
+    return None
+
+
+def decode_audio(data, fmt=None):
+    """
+    Decodes an in-memory voice note (Telegram OGG/Opus or browser WAV) to
+    16kHz mono 16bit PCM bytes. Nothing is written to disk.
+
+    :param data: Raw file bytes
+    :param fmt: 'ogg' or 'wav'; detected from the header when omitted
+    """
+    data = bytes(data)
+    fmt = fmt or detect_format(data)
+
+    samples, rate = None, None
+    if fmt == "wav":
+        try:
+            samples, rate = _read_wav(data)
+        except (wave.Error, ValueError) as e:
+            # e.g. float WAV, which the wave module does not support
+            logger.info(f"wave module could not read input ({e}), trying soundfile")
+
+    if samples is None:
+        samples, rate = _read_with_soundfile(data)
+
+    samples = to_mono(samples)
+    samples = resample(samples, rate, TARGET_RATE)
+    return samples.astype("<i2").tobytes()
+
+
+def _read_wav(data):
+    with wave.open(io.BytesIO(data), "rb") as wf:
+        width = wf.getsampwidth()
+        channels = wf.getnchannels()
+        rate = wf.getframerate()
+        frames = wf.readframes(wf.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype="<i2")
+    elif width == 4:
+        samples = (np.frombuffer(frames, dtype="<i4") >> 16).astype(np.int16)
+    else:
+        raise ValueError(f"Unsupported sample width: {width}")
+
+    return samples.reshape(-1, channels), rate
+
+
+def _read_with_soundfile(data):
+    if sf is not None:
+        samples, rate = sf.read(io.BytesIO(data), dtype="int16", always_2d=True)
+        return samples, rate
+
+    # Fallback: pydub pipes the bytes through ffmpeg (no temp files, but one subprocess)
+    from pydub import AudioSegment
+    logger.warning("soundfile is not installed; falling back to pydub/ffmpeg for decoding")
+    sound = AudioSegment.from_file(io.BytesIO(data))
+    sound = sound.set_sample_width(SAMPLE_WIDTH)
+    samples = np.frombuffer(sound.raw_data, dtype="<i2").reshape(-1, sound.channels)
+    return samples, sound.frame_rate
+
+
+def to_mono(samples):
+    """Averages a (frames, channels) array down to one channel."""
+    if samples.ndim == 1:
+        return samples
+    if samples.shape[1] == 1:
+        return samples[:, 0]
+    return samples.mean(axis=1).astype(np.int16)
+
+
+def resample(samples, src_rate, dst_rate=TARGET_RATE):
+    """Resamples int16 mono samples with a box low-pass plus linear interpolation."""
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+
+    signal = samples.astype(np.float32)
+    ratio = src_rate / dst_rate
+    if ratio > 1:
+        # Cheap anti-aliasing before decimating
+        width = int(round(ratio))
+        if width > 1:
+            signal = np.convolve(signal, np.ones(width, dtype=np.float32) / width, mode="same")
+
+    n_out = int(len(signal) * dst_rate / src_rate)
+    positions = np.arange(n_out, dtype=np.float64) * (src_rate / dst_rate)
+    out = np.interp(positions, np.arange(len(signal)), signal)
+    return np.clip(out, -32768, 32767).astype(np.int16)
+
+
+def pcm_duration(pcm):
+    """Length in seconds of 16kHz mono 16bit PCM bytes."""
+    return len(pcm) / (TARGET_RATE * SAMPLE_WIDTH * CHANNELS)
+
+
+def speech_frames(samples, threshold_dbfs=None):
+    """Per-frame speech mask (VAD_FRAME samples each) of int16 mono samples; a trailing partial frame is ignored."""
+    threshold = VAD_THRESHOLD_DBFS if threshold_dbfs is None else threshold_dbfs
+    n_frames = len(samples) // VAD_FRAME
+    frames = np.asarray(samples[:n_frames * VAD_FRAME], dtype=np.float32).reshape(n_frames, VAD_FRAME)
+    rms = np.sqrt(np.mean(np.square(frames / 32768.0), axis=1))
+    return 20 * np.log10(rms + 1e-10) > threshold
+
+
+def trim_silence(pcm, padding=VAD_PADDING_SECONDS):
+    """
+    Cuts leading and trailing silence from 16kHz mono 16bit PCM bytes.
+    Returns (pcm, trimmed seconds); the pcm is empty when the clip holds
+    less than MIN_SPEECH_SECONDS of speech.
+    """
+    samples = np.frombuffer(bytes(pcm), dtype="<i2")
+    voiced = np.flatnonzero(speech_frames(samples))
+    if len(voiced) * VAD_FRAME < MIN_SPEECH_SECONDS * TARGET_RATE:
+        return b"", pcm_duration(pcm)
+
+    pad = int(padding * TARGET_RATE)
+    start = max(0, voiced[0] * VAD_FRAME - pad)
+    end = min(len(samples), (voiced[-1] + 1) * VAD_FRAME + pad)
+    return samples[start:end].tobytes(), (len(samples) - (end - start)) / TARGET_RATE
+
+
+class SilenceGate:
+    """
+    Streaming counterpart of trim_silence: feed() decoded PCM as it arrives
+    and get back only what should be sent on. Leading silence is dropped and
+    silence after speech is held back until more speech follows, so trailing
+    silence never reaches the recognizer. Call flush() at the end of the stream.
+    """
+
+    def __init__(self, padding=VAD_PADDING_SECONDS):
+        self._pad_bytes = int(padding * TARGET_RATE) * SAMPLE_WIDTH
+        self._partial = b""          # less than one frame, waiting for more samples
+        self._held = bytearray()     # silence since the last speech frame (or the start)
+        self.started = False
+        self.speech_seconds = 0.0
+        self.trimmed_seconds = 0.0
+
+    @property
+    def has_speech(self):
+        return self.speech_seconds >= MIN_SPEECH_SECONDS
+
+    def _drop(self, n_bytes):
+        self.trimmed_seconds += n_bytes / (TARGET_RATE * SAMPLE_WIDTH)
+
+    def feed(self, pcm):
+        data = self._partial + bytes(pcm)
+        usable = len(data) - len(data) % (VAD_FRAME * SAMPLE_WIDTH)
+        frames, self._partial = data[:usable], data[usable:]
+        if not frames:
+            return b""
+
+        voiced = np.flatnonzero(speech_frames(np.frombuffer(frames, dtype="<i2")))
+        out = b""
+        if len(voiced):
+            self.speech_seconds += len(voiced) * VAD_FRAME / TARGET_RATE
+            end = (voiced[-1] + 1) * VAD_FRAME * SAMPLE_WIDTH
+            out = bytes(self._held) + frames[:end]
+            if not self.started:
+                # Leading silence: keep only the padding before the first speech frame
+                first = len(self._held) + voiced[0] * VAD_FRAME * SAMPLE_WIDTH
+                keep_from = max(0, first - self._pad_bytes)
+                self._drop(keep_from)
+                out = out[keep_from:]
+                self.started = True
+            self._held = bytearray(frames[end:])
+        else:
+            self._held += frames
+
+        if not self.started and len(self._held) > self._pad_bytes:
+            excess = len(self._held) - self._pad_bytes
+            self._drop(excess)
+            del self._held[:excess]
+        return out
+
+    def flush(self):
+        """Returns the padding after the last speech; everything else still held is trimmed."""
+        held = bytes(self._held) + self._partial
+        self._held.clear()
+        self._partial = b""
+        if not self.started:
+            self._drop(len(held))
+            return b""
+        self._drop(max(0, len(held) - self._pad_bytes))
+        return held[:self._pad_bytes]
+
+
+class OggPacketReader:
+    """
+    Incremental Ogg demuxer: feed() bytes as they arrive and get back the
+    complete packets of the first logical stream. Pages may be split anywhere.
+    """
+
+    HEADER = struct.Struct("<4sBBqIIIB")  # capture, version, type, granule, serial, seq, crc, segments
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._partial = bytearray()  # packet continued on the next page
+        self._serial = None
+
+    def feed(self, data):
+        self._buffer += data
+        packets = []
+        while True:
+            if len(self._buffer) < self.HEADER.size:
+                break
+            capture, _, _, _, serial, _, _, n_segments = self.HEADER.unpack_from(self._buffer)
+            if capture != b"OggS":
+                raise ValueError("Lost Ogg page sync")
+            table_end = self.HEADER.size + n_segments
+            if len(self._buffer) < table_end:
+                break
+            lacing = self._buffer[self.HEADER.size:table_end]
+            page_end = table_end + sum(lacing)
+            if len(self._buffer) < page_end:
+                break
+
+            if self._serial is None:
+                self._serial = serial
+            if serial == self._serial:
+                offset = table_end
+                for size in lacing:
+                    self._partial += self._buffer[offset:offset + size]
+                    offset += size
+                    if size < 255:
+                        packets.append(bytes(self._partial))
+                        self._partial.clear()
+            del self._buffer[:page_end]
+        return packets
+
+
+class OpusStreamDecoder:
+    """
+    Decodes an Ogg/Opus byte stream chunk by chunk straight to 16kHz mono
+    16bit PCM (libopus resamples internally, so no separate resampling step).
+    Requires opuslib; check OpusStreamDecoder.available() first.
+    """
+
+    # 120ms, the longest Opus frame, at 16kHz
+    MAX_FRAME = TARGET_RATE * 120 // 1000
+
+    def __init__(self):
+        if opuslib is None:
+            raise RuntimeError("opuslib is not installed")
+        self._reader = OggPacketReader()
+        self._decoder = None
+        self._channels = 1
+        self._skip = 0  # pre-skip samples still to drop
+        self._packets = 0
+
+    @staticmethod
+    def available():
+        return opuslib is not None
+
+    def feed(self, data):
+        """Returns the PCM bytes decodable from everything fed so far."""
+        out = []
+        for packet in self._reader.feed(data):
+            self._packets += 1
+            if self._packets == 1:
+                self._read_head(packet)
+                continue
+            if self._packets == 2:
+                continue  # OpusTags
+            out.append(self._decode(packet))
+        return b"".join(out)
+
+    def _read_head(self, packet):
+        if packet[:8] != b"OpusHead":
+            raise ValueError("Not an Ogg/Opus stream")
+        self._channels = packet[9]
+        pre_skip = struct.unpack_from("<H", packet, 10)[0]
+        # Pre-skip is counted at 48kHz
+        self._skip = pre_skip * TARGET_RATE // 48000
+        self._decoder = opuslib.Decoder(TARGET_RATE, self._channels)
+
+    def _decode(self, packet):
+        pcm = self._decoder.decode(packet, self.MAX_FRAME)
+        samples = to_mono(np.frombuffer(pcm, dtype="<i2").reshape(-1, self._channels))
+        if self._skip:
+            dropped = min(self._skip, len(samples))
+            samples = samples[dropped:]
+            self._skip -= dropped
+        return samples.astype("<i2").tobytes()
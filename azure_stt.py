@@ -1,35 +1,263 @@
 
 import os
+import time
+import difflib
+import threading
+import collections
 import azure.cognitiveservices.speech as speechsdk
 import logging
+from matcher import get_matcher, MIN_CONFIDENCE
+from grading_cache import GradingCache
+from grader_base import BaseGrader, MISPRONUNCIATION_THRESHOLD
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class AzureGrader:
-    def __init__(self, speech_key, service_region):
+class PcmPushStream:
+    """
+    16kHz mono 16bit PCM handed to the recognizer while it is still arriving
+    (see streaming.py). Keeps a copy of everything written so the finished
+    result can be cached under the same key as the buffered path.
+    """
+
+    def __init__(self):
+        stream_format = speechsdk.audio.AudioStreamFormat(samples_per_second=16000, bits_per_sample=16, channels=1)
+        self.stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+        self.pcm = bytearray()
+        self.closed = False
+        # Set by RecognizerPool: a recognizer already bound to this stream, and its open connection
+        self.recognizer = None
+        self.connection = None
+        self.warmed_at = None
+
+    def write(self, pcm):
+        if pcm:
+            self.pcm += pcm
+            self.stream.write(bytes(pcm))
+
+    def close(self):
+        """Signals end of audio; the recognizer finishes once it has read everything."""
+        if not self.closed:
+            self.closed = True
+            self.stream.close()
+
+    def discard(self):
+        """Releases an unused warm recognizer."""
+        self.close()
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.recognizer = None
+        self.connection = None
+
+class RecognizerPool:
+    """
+    Keeps a few SpeechRecognizers warm so a grading skips SDK setup and the
+    connection handshake.
+
+    A recognizer is tied to its audio input, so each warm entry is a
+    PcmPushStream with its own recognizer whose connection was opened ahead
+    of time. Entries are single-use: taking one starts a background refill.
+    Entries idle for longer than `max_idle` seconds are dropped, since the
+    service closes idle connections anyway.
+    """
+
+    def __init__(self, speech_config, size=None, max_idle=None):
+        self.speech_config = speech_config
+        self.size = size if size is not None else int(os.getenv("SPEECH_WARM_RECOGNIZERS", "2"))
+        self.max_idle = max_idle or float(os.getenv("SPEECH_WARM_MAX_IDLE", "240"))
+        self._ready = collections.deque()
+        self._lock = threading.Lock()
+        self._filling = False
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        """Warms up the pool in the background."""
+        self._refill()
+
+    def acquire(self):
+        """Returns a warm PcmPushStream, or None if none is ready (build one cold instead)."""
+        now = time.monotonic()
+        warm, stale = None, []
+        with self._lock:
+            while self._ready:
+                entry = self._ready.popleft()
+                if now - entry.warmed_at <= self.max_idle:
+                    warm = entry
+                    break
+                stale.append(entry)
+            if warm is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        for entry in stale:
+            entry.discard()
+        self._refill()
+        return warm
+
+    def _refill(self):
+        with self._lock:
+            if self._filling or self.size <= 0 or len(self._ready) >= self.size:
+                return
+            self._filling = True
+        threading.Thread(target=self._fill, name="speech-warmup", daemon=True).start()
+
+    def _fill(self):
+        try:
+            while True:
+                with self._lock:
+                    if len(self._ready) >= self.size:
+                        return
+                entry = self._warm()
+                if entry is None:
+                    return
+                with self._lock:
+                    self._ready.append(entry)
+        finally:
+            with self._lock:
+                self._filling = False
+
+    def _warm(self):
+        try:
+            entry = PcmPushStream()
+            audio_config = speechsdk.audio.AudioConfig(stream=entry.stream)
+            entry.recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=audio_config)
+            entry.connection = speechsdk.Connection.from_recognizer(entry.recognizer)
+            entry.connection.open(False)  # for recognize_once, not continuous recognition
+            entry.warmed_at = time.monotonic()
+            return entry
+        except Exception as e:
+            logger.warning(f"Failed to warm up a Speech recognizer: {e}")
+            return None
+
+    def close(self):
+        with self._lock:
+            entries, self._ready = list(self._ready), collections.deque()
+        for entry in entries:
+            entry.discard()
+
+class AzureGrader(BaseGrader):
+    name = "azure"
+    supports_streaming = True
+
+    def __init__(self, speech_key, service_region, cache=None, warm_recognizers=0):
         if not speech_key or not service_region:
             raise ValueError("API Key and Region are required.")
             
         self.speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=service_region)
         self.speech_config.speech_recognition_language = 'ko-KR'
+
+        # Optional GradingCache shared across graders (PCM bytes input, see remember() for streams)
+        self.cache = cache
         
         # Set output format to detailed to get phonemes if needed (though PronunciationAssessmentConfig handles most)
         self.speech_config.output_format = speechsdk.OutputFormat.Detailed
 
-    def recognize_simple(self, audio_file_path):
+        # Pre-connected recognizers for long-lived graders (see registry.get_grader)
+        self.recognizer_pool = None
+        if warm_recognizers:
+            self.recognizer_pool = RecognizerPool(self.speech_config, size=warm_recognizers)
+            self.recognizer_pool.start()
+
+    def open_stream(self):
+        """Returns a PcmPushStream for streaming input, pre-connected when one is warm."""
+        warm = self.recognizer_pool.acquire() if self.recognizer_pool is not None else None
+        return warm or PcmPushStream()
+
+    def _new_recognizer(self, audio):
+        """
+        Returns (recognizer, warm entry or None). Keep the entry referenced until
+        recognition is done, since it owns the open connection.
+        """
+        if isinstance(audio, PcmPushStream) and audio.recognizer is not None:
+            return audio.recognizer, audio
+        if isinstance(audio, (bytes, bytearray, memoryview)) and self.recognizer_pool is not None:
+            warm = self.recognizer_pool.acquire()
+            if warm is not None:
+                warm.stream.write(bytes(audio))
+                warm.close()
+                return warm.recognizer, warm
+        recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=self._audio_config(audio))
+        return recognizer, None
+
+    @staticmethod
+    def _audio_config(audio):
+        """
+        Builds the recognizer input. `audio` is either a WAV file path or
+        16kHz mono 16bit PCM bytes (see audio_utils.decode_audio), which are
+        fed through a push stream without touching the disk.
+        """
+        if isinstance(audio, PcmPushStream):
+            return speechsdk.audio.AudioConfig(stream=audio.stream)
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            pushed = PcmPushStream()
+            pushed.write(audio)
+            pushed.close()
+            return speechsdk.audio.AudioConfig(stream=pushed.stream)
+        return speechsdk.audio.AudioConfig(filename=audio)
+
+    @staticmethod
+    def _audio_missing(audio):
+        if isinstance(audio, PcmPushStream):
+            return False
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            return len(audio) == 0
+        return not os.path.exists(audio)
+
+    @staticmethod
+    def _describe(audio):
+        if isinstance(audio, PcmPushStream):
+            return "<streaming PCM>"
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            return f"<{len(audio)} bytes PCM>"
+        return audio
+
+    def settings_key(self, candidate_mode=False):
+        """Describes every setting that changes a grading result (part of the cache key)."""
+        key = f"ko-KR|HundredMark|Phoneme|miscue={not candidate_mode}"
+        if candidate_mode:
+            key += f"|unscripted|threshold={MISPRONUNCIATION_THRESHOLD}|min_match={MIN_CONFIDENCE}|pron=completeness"
+        return key
+
+    def _cache_key(self, audio, reference):
+        if self.cache is None or not isinstance(audio, (bytes, bytearray, memoryview)):
+            return None
+        candidate_mode = isinstance(reference, (list, tuple))
+        return GradingCache.make_key(audio, reference, self.settings_key(candidate_mode))
+
+    def _cached(self, cache_key):
+        if cache_key is None:
+            return None
+        result = self.cache.get(cache_key)
+        if result is not None:
+            logger.info("Grading cache hit, skipping Speech call.")
+        return result
+
+    def _store(self, cache_key, result):
+        # Errors may be transient, so only real outcomes are cached
+        if cache_key is not None and result['status'] in ('success', 'no_match'):
+            self.cache.put(cache_key, result)
+
+    def remember(self, pcm, reference, result):
+        """Caches a result graded from a stream, keyed by the complete PCM it received."""
+        self._store(self._cache_key(bytes(pcm), reference), result)
+
+    def recognize_simple(self, audio):
         """
         Performs simple Speech-to-Text to identify what was said.
         Useful for matching user speech to one of multiple reference texts.
         """
         try:
-            if not os.path.exists(audio_file_path):
+            if self._audio_missing(audio):
                 return ""
                 
-            audio_config = speechsdk.audio.AudioConfig(filename=audio_file_path)
             # Standard recognizer without PronunciationAssessmentConfig
-            recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=audio_config)
+            recognizer, _warm = self._new_recognizer(audio)
             
             result_future = recognizer.recognize_once_async()
             result = result_future.get()
@@ -41,35 +269,23 @@ class AzureGrader:
             logger.error(f"Simple recognition failed: {e}")
             return ""
 
-    def grade(self, audio_file_path, reference_text):
-        """
-        Evaluates the pronunciation of the audio file against the reference text.
-        Returns a dictionary with scores and details.
-        
-        :param audio_file_path: Absolute path to the WAV file (16kHz, 16bit, Mono recommended)
-        :param reference_text: The Korean text to evaluate against
-        """
-        logger.info(f"Grading audio: {audio_file_path} against '{reference_text}'")
-        
-        if not os.path.exists(audio_file_path):
-            return {"status": "error", "message": "Audio file not found."}
-
-        # Configure audio input
-        audio_config = speechsdk.audio.AudioConfig(filename=audio_file_path)
-
-        # Initialize recognizer
-        recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=audio_config)
-
+    def _apply_assessment(self, recognizer, reference_text, enable_miscue=True):
         # Configure pronunciation assessment parameters (matching K-Pronouncer settings)
         # grading_system=HundredMark, granularity=Phoneme, enable_miscue=True
         pronunciation_config = speechsdk.PronunciationAssessmentConfig(
             reference_text=reference_text,
             grading_system=speechsdk.PronunciationAssessmentGradingSystem.HundredMark,
             granularity=speechsdk.PronunciationAssessmentGranularity.Phoneme,
-            enable_miscue=True
+            enable_miscue=enable_miscue
         )
         pronunciation_config.apply_to(recognizer)
 
+    def _assess(self, audio, reference_text, enable_miscue=True):
+        """Runs one recognition with pronunciation assessment and parses the result."""
+        # Initialize recognizer (pre-connected when the pool has one ready)
+        recognizer, _warm = self._new_recognizer(audio)
+        self._apply_assessment(recognizer, reference_text, enable_miscue)
+
         try:
             # Perform recognition (Blocking for simplicity in this script, or use async.get())
             result_future = recognizer.recognize_once_async()
@@ -114,7 +330,8 @@ class AzureGrader:
                 logger.error(f"Recognition canceled: {cancellation_details.reason} - {cancellation_details.error_details}")
                 return {
                     "status": "error", 
-                    "message": f"인식 취소됨/오류: {cancellation_details.reason}"
+                    "message": f"인식 취소됨/오류: {cancellation_details.reason}",
+                    "service_error": True
                 }
                 
             else:
@@ -122,4 +339,161 @@ class AzureGrader:
                 
         except Exception as e:
             logger.exception("Exception during grading")
-            return {"status": "error", "message": str(e)}
+            return {"status": "error", "message": str(e), "service_error": True}
+
+    def grade(self, audio, reference_text):
+        """
+        Evaluates the pronunciation of the audio file against the reference text.
+        Returns a dictionary with scores and details.
+        
+        :param audio: Absolute path to the WAV file (16kHz, 16bit, Mono recommended) or 16kHz mono PCM bytes
+        :param reference_text: The Korean text to evaluate against
+        """
+        logger.info(f"Grading audio: {self._describe(audio)} against '{reference_text}'")
+        
+        if self._audio_missing(audio):
+            return {"status": "error", "message": "Audio file not found."}
+
+        cache_key = self._cache_key(audio, reference_text)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            return cached
+
+        res = self._assess(audio, reference_text)
+        self._store(cache_key, res)
+        return res
+
+    def recognize_and_grade(self, audio, candidates):
+        """
+        Single-pass alternative to recognize_simple() + grade() for when the user
+        did not say which sentence they read.
+
+        Runs one unscripted assessment, picks the closest candidate from the
+        recognized text (see matcher.py) and re-scores the words locally against it.
+        The result has the same shape as grade() plus 'reference_text' (the chosen
+        candidate) and 'match_confidence'. If no candidate matches confidently the
+        status is 'no_match' and 'reference_text' is only the best guess.
+
+        :param audio: Absolute path to the WAV file (16kHz, 16bit, Mono recommended) or 16kHz mono PCM bytes
+        :param candidates: Reference texts the user may have read
+        """
+        logger.info(f"Recognizing and grading audio: {self._describe(audio)} against {len(candidates)} candidates")
+
+        if not candidates:
+            return {"status": "error", "message": "비교할 숙제 목록이 없습니다."}
+        if self._audio_missing(audio):
+            return {"status": "error", "message": "Audio file not found."}
+
+        cache_key = self._cache_key(audio, list(candidates))
+        cached = self._cached(cache_key)
+        if cached is not None:
+            return cached
+
+        res = self._recognize_and_grade(audio, candidates)
+        self._store(cache_key, res)
+        return res
+
+    def _recognize_and_grade(self, audio, candidates):
+        # Miscue detection needs a reference text, so it is computed locally instead
+        res = self._assess(audio, "", enable_miscue=False)
+        if res['status'] != 'success':
+            return res
+
+        spoken_text = res['recognized_text']
+        match = get_matcher(candidates).match(spoken_text)
+        logger.info(f"Candidate match for '{spoken_text}': {match}")
+
+        if not match.confident:
+            return {
+                "status": "no_match",
+                "message": "숙제 문장 중 어느 것을 읽었는지 확실하지 않습니다.",
+                "recognized_text": spoken_text,
+                "reference_text": match.text,
+                "match_confidence": match.score
+            }
+
+        scores, word_details = rescore_against_reference(res['scores'], res['word_details'], match.text)
+        # Re-aligned to the reference here, not by Azure's scripted assessment
+        approximate = ["accuracy", "completeness"]
+        if scores["completeness"] < 100:
+            approximate.append("pronunciation")
+        return {
+            "status": "success",
+            "scores": scores,
+            "word_details": word_details,
+            "recognized_text": spoken_text,
+            "reference_text": match.text,
+            "match_confidence": match.score,
+            "approximate_scores": approximate
+        }
+
+_PUNCTUATION = ".,!?~\"'“”‘’…·"
+
+def _normalize_word(word):
+    return word.strip(_PUNCTUATION + " ").lower()
+
+def rescore_against_reference(unscripted_scores, recognized_words, reference_text):
+    """
+    Re-scores an unscripted assessment against a reference text without another Speech call.
+
+    Recognized words are aligned to the reference words; unmatched reference words
+    become Omissions, extra spoken words become Insertions, and aligned words keep
+    their acoustic accuracy (Mispronunciation below MISPRONUNCIATION_THRESHOLD).
+    Returns (scores, word_details) in the same shape as AzureGrader.grade().
+
+    Accuracy and completeness are estimates against the reference. Fluency is
+    Azure's own. The overall pronunciation score is Azure's PronScore of the
+    unscripted assessment, which never saw the skipped words, so it is scaled
+    by completeness when the reading was incomplete.
+    """
+    ref_words = [w for w in reference_text.split() if _normalize_word(w)]
+    matcher = difflib.SequenceMatcher(
+        a=[_normalize_word(w) for w in ref_words],
+        b=[_normalize_word(w['word']) for w in recognized_words],
+        autojunk=False
+    )
+
+    word_details = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for i, j in zip(range(i1, i2), range(j1, j2)):
+                accuracy = recognized_words[j]['accuracy']
+                error_type = "Mispronunciation" if accuracy < MISPRONUNCIATION_THRESHOLD else "None"
+                word_details.append({"word": ref_words[i], "accuracy": accuracy, "error_type": error_type})
+        elif tag == 'replace':
+            # Pair each reference word with the next spoken word that is still close to it
+            j = j1
+            for i in range(i1, i2):
+                for k in range(j, j2):
+                    if difflib.SequenceMatcher(a=matcher.a[i], b=matcher.b[k]).ratio() >= 0.5:
+                        for extra in range(j, k):
+                            word_details.append({"word": recognized_words[extra]['word'], "accuracy": recognized_words[extra]['accuracy'], "error_type": "Insertion"})
+                        word_details.append({"word": ref_words[i], "accuracy": recognized_words[k]['accuracy'], "error_type": "Mispronunciation"})
+                        j = k + 1
+                        break
+                else:
+                    word_details.append({"word": ref_words[i], "accuracy": 0, "error_type": "Omission"})
+            for extra in range(j, j2):
+                word_details.append({"word": recognized_words[extra]['word'], "accuracy": recognized_words[extra]['accuracy'], "error_type": "Insertion"})
+        elif tag == 'delete':
+            for i in range(i1, i2):
+                word_details.append({"word": ref_words[i], "accuracy": 0, "error_type": "Omission"})
+        elif tag == 'insert':
+            for j in range(j1, j2):
+                word_details.append({"word": recognized_words[j]['word'], "accuracy": recognized_words[j]['accuracy'], "error_type": "Insertion"})
+
+    spoken = [w for w in word_details if w['error_type'] not in ("Omission", "Insertion")]
+    completeness = 100.0 * len(spoken) / len(ref_words) if ref_words else 0.0
+    accuracy = sum(w['accuracy'] for w in spoken) / len(spoken) if spoken else 0.0
+
+    pronunciation = unscripted_scores['pronunciation']
+    if completeness < 100:
+        pronunciation *= completeness / 100.0
+
+    scores = {
+        "accuracy": accuracy,
+        "fluency": unscripted_scores['fluency'],
+        "completeness": completeness,
+        "pronunciation": pronunciation
+    }
+    return scores, word_details
@@ -0,0 +1,240 @@
+"""
+Grading pipeline benchmark with local stand-ins for Azure Speech and Google Sheets.
+
+Drives the same stages as handle_voice (decode + trim -> match + grade -> score write)
+through a GradingPool at a given concurrency and reports p50/p95/p99 latency
+per stage plus submissions/sec. No credentials or network access needed.
+
+    python bench_grading.py --submissions 500 --concurrency 8 --grader-latency-ms 800
+"""
+import io
+import os
+import sys
+import time
+import wave
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import numpy as np
+
+from azure_stt import AzureGrader
+from grading_cache import GradingCache
+from grading_pool import GradingPool
+from pipeline import grade_pcm, record_score, prepare_pcm, NO_SPEECH
+from user_manager import UserManager
+from user_store import JsonUserStore
+
+SENTENCES = [
+    "안녕하세요. 만나서 반갑습니다.",
+    "저는 한국어를 공부하고 있어요.",
+    "오늘 날씨가 정말 좋네요!",
+    "사과 3개하고 배 2개 주세요.",
+    "지하철역이 어디에 있어요?",
+    "주말에 친구랑 영화를 봤어요.",
+    "이 음식은 너무 맵지 않아요.",
+    "내일 아침 아홉 시에 만나요.",
+]
+
+class FakeAzureGrader(AzureGrader):
+    """
+    AzureGrader whose only network call (_assess) is simulated: it sleeps for a
+    log-normal latency and returns plausible scores. Caching, candidate matching
+    and local re-scoring are the real code paths.
+    """
+
+    def __init__(self, transcripts, latency_ms=800, jitter=0.3, failure_rate=0.0, cache=None, seed=0):
+        self.transcripts = transcripts  # pcm hash -> text "spoken" in that clip
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.cache = cache
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _assess(self, audio, reference_text, enable_miscue=True):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency_ms / 1000.0 * self._random.lognormvariate(0, self.jitter)
+            failed = self._random.random() < self.failure_rate
+            seed = self._random.random()
+        time.sleep(delay)
+        if failed:
+            return {"status": "error", "message": "인식 취소됨/오류: simulated"}
+
+        text = reference_text or self.transcripts.get(hash(bytes(audio)), "")
+        rng = random.Random(seed)
+        words = [{"word": w, "accuracy": rng.uniform(55, 100), "error_type": "None"} for w in text.split()]
+        accuracy = sum(w["accuracy"] for w in words) / len(words) if words else 0.0
+        scores = {
+            "accuracy": accuracy,
+            "fluency": rng.uniform(60, 100),
+            "completeness": 100.0,
+            "pronunciation": accuracy
+        }
+        return {"status": "success", "scores": scores, "word_details": words, "recognized_text": text}
+
+class FakeUsersSheet:
+    """Minimal 'Users' worksheet: the calls SheetWriteBuffer makes, with simulated latency."""
+
+    def __init__(self, latency_ms=150):
+        self.latency_ms = latency_ms
+        self.rows = [["user_id", "current_day", "last_updated", "score"]]
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        time.sleep(self.latency_ms / 1000.0)
+        self.requests += 1
+
+    def col_values(self, col):
+        self._call()
+        with self._lock:
+            return [row[col - 1] if len(row) >= col else "" for row in self.rows]
+
+    def batch_update(self, data, **kwargs):
+        self._call()
+
+    def append_rows(self, rows):
+        self._call()
+        with self._lock:
+            first = len(self.rows) + 1
+            self.rows.extend(rows)
+            last = len(self.rows)
+        return {"updates": {"updatedRange": f"Users!A{first}:D{last}"}}
+
+def synth_wav(duration, rate=48000, seed=0, lead=0.4):
+    """
+    Browser-like 48kHz mono WAV: a few voiced bursts over quiet background
+    noise, with `lead` seconds of silence before and after for trimming.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * rate)) / rate
+    envelope = ((np.sin(2 * np.pi * 1.5 * t) > 0) & (t >= lead) & (t < duration - lead)).astype(np.float32)
+    voice = np.sin(2 * np.pi * rng.uniform(110, 220) * t) * envelope
+    signal = 0.3 * voice + 0.003 * rng.standard_normal(len(t))
+    samples = (np.clip(signal, -1, 1) * 32767).astype("<i2")
+
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def build_submissions(args):
+    """Pre-generates audio clips; repeat_ratio of them are resends of an earlier clip."""
+    rng = random.Random(args.seed)
+    candidates = SENTENCES[:args.candidates]
+    submissions = []
+    transcripts = {}
+    for i in range(args.submissions):
+        if submissions and rng.random() < args.repeat_ratio:
+            submissions.append(rng.choice(submissions))
+            continue
+        audio = synth_wav(args.duration, seed=args.seed * 100003 + i)
+        spoken = rng.choice(candidates)
+        # Keyed by the trimmed PCM, which is what the grader receives
+        transcripts[hash(prepare_pcm(audio)[0])] = spoken
+        # Half the users reply to the sentence, half rely on candidate matching
+        ref_text = spoken if rng.random() < 0.5 else None
+        submissions.append({"audio": audio, "ref_text": ref_text, "chat_id": 1000 + i % args.users})
+    return submissions, candidates, transcripts
+
+async def run_benchmark(args):
+    submissions, candidates, transcripts = build_submissions(args)
+
+    cache = GradingCache(max_entries=1024, cache_dir="") if args.cache else None
+    grader = FakeAzureGrader(transcripts, args.grader_latency_ms, args.grader_jitter, args.failure_rate, cache, args.seed)
+
+    sheet = FakeUsersSheet(args.sheet_latency_ms)
+    store = JsonUserStore(os.path.join(tempfile.mkdtemp(), "users.json"))
+    user_manager = UserManager(client=object(), store=store)
+    user_manager.sheet = sheet
+
+    pool = GradingPool(max_workers=args.concurrency, max_queue=args.submissions)
+    stages = {"prepare": [], "grade": [], "sheet_write": [], "total": []}
+    statuses = {}
+    trimmed_seconds = []
+
+    async def submit(sub):
+        started = time.perf_counter()
+        async with pool.slot():
+            t0 = time.perf_counter()
+            pcm, trimmed = await pool.run(prepare_pcm, sub["audio"])
+            t1 = time.perf_counter()
+            if pcm:
+                res = await pool.run(grade_pcm, grader, pcm, sub["ref_text"], candidates)
+            else:
+                res = dict(NO_SPEECH)
+            t2 = time.perf_counter()
+            record_score(user_manager, sub["chat_id"], res)
+            t3 = time.perf_counter()
+        trimmed_seconds.append(trimmed)
+        stages["prepare"].append(t1 - t0)
+        stages["grade"].append(t2 - t1)
+        stages["sheet_write"].append(t3 - t2)
+        stages["total"].append(t3 - started)
+        statuses[res["status"]] = statuses.get(res["status"], 0) + 1
+
+    began = time.perf_counter()
+    await asyncio.gather(*(submit(sub) for sub in submissions))
+    elapsed = time.perf_counter() - began
+
+    flush_started = time.perf_counter()
+    user_manager.flush_sheet()
+    flush_elapsed = time.perf_counter() - flush_started
+    pool.shutdown()
+
+    lines = [
+        f"submissions={len(submissions)} concurrency={args.concurrency} "
+        f"grader_latency={args.grader_latency_ms}ms sheet_latency={args.sheet_latency_ms}ms cache={'on' if cache else 'off'}",
+        f"{'stage':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}",
+    ]
+    for name, values in stages.items():
+        values.sort()
+        lines.append(
+            f"{name:<12} {percentile(values, 50) * 1000:9.1f} {percentile(values, 95) * 1000:9.1f} "
+            f"{percentile(values, 99) * 1000:9.1f} {values[-1] * 1000:9.1f}"
+        )
+    lines.append(f"throughput: {len(submissions) / elapsed:.2f} submissions/sec ({elapsed:.2f}s wall)")
+    lines.append(f"speech calls: {grader.calls} | statuses: {statuses} | silence trimmed: {sum(trimmed_seconds) / len(trimmed_seconds):.2f}s/clip")
+    lines.append(f"sheet: {sheet.requests} API calls, final flush {flush_elapsed * 1000:.0f}ms")
+    return "\n".join(lines)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4, help="Grading workers (GRADING_WORKERS)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--candidates", type=int, default=5, help="Homework sentences per day")
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds of audio per clip")
+    parser.add_argument("--grader-latency-ms", type=float, default=800)
+    parser.add_argument("--grader-jitter", type=float, default=0.3, help="Log-normal sigma of grader latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--sheet-latency-ms", type=float, default=150)
+    parser.add_argument("--repeat-ratio", type=float, default=0.1, help="Share of resent clips")
+    parser.add_argument("--no-cache", dest="cache", action="store_false")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Also append the report to this file (e.g. bench_output.txt)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run_benchmark(args))
+    print(report)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(report + "\n\n")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
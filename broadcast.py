@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+import logging
+from telegram.error import RetryAfter, BadRequest, TimedOut, NetworkError
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = None
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Blocks the bucket, e.g. while Telegram asks us to back off."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+class BroadcastJob:
+    """Messages for one chat, sent in order. `on_success(chat_id)` runs once all are delivered."""
+
+    def __init__(self, chat_id, messages, on_success=None):
+        self.chat_id = chat_id
+        self.messages = list(messages)
+        self.on_success = on_success
+
+class BroadcastReport:
+    def __init__(self):
+        self.chats_ok = 0
+        self.chats_failed = 0
+        self.messages_sent = 0
+        self.retries = 0
+        self.elapsed = 0.0
+
+    @property
+    def messages_per_second(self):
+        return self.messages_sent / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.chats_ok} chats ok, {self.chats_failed} failed, "
+                f"{self.messages_sent} messages in {self.elapsed:.1f}s "
+                f"({self.messages_per_second:.1f} msg/s, {self.retries} retries)")
+
+class Broadcaster:
+    """
+    Sends message bundles to many chats concurrently while staying under Telegram's
+    limits: a global token bucket (~30 msg/s) plus one bucket per chat. RetryAfter
+    pauses the global bucket for the requested time before retrying.
+    """
+
+    def __init__(self, bot, global_rate=None, per_chat_rate=None, per_chat_burst=None,
+                 max_concurrency=None, max_retries=3):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate or float(os.getenv("BROADCAST_GLOBAL_RATE", "30")))
+        self.per_chat_rate = per_chat_rate or float(os.getenv("BROADCAST_PER_CHAT_RATE", "1"))
+        self.per_chat_burst = per_chat_burst or float(os.getenv("BROADCAST_PER_CHAT_BURST", "3"))
+        self.max_concurrency = max_concurrency or int(os.getenv("BROADCAST_CONCURRENCY", "50"))
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    @staticmethod
+    def _retry_after_seconds(error):
+        retry_after = error.retry_after
+        if hasattr(retry_after, "total_seconds"):
+            return retry_after.total_seconds()
+        return float(retry_after)
+
+    async def send(self, chat_id, text, report=None):
+        """Sends one message, waiting for rate limits and retrying transient errors."""
+        chat_bucket = self._chat_bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            # Per-chat first so a busy chat never holds global tokens while it waits
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                if report:
+                    report.messages_sent += 1
+                return
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_after_seconds(e)
+                logging.warning(f"Flood control: retry after {delay}s (chat {chat_id})")
+                self.global_bucket.pause(delay)
+            except (TimedOut, NetworkError) as e:
+                # BadRequest is a NetworkError too, but retrying it never helps
+                if isinstance(e, BadRequest) or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+            if report:
+                report.retries += 1
+
+    async def run(self, jobs):
+        """Delivers every job and returns a BroadcastReport."""
+        report = BroadcastReport()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        started = time.monotonic()
+
+        async def deliver(job):
+            async with semaphore:
+                try:
+                    for text in job.messages:
+                        await self.send(job.chat_id, text, report)
+                except Exception as e:
+                    report.chats_failed += 1
+                    logging.error(f"Failed to broadcast to {job.chat_id}: {e}")
+                    return
+            report.chats_ok += 1
+            if job.on_success:
+                try:
+                    job.on_success(job.chat_id)
+                except Exception as e:
+                    logging.error(f"Broadcast callback failed for {job.chat_id}: {e}")
+
+        await asyncio.gather(*(deliver(job) for job in jobs))
+        report.elapsed = time.monotonic() - started
+        return report
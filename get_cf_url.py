@@ -1,4 +1,3 @@
-
 import re
 import time
 import os
@@ -9,37 +8,46 @@ def clean_ansi(text):
     ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
     return ansi_escape.sub('', text)
 
-print("Searching for URL in log...")
-found = False
-for i in range(10): # Try for 10 seconds
-    if not os.path.exists(log_file):
-        time.sleep(1)
-        continue
-        
-    try:
-        with open(log_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except:
+def read_log(path):
+    """Reads a cloudflared log (PowerShell redirects write UTF-16)."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if raw.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return raw.decode('utf-16', errors='ignore')
+    return raw.decode('utf-8', errors='ignore')
+
+def find_tunnel_url(path=log_file, timeout=10):
+    """Polls the log for the quick-tunnel URL. Returns (url or None, last log content)."""
+    content = ""
+    for i in range(timeout):
+        if not os.path.exists(path):
+            time.sleep(1)
+            continue
+
+        try:
+            content = clean_ansi(read_log(path))
+        except:
+            time.sleep(1)
+            continue
+
+        # Regex to capture the URL. The URL is usually like https://<subdomain>.trycloudflare.com
+        # Make sure to strictly capture the domain.
+        match = re.search(r'(https://[a-zA-Z0-9-]+\.trycloudflare\.com)', content)
+        if match:
+            return match.group(1), content
         time.sleep(1)
-        continue
-
-    content = clean_ansi(content)
-    # Regex to capture the URL. The URL is usually like https://<subdomain>.trycloudflare.com
-    # Make sure to strictly capture the domain.
-    match = re.search(r'(https://[a-zA-Z0-9-]+\.trycloudflare\.com)', content)
-    
-    if match:
-        url = match.group(1)
+    return None, content
+
+if __name__ == "__main__":
+    print("Searching for URL in log...")
+    url, content = find_tunnel_url(log_file)
+
+    if url:
         print(f"\nSUCCESS! URL Found: {url}")
         print("--------------------------------------------------")
         print("Open this URL in your mobile browser:")
         print(f"👉 {url}")
         print("--------------------------------------------------")
-        found = True
-        break
     else:
-        time.sleep(1)
-
-if not found:
-    print("URL not found yet. Dumping last 500 chars of log:")
-    print(content[-500:] if 'content' in locals() else "No log content")
+        print("URL not found yet. Dumping last 500 chars of log:")
+        print(content[-500:] if content else "No log content")
@@ -0,0 +1,179 @@
+"""
+Common grader interface and the latency/outage router between graders.
+
+Every grader returns the same result dicts:
+    {"status": "success", "scores": {accuracy, fluency, completeness, pronunciation},
+     "word_details": [{word, accuracy, error_type}], "recognized_text": ...}
+recognize_and_grade() adds "reference_text" and "match_confidence", or returns
+status "no_match". Scores estimated locally rather than by Azure's assessment
+are named in "approximate_scores" and shown to users as estimates.
+
+Errors are {"status": "error", "message": ...}. Errors caused by the service
+itself (not by the audio) also carry "service_error": True.
+"""
+import os
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from grading_cache import GradingCache
+
+logger = logging.getLogger(__name__)
+
+# Words below this accuracy are reported as mispronounced when scoring locally
+MISPRONUNCIATION_THRESHOLD = 60
+
+# Weights of the local grader's overall score (an estimate, not Azure's PronScore formula)
+PRONUNCIATION_WEIGHTS = {"accuracy": 0.5, "fluency": 0.25, "completeness": 0.25}
+
+PCM_TYPES = (bytes, bytearray, memoryview)
+
+class BaseGrader(ABC):
+    """Pronunciation grader interface (see module docstring for the result shape)."""
+
+    name = "base"
+
+    # Whether grade()/recognize_and_grade() accept a stream from open_stream()
+    supports_streaming = False
+
+    @abstractmethod
+    def grade(self, audio, reference_text):
+        """Grades `audio` (16kHz mono PCM bytes) against one reference text."""
+
+    @abstractmethod
+    def recognize_and_grade(self, audio, candidates):
+        """Finds which candidate was read and grades against it."""
+
+    def open_stream(self):
+        raise NotImplementedError(f"{self.name} grader does not accept streaming input")
+
+    # Optional GradingCache
+    cache = None
+
+    def settings_key(self, candidate_mode=False):
+        """Describes every setting that changes a grading result (part of the cache key)."""
+        return self.name
+
+    def remember(self, pcm, reference, result):
+        """Caches a result graded from a stream (no-op for graders without a cache)."""
+
+    def cached_for_file(self, file_key, reference):
+        """Returns the result cached for a voice file (Telegram file_unique_id), or None."""
+        if self.cache is None or not file_key:
+            return None
+        key = GradingCache.make_file_key(file_key, reference, self.settings_key(isinstance(reference, (list, tuple))))
+        return self.cache.get(key)
+
+    def remember_file(self, file_key, reference, result):
+        """Caches a result under its voice file, so a resent note skips grading on either path."""
+        if self.cache is None or not file_key or result["status"] not in ("success", "no_match"):
+            return
+        key = GradingCache.make_file_key(file_key, reference, self.settings_key(isinstance(reference, (list, tuple))))
+        self.cache.put(key, result)
+
+class RoutingGrader(BaseGrader):
+    """
+    Sends every grading to `primary` (Azure) and answers from `fallback` (the
+    local engine) when primary misses the latency budget (GRADER_LATENCY_BUDGET
+    seconds) or fails with a service error. After `max_failures` failures in a
+    row primary is skipped for `cooldown` seconds, so an outage costs one
+    budget per grading only until the breaker opens.
+
+    A primary call that misses the budget cannot be stopped and keeps its
+    thread. When every primary thread is still busy with such calls, new
+    gradings go straight to fallback, so they never queue behind hung calls.
+    """
+
+    name = "routing"
+
+    def __init__(self, primary, fallback, budget=None, max_failures=3, cooldown=60.0):
+        self.primary = primary
+        self.fallback = fallback
+        self.budget = budget or float(os.getenv("GRADER_LATENCY_BUDGET", "8"))
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+        # Primary calls run here so a slow one can be abandoned at the budget
+        self.max_in_flight = 2 * int(os.getenv("GRADING_WORKERS", "4"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="primary-grader")
+        self._in_flight = 0
+
+    @property
+    def supports_streaming(self):
+        # Streaming commits to primary, so only offer it while primary is healthy
+        return self.primary.supports_streaming and self._primary_available()
+
+    def open_stream(self):
+        return self.primary.open_stream()
+
+    def remember(self, pcm, reference, result):
+        self.primary.remember(pcm, reference, result)
+
+    def cached_for_file(self, file_key, reference):
+        return self.primary.cached_for_file(file_key, reference) or self.fallback.cached_for_file(file_key, reference)
+
+    def remember_file(self, file_key, reference, result):
+        engine = self.fallback if result.get("engine") == self.fallback.name else self.primary
+        engine.remember_file(file_key, reference, result)
+
+    def grade(self, audio, reference_text):
+        return self._route("grade", audio, reference_text)
+
+    def recognize_and_grade(self, audio, candidates):
+        return self._route("recognize_and_grade", audio, candidates)
+
+    def _primary_available(self):
+        return time.monotonic() >= self._open_until
+
+    def _record(self, ok):
+        with self._lock:
+            if ok:
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._failures >= self.max_failures:
+                self._open_until = time.monotonic() + self.cooldown
+                logger.warning(f"{self.primary.name} grader failing, using {self.fallback.name} for {self.cooldown:.0f}s")
+
+    def _submit_primary(self, method, audio, arg):
+        """Starts a primary call on a free thread; None when all are taken by abandoned calls."""
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                logger.warning(f"{self.primary.name} grader has {self._in_flight} calls in flight, using {self.fallback.name}")
+                return None
+            self._in_flight += 1
+        future = self._executor.submit(getattr(self.primary, method), audio, arg)
+        future.add_done_callback(self._primary_done)
+        return future
+
+    def _primary_done(self, future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _route(self, method, audio, arg):
+        if not isinstance(audio, PCM_TYPES):
+            # Streams can only be consumed once
+            return getattr(self.primary, method)(audio, arg)
+
+        future = self._submit_primary(method, audio, arg) if self._primary_available() else None
+        if future is not None:
+            try:
+                res = future.result(timeout=self.budget)
+            except FutureTimeout:
+                future.cancel()
+                logger.warning(f"{self.primary.name} grader exceeded {self.budget:.1f}s, using {self.fallback.name}")
+                self._record(False)
+            except Exception as e:
+                logger.error(f"{self.primary.name} grader failed, using {self.fallback.name}: {e}")
+                self._record(False)
+            else:
+                if not res.get("service_error"):
+                    self._record(True)
+                    return res
+                self._record(False)
+
+        return getattr(self.fallback, method)(audio, arg)
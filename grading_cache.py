@@ -0,0 +1,130 @@
+import os
+import json
+import copy
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+class GradingCache:
+    """
+    Content-addressed cache for grading results.
+
+    Keys hash the 16kHz PCM audio together with the reference text(s) and the
+    grader settings, so a re-sent voice note (or a Telegram retry) is answered
+    without another Speech call. Results live in an in-memory LRU and, when
+    GRADING_CACHE_DIR is set, in one JSON file per key on disk.
+    """
+
+    def __init__(self, max_entries=None, cache_dir=None, max_disk_entries=None):
+        self.max_entries = max_entries or int(os.getenv("GRADING_CACHE_SIZE", "512"))
+        self.cache_dir = cache_dir if cache_dir is not None else os.getenv("GRADING_CACHE_DIR")
+        self.max_disk_entries = max_disk_entries or int(os.getenv("GRADING_CACHE_DISK_SIZE", "10000"))
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.misses = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(pcm, reference, settings):
+        """
+        :param pcm: Normalized 16kHz mono PCM bytes
+        :param reference: Reference text, or a list of candidate texts
+        :param settings: String describing every grader setting that affects the result
+        """
+        if isinstance(reference, (list, tuple)):
+            reference = "candidates:" + "\x1e".join(reference)
+        digest = hashlib.sha256()
+        digest.update(settings.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(reference.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(bytes(pcm))
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_file_key(file_key, reference, settings):
+        """
+        Key by the sender's file identity (Telegram file_unique_id) instead of
+        the PCM. The streaming and buffered paths decode the same voice note to
+        different PCM bytes, but both know its file_unique_id.
+        """
+        return GradingCache.make_key(f"file:{file_key}".encode("utf-8"), reference, settings + "|by_file")
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(result)
+
+        result = self._load_from_disk(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, result)
+        return copy.deepcopy(result)
+
+    def put(self, key, result):
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._remember(key, result)
+        self._save_to_disk(key, result)
+
+    def _remember(self, key, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load_from_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable grading cache entry {path}: {e}")
+            return None
+
+    def _save_to_disk(self, key, result):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"Failed to write grading cache entry: {e}")
+            return
+
+        self._disk_writes += 1
+        if self._disk_writes % 100 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        # Drop the oldest files once the disk tier grows past its cap
+        try:
+            paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+            excess = len(paths) - self.max_disk_entries
+            if excess > 0:
+                for path in sorted(paths, key=os.path.getmtime)[:excess]:
+                    os.remove(path)
+        except Exception as e:
+            logging.warning(f"Failed to prune grading cache: {e}")
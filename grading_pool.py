@@ -0,0 +1,153 @@
+import os
+import asyncio
+import logging
+import itertools
+import functools
+import collections
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+class GradingQueueFull(Exception):
+    """Raised when more gradings are waiting than the queue allows."""
+
+
+class GradingSuperseded(Exception):
+    """Raised for a waiting grading when a newer submission for the same sentence arrives."""
+
+
+class _Turn:
+    """A submission's place in its chat's lane (see GradingPool.reserve)."""
+
+    def __init__(self, pool, chat_id, key):
+        self.pool = pool
+        self.chat_id = chat_id
+        self.key = key
+        self.future = asyncio.get_running_loop().create_future()
+        self.released = False
+
+    @property
+    def active(self):
+        """True once this submission was given its turn (and was not superseded or cancelled)."""
+        return self.future.done() and not self.future.cancelled() and self.future.exception() is None
+
+    def release(self):
+        """Leaves the lane (idempotent); hands the turn on if this submission held it."""
+        if not self.released:
+            self.released = True
+            self.pool._leave(self)
+
+
+class GradingPool:
+    """
+    Runs blocking grading work (audio conversion, Azure Speech calls) off the event loop.
+
+    At most `max_workers` gradings run at the same time and at most `max_queue`
+    more may wait for a slot; anything beyond that is rejected right away.
+    Within one chat, submissions are graded one at a time in arrival order
+    (chat_turn), with at most `max_per_chat` waiting behind the running one.
+    """
+
+    def __init__(self, max_workers=None, max_queue=None, max_per_chat=None):
+        self.max_workers = max_workers or int(os.getenv("GRADING_WORKERS", "4"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("GRADING_QUEUE_SIZE", "20"))
+        self.max_per_chat = max_per_chat if max_per_chat is not None else int(os.getenv("GRADING_PER_CHAT_QUEUE", "3"))
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="grading")
+        self._semaphore = None
+        self._pending = 0
+        self._lanes = {}  # chat_id -> deque of _Turn, head first
+
+    @property
+    def pending(self):
+        """Number of gradings currently running or waiting."""
+        return self._pending
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Reserves one grading slot for the duration of the block."""
+        if self._pending >= self.max_workers + self.max_queue:
+            raise GradingQueueFull(f"{self._pending} gradings already pending")
+
+        # Created lazily so it binds to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                yield
+        finally:
+            self._pending -= 1
+
+    def reserve(self, chat_id, key=None):
+        """
+        Takes the next place in `chat_id`'s lane without waiting. Call it before
+        the handler's first await, so a chat's voice notes are graded in the order
+        they arrived. Enter the place with chat_turn(..., turn=...) or release() it.
+
+        A submission with a `key` (the reference sentence) supersedes the ones
+        with the same key that are still waiting: they raise GradingSuperseded
+        instead of being graded. Raises GradingQueueFull when `max_per_chat`
+        submissions are already waiting.
+        """
+        lane = self._lanes.setdefault(chat_id, collections.deque())
+        waiting = [turn for turn in itertools.islice(lane, 1, None) if not turn.future.done()]
+        if key is not None:
+            for turn in waiting:
+                if turn.key == key:
+                    turn.future.set_exception(GradingSuperseded(f"Newer submission for chat {chat_id}"))
+            waiting = [turn for turn in waiting if not turn.future.done()]
+        if len(waiting) >= self.max_per_chat:
+            if not lane:
+                del self._lanes[chat_id]
+            raise GradingQueueFull(f"{len(waiting)} gradings already waiting for chat {chat_id}")
+
+        turn = _Turn(self, chat_id, key)
+        if not any(other.active for other in lane):
+            # Only superseded/cancelled turns (on their way out) ahead of us
+            turn.future.set_result(None)
+        lane.append(turn)
+        return turn
+
+    def _leave(self, turn):
+        lane = self._lanes.get(turn.chat_id)
+        if lane is None:
+            return
+        was_active = turn.active
+        if turn.future.done() and not turn.future.cancelled():
+            turn.future.exception()  # Superseded before anyone awaited it: mark it retrieved
+        elif not turn.future.done():
+            turn.future.cancel()
+        lane.remove(turn)
+        if was_active:
+            # Hand the lane to the next submission that is still waiting
+            for next_turn in lane:
+                if not next_turn.future.done():
+                    next_turn.future.set_result(None)
+                    break
+        if not lane:
+            del self._lanes[turn.chat_id]
+
+    @contextlib.asynccontextmanager
+    async def chat_turn(self, chat_id, key=None, turn=None):
+        """
+        Waits until every earlier submission of `chat_id` has finished, so a
+        chat's results come back in the order its voice notes were sent.
+        Uses the place from reserve() when given `turn`, otherwise reserves one now.
+        """
+        turn = turn or self.reserve(chat_id, key)
+        try:
+            await turn.future
+            yield
+        finally:
+            turn.release()
+
+    async def run(self, func, *args, **kwargs):
+        """Runs a blocking function on the worker threads and awaits its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        logging.info("Shutting down grading pool...")
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+
+class SqliteJobQueue:
+    """
+    Durable grading queue shared by the bot (ingress) and grading_worker.py
+    processes through one local SQLite file (WAL mode).
+
+    A worker claims a job with a time-limited lease and renews it while it
+    works. If the worker dies, the lease runs out and another worker picks the
+    job up, so a restart never drops a submission. Finished jobs keep their
+    result until the ingress takes it and posts it to the chat.
+
+    Jobs of one chat (payload "chat_id") are graded one at a time, oldest
+    first, so a chat's results are posted in the order they were sent.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            created_at REAL NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            lease_owner TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+    """
+
+    def __init__(self, db_file=None, lease_seconds=None, max_attempts=3):
+        self.db_file = db_file or os.getenv("GRADING_QUEUE_DB", "grading_queue.db")
+        self.lease_seconds = lease_seconds or float(os.getenv("GRADING_LEASE_SECONDS", "60"))
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def _transaction(self, func):
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes can't claim the same job
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def submit(self, payload):
+        """Queues a job; returns its id."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, created_at, status, payload) VALUES (?, ?, 'queued', ?)",
+                (job_id, time.time(), json.dumps(payload, ensure_ascii=False))
+            )
+        return job_id
+
+    def supersede(self, chat_id, ref_text, result):
+        """Finishes the chat's still-queued jobs for `ref_text` with `result` instead of grading them; returns how many."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, finished_at = ? "
+                "WHERE status = 'queued' AND json_extract(payload, '$.chat_id') = ? AND json_extract(payload, '$.ref_text') = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), chat_id, ref_text)
+            )
+        return cursor.rowcount
+
+    def depth(self):
+        """Jobs waiting or being graded."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'leased')").fetchone()[0]
+
+    def claim(self, worker_id):
+        """Leases the oldest available job to `worker_id`; returns (job_id, payload) or None."""
+        def claim_next(conn):
+            now = time.time()
+            # Skip chats that already have a job being graded
+            row = conn.execute(
+                "SELECT job_id, payload, attempts FROM jobs "
+                "WHERE (status = 'queued' OR (status = 'leased' AND lease_expires < ?)) "
+                "AND json_extract(payload, '$.chat_id') NOT IN ("
+                "    SELECT json_extract(payload, '$.chat_id') FROM jobs WHERE status = 'leased' AND lease_expires >= ?"
+                ") "
+                "ORDER BY created_at LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, payload, attempts = row
+            if attempts >= self.max_attempts:
+                # Crashed the worker every time; give up instead of looping forever
+                self._finish(conn, job_id, {"status": "error", "message": "채점 작업이 반복해서 실패했습니다."})
+                return claim_next(conn)
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE job_id = ?",
+                (worker_id, now + self.lease_seconds, job_id)
+            )
+            return job_id, json.loads(payload)
+
+        return self._transaction(claim_next)
+
+    def renew(self, job_id, worker_id):
+        """Extends a lease; returns False if the job was taken over by another worker."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND status = 'leased' AND lease_owner = ?",
+                (time.time() + self.lease_seconds, job_id, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result):
+        """Stores the result of a leased job."""
+        def finish(conn):
+            owner = conn.execute("SELECT lease_owner FROM jobs WHERE job_id = ? AND status = 'leased'", (job_id,)).fetchone()
+            if owner is None or owner[0] != worker_id:
+                logging.warning(f"Dropping result for job {job_id}: lease lost")
+                return False
+            self._finish(conn, job_id, result)
+            return True
+
+        return self._transaction(finish)
+
+    def release(self, job_id, worker_id):
+        """Gives a leased job back to the queue (e.g. after a transient error) for another attempt."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', lease_owner = NULL, lease_expires = NULL "
+                "WHERE job_id = ? AND status = 'leased' AND lease_owner = ?",
+                (job_id, worker_id)
+            )
+
+    @staticmethod
+    def _finish(conn, job_id, result):
+        conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, finished_at = ?, lease_owner = NULL WHERE job_id = ?",
+            (json.dumps(result, ensure_ascii=False), time.time(), job_id)
+        )
+
+    def take_results(self, limit=50, lease_seconds=60):
+        """
+        Leases finished jobs to the ingress for posting; returns (job_id, payload, result).
+        Call mark_delivered() once posted, or release_result() to post again later.
+        A lease not settled within `lease_seconds` (ingress crashed) is handed out again.
+        """
+        def take(conn):
+            now = time.time()
+            rows = conn.execute(
+                "SELECT job_id, payload, result FROM jobs "
+                "WHERE status = 'done' OR (status = 'delivering' AND lease_expires < ?) "
+                "ORDER BY finished_at LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'delivering', lease_expires = ? WHERE job_id = ?",
+                [(now + lease_seconds, row[0]) for row in rows]
+            )
+            return [(job_id, json.loads(payload), json.loads(result)) for job_id, payload, result in rows]
+
+        return self._transaction(take)
+
+    def mark_delivered(self, job_id):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'delivered', lease_expires = NULL WHERE job_id = ?", (job_id,))
+
+    def release_result(self, job_id):
+        """Puts a result whose posting failed back for the next delivery round."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'done', lease_expires = NULL WHERE job_id = ? AND status = 'delivering'",
+                (job_id,)
+            )
+
+    def purge(self, max_age=86400):
+        """Deletes delivered jobs older than `max_age` seconds."""
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE status = 'delivered' AND finished_at < ?", (time.time() - max_age,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,173 @@
+"""
+Grading worker processes for DEPLOY_MODE=sharded.
+
+The bot (ingress) only receives updates and queues voice submissions in the
+shared SQLite queue (grading_queue.py); these processes download, decode and
+grade them on every core and store the results, which the bot posts back.
+
+    python grading_worker.py --processes 4 --threads 2
+
+A crashed or restarted worker loses nothing: its lease expires and another
+worker takes the job over.
+"""
+import os
+import sys
+import time
+import socket
+import signal
+import logging
+import argparse
+import threading
+import multiprocessing
+import httpx
+from dotenv import load_dotenv
+from grading_queue import SqliteJobQueue
+from pipeline import grade_pcm, prepare_pcm, NO_SPEECH
+
+logging.basicConfig(
+    format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+TELEGRAM_API = "https://api.telegram.org"
+
+def download_voice(client, token, file_id):
+    """Downloads a Telegram file by id with the Bot API (getFile + file download)."""
+    response = client.get(f"{TELEGRAM_API}/bot{token}/getFile", params={"file_id": file_id})
+    response.raise_for_status()
+    file_path = response.json()["result"]["file_path"]
+    response = client.get(f"{TELEGRAM_API}/file/bot{token}/{file_path}")
+    response.raise_for_status()
+    return response.content
+
+def grade_job(grader, client, token, payload, archive=None):
+    reference = payload["ref_text"] or list(payload["candidates"])
+    cached = grader.cached_for_file(payload.get("file_unique_id"), reference)
+    if cached is not None:
+        return cached
+
+    ogg_bytes = download_voice(client, token, payload["file_id"])
+    try:
+        pcm, _ = prepare_pcm(ogg_bytes, "ogg")
+    except Exception as e:
+        logging.error(f"Conversion Error: {e}")
+        return {"status": "error", "message": "오디오 변환 실패. 서버에 soundfile(libsndfile) 또는 ffmpeg가 설치되어 있는지 확인해주세요."}
+    if not pcm:
+        return dict(NO_SPEECH)
+    res = grade_pcm(grader, pcm, payload["ref_text"], payload["candidates"])
+    grader.remember_file(payload.get("file_unique_id"), reference, res)
+    if archive is not None and res["status"] != "error":
+        archive.add(pcm, res, source="bot", chat_id=payload["chat_id"], ref_text=payload["ref_text"],
+                    candidates=payload["candidates"], grader=grader.name)
+    return res
+
+class _LeaseKeeper:
+    """Renews a job's lease in the background while it is being graded."""
+
+    def __init__(self, queue, job_id, worker_id):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            if not self.queue.renew(self.job_id, self.worker_id):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+
+def worker_loop(worker_id, stop, poll_interval=0.5):
+    # Imported here so each process builds its own Speech/Sheets clients
+    from registry import get_grader, get_archive
+
+    token = os.getenv("TELEGRAM_TOKEN")
+    grader = get_grader()
+    if not token or grader is None:
+        logging.error("TELEGRAM_TOKEN and AZURE_SPEECH_KEY/AZURE_SPEECH_REGION are required")
+        return
+
+    queue = SqliteJobQueue()
+    with httpx.Client(timeout=30) as client:
+        while not stop.is_set():
+            claimed = queue.claim(worker_id)
+            if claimed is None:
+                stop.wait(poll_interval)
+                continue
+
+            job_id, payload = claimed
+            started = time.perf_counter()
+            try:
+                with _LeaseKeeper(queue, job_id, worker_id):
+                    res = grade_job(grader, client, token, payload, get_archive())
+            except Exception as e:
+                # Download/network trouble: let another attempt (maybe another worker) retry it
+                logging.error(f"Job {job_id} failed, releasing it: {e}")
+                queue.release(job_id, worker_id)
+                continue
+            queue.complete(job_id, worker_id, res)
+            logging.info(f"grading_job job={job_id} chat_id={payload['chat_id']} status={res['status']} total={time.perf_counter() - started:.3f}s")
+    queue.close()
+
+def run_process(index, threads):
+    load_dotenv()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    host = socket.gethostname()
+    loops = [
+        threading.Thread(target=worker_loop, args=(f"{host}:{os.getpid()}:{n}", stop), name=f"worker-{index}-{n}")
+        for n in range(threads)
+    ]
+    for loop in loops:
+        loop.start()
+    for loop in loops:
+        loop.join()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grading worker pool for DEPLOY_MODE=sharded")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("GRADING_PROCESSES", str(os.cpu_count() or 1))))
+    # Most of a grading is waiting on the Speech service, so a few threads per core pay off
+    parser.add_argument("--threads", type=int, default=int(os.getenv("GRADING_THREADS", "2")))
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    def spawn(index):
+        process = multiprocessing.Process(target=run_process, args=(index, args.threads), name=f"grading-{index}")
+        process.start()
+        return process
+
+    processes = {index: spawn(index) for index in range(args.processes)}
+    print(f"🧮 Grading workers started: {args.processes} processes x {args.threads} threads")
+
+    # Restart crashed workers; their leased jobs are picked up again after the lease expires
+    while not stopping:
+        time.sleep(1)
+        for index, process in list(processes.items()):
+            if not process.is_alive() and not stopping:
+                logging.warning(f"Worker {process.name} exited with {process.exitcode}, restarting")
+                processes[index] = spawn(index)
+
+    for process in processes.values():
+        process.terminate()
+    for process in processes.values():
+        process.join()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
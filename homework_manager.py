@@ -1,20 +1,23 @@
 import streamlit as st
-import gspread
-from google.oauth2 import service_account
-import json
 import os
+import time
+import asyncio
+import logging
+import threading
 from dotenv import load_dotenv
+import sheets_auth
+from metrics import timed
 
 # Load env file for standalone/bot usage
 load_dotenv()
 
 class HomeworkManager:
-    def __init__(self):
-        self.scope = [
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/drive'
-        ]
-        self.client = None
+    def __init__(self, client=None, client_factory=None):
+        # Pass a shared gspread client to reuse its HTTP session; client_factory
+        # (e.g. registry.get_sheets_client) supplies it later if it was unavailable
+        self.client = client
+        self.client_factory = client_factory
+        self.spreadsheet = None
         self.sheet = None
         
         # 1. Check environment variable first (for Bot)
@@ -27,54 +30,30 @@ class HomeworkManager:
             except:
                 self.sheet_name = "JDoit_Homework"
 
+        # In-process Homework catalog: day -> list of rows, refreshed on TTL
+        self.catalog_ttl = float(os.getenv("HOMEWORK_CACHE_TTL", "300"))
+        self._catalog = {}
+        self._catalog_loaded_at = None
+        # After a failed refresh with nothing cached, lookups wait this long before retrying
+        self.catalog_retry = float(os.getenv("HOMEWORK_CACHE_RETRY", "30"))
+        self._retry_at = 0.0
+        self._catalog_lock = threading.Lock()
+        self._refresh_lock = None  # asyncio.Lock, created in the running loop
+        self.catalog_version = 0
+
     def connect(self):
         """Connects to Google Sheets using either st.secrets or a local JSON key file."""
-        if self.client is None:
-            creds_info = None
-            try:
-                import streamlit as st
-                # 1. Standard approach that usually works in Streamlit Cloud
-                if "gcp_service_account" in st.secrets:
-                    creds_info = st.secrets["gcp_service_account"]
-                # 2. Fallback to flat secrets
-                elif "private_key" in st.secrets:
-                    creds_info = dict(st.secrets)
-            except:
-                pass
-
-            # 3. Fallback to local file (for Bot environment)
-            if not creds_info:
-                if os.path.exists("service_account.json"):
-                    with open("service_account.json", "r") as f:
-                        creds_info = json.load(f)
-
+        if self.spreadsheet is None:
             try:
-                if not creds_info:
-                    raise ValueError("Credentials not found in st.secrets or service_account.json")
-
-                # Convert to plain dict to avoid any Streamlit internal class issues
-                creds_dict = {}
-                try:
-                    # If it's a Streamlit Secrets object, convert to dict
-                    if hasattr(creds_info, "to_dict"):
-                        creds_dict = creds_info.to_dict()
-                    else:
-                        creds_dict = dict(creds_info)
-                except:
-                    creds_dict = creds_info # Fallback if already a dict
-
-                # Just in case, fix escaped newlines if they exist
-                if isinstance(creds_dict.get("private_key"), str):
-                    creds_dict["private_key"] = creds_dict["private_key"].replace("\\n", "\n")
-
-                creds = service_account.Credentials.from_service_account_info(
-                    creds_dict, scopes=self.scope
-                )
-                self.client = gspread.authorize(creds)
-                self.sheet = self.client.open(self.sheet_name).get_worksheet(0)
-                print(f"DEBUG: Successfully connected to {self.sheet_name}")
+                if self.client is None:
+                    self.client = self.client_factory() if self.client_factory else sheets_auth.authorize()
+                if self.client is None:
+                    raise RuntimeError("Google Sheets client unavailable")
+                self.spreadsheet = self.client.open(self.sheet_name)
+                self.sheet = self.spreadsheet.get_worksheet(0)
+                logging.info(f"homework_sheet connected sheet={self.sheet_name}")
             except Exception as e:
-                print(f"DEBUG: Connection failed: {e}")
+                logging.error(f"homework_sheet connect_failed sheet={self.sheet_name} error={e}")
                 raise e
 
     def get_user_info(self, user_id):
@@ -86,19 +65,98 @@ class HomeworkManager:
                 if str(record.get('user_id')) == str(user_id):
                     return record
         except Exception as e:
-            print(f"Error fetching user info: {e}")
+            logging.error(f"homework_sheet user_info_failed user_id={user_id} error={e}")
         return None
 
-    def get_homework(self, day):
-        self.connect()
-        try:
-            homework_sheet = self.client.open(self.sheet_name).worksheet("Homework")
+    @staticmethod
+    def _day_key(day):
+        return str(day).strip()
+
+    def refresh_catalog(self):
+        """Reads the whole Homework sheet once and rebuilds the day index."""
+        with timed("catalog_refresh"):
+            self.connect()
+            homework_sheet = self.spreadsheet.worksheet("Homework")
             all_homework = homework_sheet.get_all_records()
-            print(f"DEBUG: Found {len(all_homework)} total homework rows.")
-            
-            day_homework = [row for row in all_homework if str(row.get('day')).strip() == str(day).strip()]
-            print(f"DEBUG: Found {len(day_homework)} rows for Day {day}")
-            return day_homework
-        except Exception as e:
-            print(f"DEBUG: Error in get_homework: {e}")
-            return []
+        return self._set_catalog(all_homework)
+
+    async def refresh_catalog_async(self, sheets=None):
+        """
+        refresh_catalog() for coroutines: reads through an AsyncSheetsClient when
+        given, otherwise runs the gspread read on a thread.
+        """
+        if sheets is None:
+            return await asyncio.to_thread(self.refresh_catalog)
+        with timed("catalog_refresh"):
+            spreadsheet_id = await sheets.spreadsheet_id(self.sheet_name)
+            all_homework = await sheets.get_all_records(spreadsheet_id, "Homework")
+        return self._set_catalog(all_homework)
+
+    async def ensure_catalog_async(self, sheets=None):
+        """Refreshes a stale catalog without blocking the event loop; concurrent callers share one read."""
+        if not self.catalog_is_stale():
+            return
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            if not self.catalog_is_stale():
+                return
+            try:
+                await self.refresh_catalog_async(sheets)
+            except Exception as e:
+                logging.error(f"homework_catalog refresh_failed cached_days={len(self._catalog)} error={e}")
+                self._refresh_failed()
+
+    def _refresh_failed(self):
+        with self._catalog_lock:
+            if self._catalog:
+                # Keep serving the previous catalog until the next TTL window
+                self._catalog_loaded_at = time.monotonic()
+            else:
+                # Nothing to serve, but don't retry the read on every lookup
+                self._retry_at = time.monotonic() + self.catalog_retry
+
+    def _set_catalog(self, all_homework):
+        catalog = {}
+        for row in all_homework:
+            catalog.setdefault(self._day_key(row.get('day')), []).append(row)
+
+        with self._catalog_lock:
+            self._catalog = catalog
+            self._catalog_loaded_at = time.monotonic()
+            self._retry_at = 0.0
+            self.catalog_version += 1
+        logging.info(f"homework_catalog refreshed rows={len(all_homework)} days={len(catalog)} version={self.catalog_version}")
+        return catalog
+
+    def invalidate_catalog(self):
+        """Forces the next lookup to reload the Homework sheet."""
+        with self._catalog_lock:
+            self._catalog_loaded_at = None
+            self._retry_at = 0.0
+
+    def catalog_is_stale(self):
+        if time.monotonic() < self._retry_at:
+            return False
+        loaded_at = self._catalog_loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at > self.catalog_ttl
+
+    def get_homework(self, day, refresh=True):
+        """
+        Rows of `day` from the catalog. With refresh=False a stale catalog is
+        read as is (for coroutines, after ensure_catalog_async()).
+        """
+        with timed("get_homework"):
+            return self._get_homework(day, refresh)
+
+    def _get_homework(self, day, refresh=True):
+        if refresh and self.catalog_is_stale():
+            try:
+                self.refresh_catalog()
+            except Exception as e:
+                logging.error(f"homework_catalog refresh_failed day={day} cached_days={len(self._catalog)} error={e}")
+                self._refresh_failed()
+
+        day_homework = list(self._catalog.get(self._day_key(day), []))
+        logging.debug(f"homework_catalog lookup day={day} rows={len(day_homework)}")
+        return day_homework
@@ -0,0 +1,117 @@
+import os
+from matcher import get_matcher
+
+# Telegram rejects longer text messages
+MAX_MESSAGE_LENGTH = 4096
+
+# Header lines and closing tip for each place homework is sent from
+STYLES = {
+    # Scheduled 20:00 job
+    "daily": (
+        ["🔔 [알림] 오늘의 숙제가 도착했습니다! (Day {day})",
+         "📚 총 {count}개의 문장이 준비되었습니다."],
+        "💡 아무 문장이나 읽어서 음성 메시지로 보내주세요!"
+    ),
+    # /homework command
+    "command": (
+        ["📚 [Day {day}] 오늘의 숙제는 총 {count}개 입니다."],
+        "💡 팁: 위 문장 중 아무거나 골라서 읽어주시면, 자동으로 찾아서 채점해드립니다!"
+    ),
+    # test_send_day2.py preview
+    "preview": (
+        ["🧪 [테스트 발송] {day}일차 숙제 미리보기",
+         "📚 [Day {day}] 오늘의 숙제는 총 {count}개 입니다."],
+        "💡 [테스트 종료] 실제 진도는 변경되지 않았습니다."
+    ),
+}
+
+class HomeworkBundle:
+    """Ready-to-send messages for one day, plus the sentences used for voice matching."""
+
+    def __init__(self, day, messages, candidates):
+        self.day = day
+        self.messages = tuple(messages)
+        self.candidates = tuple(candidates)
+
+def format_homework_item(idx, hw):
+    hw_text = hw.get('text', '')
+    audio_url = hw.get('audio_url')
+
+    msg = f"#{idx}. 다음 문장을 읽어주세요:\n\n\"{hw_text}\""
+    if audio_url:
+        msg += f"\n\n🎧 참고 오디오: {audio_url}"
+    return msg
+
+def pack_messages(parts, limit=MAX_MESSAGE_LENGTH):
+    """Joins parts into as few messages as possible without exceeding `limit`."""
+    messages = []
+    current = ""
+    for part in parts:
+        candidate = f"{current}\n\n{part}" if current else part
+        if len(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            messages.append(current)
+        current = part
+    if current:
+        messages.append(current)
+    return messages
+
+class HomeworkRenderer:
+    """
+    Builds each day's message bundle once per catalog version and reuses it for
+    every user on that day. Compact mode (HOMEWORK_COMPACT=1) packs the whole
+    bundle into a single message instead of 3+N.
+    """
+
+    def __init__(self, hw_manager, compact=None):
+        self.hw_manager = hw_manager
+        if compact is None:
+            compact = os.getenv("HOMEWORK_COMPACT", "0").lower() in ("1", "true", "yes")
+        self.compact = compact
+        self._cache = {}
+        self._version = None
+
+    def render(self, day, style="daily", compact=None, refresh=True):
+        """
+        Returns the HomeworkBundle for `day`, or None when there is no homework.
+        refresh=False never reads Sheets (for the event loop, after
+        ensure_catalog_async()); it renders whatever catalog is loaded.
+        """
+        compact = self.compact if compact is None else compact
+        key = (str(day).strip(), style, compact)
+
+        if (not refresh or not self.hw_manager.catalog_is_stale()) and self._version == self.hw_manager.catalog_version:
+            if key in self._cache:
+                return self._cache[key]
+
+        # Refreshes the catalog if needed; a new version invalidates every bundle
+        hw_list = self.hw_manager.get_homework(day=day, refresh=refresh)
+        if self._version != self.hw_manager.catalog_version:
+            self._cache.clear()
+            self._version = self.hw_manager.catalog_version
+
+        bundle = self._build(day, hw_list, style, compact) if hw_list else None
+        self._cache[key] = bundle
+        return bundle
+
+    async def render_async(self, day, style="daily", compact=None, sheets=None):
+        """render() for handlers: a stale catalog is refreshed without blocking the event loop."""
+        await self.hw_manager.ensure_catalog_async(sheets)
+        return self.render(day, style, compact, refresh=False)
+
+    def _build(self, day, hw_list, style, compact):
+        headers, footer = STYLES[style]
+        header_lines = [line.format(day=day, count=len(hw_list)) for line in headers]
+        items = [format_homework_item(idx, hw) for idx, hw in enumerate(hw_list, 1)]
+
+        if compact:
+            messages = pack_messages(["\n".join(header_lines)] + items + [footer])
+        else:
+            messages = header_lines + items + [footer]
+
+        candidates = [entry['text'] for entry in hw_list if entry.get('text')]
+        # Build the match profiles now so the first voice reply doesn't pay for it
+        get_matcher(candidates)
+        return HomeworkBundle(day, messages, candidates)
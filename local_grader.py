@@ -0,0 +1,293 @@
+"""
+Offline, CPU-only pronunciation grader.
+
+Runs a small CTC acoustic model exported to ONNX (LOCAL_ASR_MODEL, e.g. a
+wav2vec2 Korean model over jamo or syllable tokens) with onnxruntime. The
+recognized text comes from greedy CTC decoding. Word accuracy is a
+goodness-of-pronunciation score from a forced alignment of the reference
+tokens against the frame posteriors. Results have the same shape as
+AzureGrader, so the bot and the bulk re-scorer can use either.
+
+The vocabulary is read from LOCAL_ASR_VOCAB, or <model>.vocab.json next to
+the model. It is either a token list in output order, or a {token: id} map.
+"""
+import os
+import json
+import difflib
+import logging
+import unicodedata
+import numpy as np
+from grader_base import BaseGrader, PCM_TYPES, MISPRONUNCIATION_THRESHOLD, PRONUNCIATION_WEIGHTS
+from grading_cache import GradingCache
+from matcher import get_matcher, MIN_CONFIDENCE
+
+try:
+    import onnxruntime as ort
+except ImportError:  # Optional: only needed for the offline grader
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+# Words whose aligned frames score below this are reported as Omission
+OMISSION_THRESHOLD = 15
+
+# Silence between words longer than this counts against fluency
+LONG_PAUSE_SECONDS = 0.5
+
+_BLANK_TOKENS = ("<pad>", "[PAD]", "<blank>", "_")
+_DELIMITER_TOKENS = ("|", " ", "▁")
+
+def log_softmax(logits):
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+def ctc_force_align(log_probs, labels, blank):
+    """
+    Viterbi CTC alignment of `labels` to the frames of `log_probs` (T x V).
+    Returns, per frame, the index into `labels` it was aligned to (-1 = blank),
+    or None if the clip has fewer frames than the labels need.
+    """
+    n_frames = len(log_probs)
+    if not labels or n_frames < len(labels):
+        return None
+
+    ext = np.full(2 * len(labels) + 1, blank, dtype=np.int64)
+    ext[1::2] = labels
+    n_states = len(ext)
+
+    # A state may skip the blank before it unless it repeats the previous label
+    can_skip = np.zeros(n_states, dtype=bool)
+    can_skip[3::2] = ext[3::2] != ext[1:-2:2]
+
+    neg = -np.inf
+    score = np.full(n_states, neg)
+    score[0] = log_probs[0, ext[0]]
+    score[1] = log_probs[0, ext[1]]
+    back = np.zeros((n_frames, n_states), dtype=np.int8)
+
+    for t in range(1, n_frames):
+        step1 = np.concatenate(([neg], score[:-1]))
+        step2 = np.where(can_skip, np.concatenate(([neg, neg], score[:-2])), neg)
+        moves = np.stack([score, step1, step2])
+        choice = moves.argmax(axis=0)
+        back[t] = choice
+        score = moves[choice, np.arange(n_states)] + log_probs[t, ext]
+
+    state = n_states - 1 if score[-1] >= score[-2] else n_states - 2
+    if not np.isfinite(score[state]):
+        return None
+
+    path = np.empty(n_frames, dtype=np.int64)
+    for t in range(n_frames - 1, -1, -1):
+        path[t] = state
+        state -= back[t, state]
+    return np.where(path % 2 == 1, (path - 1) // 2, -1)
+
+class LocalGrader(BaseGrader):
+    name = "local"
+
+    def __init__(self, model_path=None, vocab_path=None, cache=None, threads=None):
+        if ort is None:
+            raise RuntimeError("onnxruntime is not installed")
+        self.model_path = model_path or os.getenv("LOCAL_ASR_MODEL")
+        if not self.model_path or not os.path.exists(self.model_path):
+            raise ValueError(f"Local ASR model not found: {self.model_path}")
+        vocab_path = vocab_path or os.getenv("LOCAL_ASR_VOCAB") or os.path.splitext(self.model_path)[0] + ".vocab.json"
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or int(os.getenv("LOCAL_ASR_THREADS", "1"))
+        self.session = ort.InferenceSession(self.model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+        with open(vocab_path, "r", encoding="utf-8") as f:
+            self._set_vocab(json.load(f))
+
+        self.cache = cache
+
+    def _set_vocab(self, vocab):
+        if isinstance(vocab, dict):
+            vocab = [token for token, _ in sorted(vocab.items(), key=lambda item: item[1])]
+        self.tokens = vocab
+        self.token_ids = {token: i for i, token in enumerate(vocab)}
+        self.blank = next((self.token_ids[t] for t in _BLANK_TOKENS if t in self.token_ids), 0)
+        self.delimiter = next((self.token_ids[t] for t in _DELIMITER_TOKENS if t in self.token_ids), None)
+
+    @staticmethod
+    def available():
+        """True when onnxruntime is installed and LOCAL_ASR_MODEL points at a file."""
+        path = os.getenv("LOCAL_ASR_MODEL")
+        return ort is not None and bool(path) and os.path.exists(path)
+
+    def settings_key(self, candidate_mode=False):
+        key = f"local|{os.path.basename(self.model_path)}|threshold={MISPRONUNCIATION_THRESHOLD}|weights={sorted(PRONUNCIATION_WEIGHTS.items())}"
+        if candidate_mode:
+            key += f"|min_match={MIN_CONFIDENCE}"
+        return key
+
+    # --- acoustic model ---
+
+    def _log_probs(self, pcm):
+        samples = np.frombuffer(bytes(pcm), dtype="<i2").astype(np.float32) / 32768.0
+        # wav2vec2-style input normalization
+        samples = (samples - samples.mean()) / (samples.std() + 1e-7)
+        logits = self.session.run(None, {self.input_name: samples[np.newaxis, :]})[0][0]
+        return log_softmax(logits.astype(np.float32))
+
+    def _decode(self, log_probs):
+        """Greedy CTC decoding to text."""
+        best = log_probs.argmax(axis=-1)
+        out = []
+        previous = None
+        for token in best:
+            if token != previous and token != self.blank:
+                out.append(" " if token == self.delimiter else self.tokens[token])
+            previous = token
+        # Jamo tokens compose back into syllables
+        return unicodedata.normalize("NFC", " ".join("".join(out).split()))
+
+    def _tokenize_word(self, word):
+        ids = []
+        for ch in word:
+            if ch in self.token_ids:
+                ids.append(self.token_ids[ch])
+                continue
+            # Syllable not in the vocabulary: try its conjoining jamo
+            for jamo in unicodedata.normalize("NFD", ch):
+                if jamo in self.token_ids:
+                    ids.append(self.token_ids[jamo])
+        return ids
+
+    # --- scoring ---
+
+    def _score(self, pcm, log_probs, reference_text, recognized_text):
+        words = [w for w in reference_text.split() if self._tokenize_word(w)]
+        labels, owners = [], []
+        for index, word in enumerate(words):
+            if index and self.delimiter is not None:
+                labels.append(self.delimiter)
+                owners.append(-1)
+            ids = self._tokenize_word(word)
+            labels.extend(ids)
+            owners.extend([index] * len(ids))
+        if not labels:
+            return {"status": "error", "message": "채점할 수 있는 문장이 아닙니다."}
+
+        alignment = ctc_force_align(log_probs, labels, self.blank)
+        if alignment is None:
+            return {"status": "error", "message": "음성을 인식할 수 없습니다. (No Match)"}
+
+        # Goodness of pronunciation: how close each aligned label is to the best token per frame
+        frame_best = log_probs.max(axis=-1)
+        label_gop = np.full(len(labels), -np.inf)
+        for k in range(len(labels)):
+            frames = np.nonzero(alignment == k)[0]
+            if len(frames):
+                label_gop[k] = float(np.mean(log_probs[frames, labels[k]] - frame_best[frames]))
+
+        word_details = []
+        for index, word in enumerate(words):
+            gops = [label_gop[k] for k in range(len(labels)) if owners[k] == index]
+            accuracy = float(100.0 * np.mean(np.exp(gops)))
+            if accuracy < OMISSION_THRESHOLD:
+                word_details.append({"word": word, "accuracy": 0, "error_type": "Omission"})
+            else:
+                error_type = "Mispronunciation" if accuracy < MISPRONUNCIATION_THRESHOLD else "None"
+                word_details.append({"word": word, "accuracy": accuracy, "error_type": error_type})
+
+        spoken = [w for w in word_details if w["error_type"] != "Omission"]
+        accuracy = sum(w["accuracy"] for w in spoken) / len(spoken) if spoken else 0.0
+
+        # Completeness: share of reference tokens found in the recognized tokens
+        ref_tokens = [l for l in labels if l != self.delimiter]
+        hyp_tokens = [i for w in recognized_text.split() for i in self._tokenize_word(w)]
+        matched = sum(block.size for block in difflib.SequenceMatcher(a=ref_tokens, b=hyp_tokens, autojunk=False).get_matching_blocks())
+        completeness = 100.0 * matched / len(ref_tokens)
+
+        # Fluency: long silences between the first and last aligned word frame.
+        # Silence aligns to blank, or to the word delimiter ("|") between words.
+        owners = np.asarray(owners)
+        in_word = (alignment >= 0) & (owners[np.maximum(alignment, 0)] >= 0)
+        voiced = np.nonzero(in_word)[0]
+        seconds_per_frame = len(pcm) / 32000.0 / len(log_probs)
+        span = ~in_word[voiced[0]:voiced[-1] + 1]
+        pause_frames, run = 0, 0
+        long_run = max(1, int(LONG_PAUSE_SECONDS / seconds_per_frame))
+        for is_pause in span:
+            run = run + 1 if is_pause else 0
+            if run == long_run:
+                pause_frames += run
+            elif run > long_run:
+                pause_frames += 1
+        fluency = 100.0 * (1 - pause_frames / len(span))
+
+        scores = {"accuracy": accuracy, "fluency": fluency, "completeness": completeness}
+        scores["pronunciation"] = sum(scores[k] * weight for k, weight in PRONUNCIATION_WEIGHTS.items())
+        return {
+            "status": "success",
+            "scores": scores,
+            "word_details": word_details,
+            "recognized_text": recognized_text,
+            "engine": self.name,
+            # Not calibrated against Azure's scoring
+            "approximate_scores": ["accuracy", "fluency", "completeness", "pronunciation"]
+        }
+
+    # --- BaseGrader ---
+
+    def _cached(self, pcm, reference):
+        if self.cache is None:
+            return None, None
+        key = GradingCache.make_key(pcm, reference, self.settings_key(isinstance(reference, list)))
+        return key, self.cache.get(key)
+
+    def _store(self, key, result):
+        if key is not None and result["status"] in ("success", "no_match"):
+            self.cache.put(key, result)
+
+    def grade(self, audio, reference_text):
+        if not isinstance(audio, PCM_TYPES) or len(audio) == 0:
+            return {"status": "error", "message": "Audio file not found."}
+        key, cached = self._cached(audio, reference_text)
+        if cached is not None:
+            return cached
+
+        try:
+            log_probs = self._log_probs(audio)
+            res = self._score(audio, log_probs, reference_text, self._decode(log_probs))
+        except Exception as e:
+            logger.exception("Local grading failed")
+            return {"status": "error", "message": str(e)}
+        self._store(key, res)
+        return res
+
+    def recognize_and_grade(self, audio, candidates):
+        if not candidates:
+            return {"status": "error", "message": "비교할 숙제 목록이 없습니다."}
+        if not isinstance(audio, PCM_TYPES) or len(audio) == 0:
+            return {"status": "error", "message": "Audio file not found."}
+        key, cached = self._cached(audio, list(candidates))
+        if cached is not None:
+            return cached
+
+        try:
+            log_probs = self._log_probs(audio)
+            spoken_text = self._decode(log_probs)
+            match = get_matcher(candidates).match(spoken_text)
+            if not match.confident:
+                res = {
+                    "status": "no_match",
+                    "message": "숙제 문장 중 어느 것을 읽었는지 확실하지 않습니다.",
+                    "recognized_text": spoken_text,
+                    "reference_text": match.text,
+                    "match_confidence": match.score
+                }
+            else:
+                res = self._score(audio, log_probs, match.text, spoken_text)
+                if res["status"] == "success":
+                    res["reference_text"] = match.text
+                    res["match_confidence"] = match.score
+        except Exception as e:
+            logger.exception("Local grading failed")
+            return {"status": "error", "message": str(e)}
+        self._store(key, res)
+        return res
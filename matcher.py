@@ -0,0 +1,145 @@
+"""
+Matches recognized speech to one of the day's homework sentences.
+
+Text is normalized for Korean ASR output (numbers read out in Sino-Korean,
+spacing and punctuation removed, syllables decomposed into jamo), and each
+candidate is reduced to a jamo n-gram profile once. Scoring a recognition is
+then a linear-time multiset overlap (Dice coefficient) per candidate.
+"""
+import os
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+# Below this score a match is reported as not confident
+MIN_CONFIDENCE = float(os.getenv("MATCH_MIN_CONFIDENCE", "0.4"))
+
+_HANGUL_BASE = 0xAC00
+_HANGUL_LAST = 0xD7A3
+
+_DIGITS = "영일이삼사오육칠팔구"
+_SMALL_UNITS = ["", "십", "백", "천"]
+_LARGE_UNITS = ["", "만", "억", "조", "경"]
+
+_NUMBER_RE = re.compile(r"\d+(?:,\d{3})*")
+_KEEP_RE = re.compile(r"[^0-9a-zᄀ-ᇿ㄰-㆏가-힣]")
+
+def read_sino_korean(number):
+    """Reads an integer the way ASR spells it out: 3 -> 삼, 25 -> 이십오, 10000 -> 만."""
+    if number == 0:
+        return _DIGITS[0]
+
+    words = []
+    group_index = 0
+    while number > 0 and group_index < len(_LARGE_UNITS):
+        number, group = divmod(number, 10000)
+        if group:
+            part = ""
+            for pos in range(3, -1, -1):
+                digit = (group // 10 ** pos) % 10
+                if digit == 0:
+                    continue
+                # 십, 백, 천 drop a leading 일 (일십 -> 십)
+                if digit == 1 and pos > 0:
+                    part += _SMALL_UNITS[pos]
+                else:
+                    part += _DIGITS[digit] + _SMALL_UNITS[pos]
+            # 만 also drops it (일만 -> 만)
+            if part == "일" and group_index == 1:
+                part = ""
+            words.append(part + _LARGE_UNITS[group_index])
+        group_index += 1
+    return "".join(reversed(words))
+
+def decompose_jamo(text):
+    """Splits precomposed Hangul syllables into conjoining jamo; other characters pass through."""
+    out = []
+    for ch in text:
+        code = ord(ch)
+        if _HANGUL_BASE <= code <= _HANGUL_LAST:
+            offset = code - _HANGUL_BASE
+            initial, rest = divmod(offset, 21 * 28)
+            medial, final = divmod(rest, 28)
+            out.append(chr(0x1100 + initial))
+            out.append(chr(0x1161 + medial))
+            if final:
+                out.append(chr(0x11A7 + final))
+        else:
+            out.append(ch)
+    return "".join(out)
+
+def normalize(text):
+    """Canonical jamo string used for matching."""
+    text = unicodedata.normalize("NFC", text or "").lower()
+    text = _NUMBER_RE.sub(lambda m: read_sino_korean(int(m.group().replace(",", ""))), text)
+    text = _KEEP_RE.sub("", text)
+    return decompose_jamo(text)
+
+def ngram_profile(text, n=3):
+    """Multiset of character n-grams (the whole string if shorter than n)."""
+    if len(text) < n:
+        return Counter([text]) if text else Counter()
+    return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+class MatchResult:
+    def __init__(self, text, index, score, margin, confident):
+        self.text = text
+        self.index = index
+        self.score = score
+        self.margin = margin  # lead over the runner-up
+        self.confident = confident
+
+    def __repr__(self):
+        return f"MatchResult({self.text!r}, score={self.score:.2f}, confident={self.confident})"
+
+class CandidateMatcher:
+    def __init__(self, candidates, n=3, min_confidence=None):
+        self.candidates = list(candidates)
+        self.n = n
+        self.min_confidence = MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self._profiles = [self._profile(c) for c in self.candidates]
+
+    def _profile(self, text):
+        profile = ngram_profile(normalize(text), self.n)
+        return profile, sum(profile.values())
+
+    def scores(self, spoken_text):
+        """Dice similarity (0..1) of the spoken text against every candidate."""
+        spoken, spoken_total = self._profile(spoken_text)
+        results = []
+        for profile, total in self._profiles:
+            if not spoken_total or not total:
+                results.append(0.0)
+                continue
+            # Iterate the smaller profile: linear in the shorter text
+            small, large = (spoken, profile) if len(spoken) <= len(profile) else (profile, spoken)
+            overlap = sum(min(count, large[gram]) for gram, count in small.items() if gram in large)
+            results.append(2.0 * overlap / (spoken_total + total))
+        return results
+
+    def match(self, spoken_text):
+        """Returns the best MatchResult, or None if there are no candidates."""
+        if not self.candidates:
+            return None
+
+        scores = self.scores(spoken_text)
+        ranked = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+        best = ranked[0]
+        runner_up = scores[ranked[1]] if len(ranked) > 1 else 0.0
+        score = scores[best]
+        return MatchResult(
+            text=self.candidates[best],
+            index=best,
+            score=score,
+            margin=score - runner_up,
+            confident=score >= self.min_confidence
+        )
+
+@lru_cache(maxsize=256)
+def _cached_matcher(candidates):
+    return CandidateMatcher(candidates)
+
+def get_matcher(candidates):
+    """Shared matcher for a candidate list; profiles are built once per distinct list."""
+    return _cached_matcher(tuple(candidates))
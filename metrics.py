@@ -0,0 +1,193 @@
+"""
+Per-stage latency histograms and a Prometheus-style text endpoint.
+
+    with timed("get_homework"):
+        ...
+
+    trace = Trace("grading", chat_id=chat_id)
+    with trace.stage("download"):
+        ...
+    trace.log()   # grading chat_id=1 download=0.213s ... total=1.734s
+
+Set METRICS_PORT to serve /metrics on METRICS_HOST (default 127.0.0.1).
+Only the standard library is used, so this is safe to import everywhere.
+"""
+import os
+import time
+import logging
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("metrics")
+
+# Seconds; the Speech round trip and Sheets calls sit in the 0.25-10s range
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label set."""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, series in items:
+            labels = ",".join(f'{n}="{v}"' for n, v in zip(self.label_names, label_values))
+            sep = "," if labels else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {series[len(self.buckets)]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[len(self.buckets)]}")
+        return lines
+
+class Gauge:
+    """Value read from a callback at scrape time."""
+
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+
+    def expose(self):
+        try:
+            value = float(self.func())
+        except Exception as e:
+            logger.warning(f"Gauge {self.name} failed: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {value:g}"]
+
+_lock = threading.Lock()
+_metrics = {}
+
+STAGE_SECONDS = Histogram(
+    "jdoit_stage_seconds",
+    "Time spent per pipeline stage.",
+    ("stage", "outcome")
+)
+_metrics[STAGE_SECONDS.name] = STAGE_SECONDS
+
+def observe(stage, seconds, outcome="ok"):
+    STAGE_SECONDS.observe(seconds, stage, outcome)
+
+TRIMMED_SECONDS = Histogram(
+    "jdoit_trimmed_audio_seconds",
+    "Silence trimmed from each submission before grading.",
+    (),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+)
+_metrics[TRIMMED_SECONDS.name] = TRIMMED_SECONDS
+
+def observe_trimmed(seconds):
+    TRIMMED_SECONDS.observe(seconds)
+
+def register_gauge(name, help_text, func):
+    """Registers (or replaces) a gauge evaluated on every scrape."""
+    with _lock:
+        _metrics[name] = Gauge(name, help_text, func)
+
+@contextlib.contextmanager
+def timed(stage):
+    """Records the duration of the block under `stage`; exceptions count as outcome="error"."""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start, outcome)
+
+class Trace:
+    """
+    Stage timings of one request (e.g. one grading), recorded into the histograms
+    and summarized in a single key=value log line.
+    """
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = dict(fields)
+        self.stages = []
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            with timed(stage):
+                yield
+        finally:
+            self.stages.append((stage, time.perf_counter() - start))
+
+    def mark(self, stage):
+        """Records the time since the trace started (e.g. time spent queued) as `stage`."""
+        seconds = time.perf_counter() - self._start
+        observe(stage, seconds)
+        self.stages.append((stage, seconds))
+
+    def log(self, level=logging.INFO, **fields):
+        """Emits `<name> key=value ... <stage>=<seconds>s ... total=<seconds>s`."""
+        total = time.perf_counter() - self._start
+        observe(f"{self.name}_total", total, str(fields.get("status", "ok")))
+        parts = [self.name]
+        parts += [f"{k}={v}" for k, v in {**self.fields, **fields}.items()]
+        parts += [f"{stage}={seconds:.3f}s" for stage, seconds in self.stages]
+        parts.append(f"total={total:.3f}s")
+        logger.log(level, " ".join(parts))
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format."""
+    with _lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the bot log
+        pass
+
+def start_metrics_server(port=None, host=None):
+    """Serves /metrics from a daemon thread if METRICS_PORT (or `port`) is set; returns the server."""
+    port = port or os.getenv("METRICS_PORT")
+    if not port:
+        return None
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
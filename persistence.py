@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import uuid
+import pickle
+import sqlite3
+import logging
+import threading
+from telegram.ext import BasePersistence
+
+class SqlitePersistence(BasePersistence):
+    """
+    python-telegram-bot persistence backed by a local SQLite file (WAL mode).
+
+    Each user/chat is one row, so a flush only rewrites the entries that changed,
+    and PTB batches those flushes every `update_interval` seconds. Pending
+    grading jobs are written immediately so they survive a crash or restart.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS state (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (kind, key)
+        );
+        CREATE TABLE IF NOT EXISTS pending_jobs (
+            job_id TEXT PRIMARY KEY,
+            created_at REAL NOT NULL,
+            payload TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_file="bot_state.db", update_interval=None):
+        super().__init__(update_interval=update_interval or float(os.getenv("PERSISTENCE_INTERVAL", "10")))
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        # Last serialized value per row, so unchanged data is never rewritten
+        self._written = {}
+
+    # --- storage helpers ---
+
+    def _load(self, kind):
+        with self._lock:
+            rows = self._conn.execute("SELECT key, data FROM state WHERE kind = ?", (kind,)).fetchall()
+        loaded = {}
+        for key, data in rows:
+            self._written[(kind, key)] = data
+            loaded[key] = pickle.loads(data)
+        return loaded
+
+    def _save(self, kind, key, value):
+        data = pickle.dumps(value)
+        if self._written.get((kind, key)) == data:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO state (kind, key, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data",
+                (kind, key, data)
+            )
+        self._written[(kind, key)] = data
+
+    def _delete(self, kind, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE kind = ? AND key = ?", (kind, key))
+        self._written.pop((kind, key), None)
+
+    # --- BasePersistence ---
+
+    async def get_user_data(self):
+        return {int(key): value for key, value in self._load("user").items()}
+
+    async def get_chat_data(self):
+        return {int(key): value for key, value in self._load("chat").items()}
+
+    async def get_bot_data(self):
+        return self._load("bot").get("bot", {})
+
+    async def get_callback_data(self):
+        return self._load("callback").get("callback")
+
+    async def get_conversations(self, name):
+        return {tuple(json.loads(key)): state for key, state in self._load(f"conversation:{name}").items()}
+
+    async def update_user_data(self, user_id, data):
+        self._save("user", str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._save("chat", str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        self._save("bot", "bot", data)
+
+    async def update_callback_data(self, data):
+        self._save("callback", "callback", data)
+
+    async def update_conversation(self, name, key, new_state):
+        row_key = json.dumps(list(key))
+        if new_state is None:
+            self._delete(f"conversation:{name}", row_key)
+        else:
+            self._save(f"conversation:{name}", row_key, new_state)
+
+    async def drop_user_data(self, user_id):
+        self._delete("user", str(user_id))
+
+    async def drop_chat_data(self, chat_id):
+        self._delete("chat", str(chat_id))
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    # --- pending grading jobs ---
+
+    def add_pending_job(self, payload):
+        """Records a grading job before it starts; returns its id."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pending_jobs (job_id, created_at, payload) VALUES (?, ?, ?)",
+                (job_id, time.time(), json.dumps(payload, ensure_ascii=False))
+            )
+        return job_id
+
+    def remove_pending_job(self, job_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM pending_jobs WHERE job_id = ?", (job_id,))
+
+    def pop_pending_jobs(self, max_age=None, created_before=None):
+        """
+        Returns and clears jobs left over from a previous run (oldest first).
+        Pass the process start time as `created_before` so jobs recorded by
+        this run's live handlers are left alone.
+        """
+        created_before = created_before if created_before is not None else time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, created_at, payload FROM pending_jobs WHERE created_at < ? ORDER BY created_at",
+                (created_before,)
+            ).fetchall()
+            self._conn.execute("DELETE FROM pending_jobs WHERE created_at < ?", (created_before,))
+
+        jobs = []
+        for job_id, created_at, payload in rows:
+            if max_age is not None and time.time() - created_at > max_age:
+                logging.info(f"Dropping stale grading job {job_id}")
+                continue
+            jobs.append(json.loads(payload))
+        return jobs
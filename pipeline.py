@@ -0,0 +1,55 @@
+"""
+Front-end independent grading steps shared by the bot, the web app and the benchmark.
+Everything here is blocking; async callers run it on a GradingPool.
+"""
+from audio_utils import decode_audio, trim_silence
+from metrics import observe_trimmed
+
+NO_SPEECH = {"status": "error", "message": "🔇 목소리가 들리지 않습니다. 마이크를 확인하고 다시 녹음해주세요."}
+# A newer recording of the same sentence arrived before this one was graded
+SUPERSEDED = {"status": "superseded", "message": "⏭ 같은 문장의 새 녹음이 도착해서 이 녹음은 채점하지 않습니다."}
+
+def prepare_pcm(audio, fmt=None):
+    """
+    Decodes a voice file to 16kHz mono PCM and trims leading/trailing silence.
+    Returns (pcm, trimmed seconds); pcm is empty when there is no speech (grade nothing).
+    """
+    pcm, trimmed = trim_silence(decode_audio(audio, fmt))
+    observe_trimmed(trimmed)
+    return pcm, trimmed
+
+def grade_pcm(grader, pcm, ref_text=None, candidates=None):
+    """Grades against ref_text, or picks the sentence from candidates in the same Speech pass."""
+    if ref_text:
+        return grader.grade(pcm, ref_text)
+    if not candidates:
+        return {"status": "error", "message": "비교할 숙제 목록이 없습니다."}
+    return grader.recognize_and_grade(pcm, candidates)
+
+def format_score(res, name):
+    """A score for display: '85', or '≈85' when it was estimated locally (see approximate_scores)."""
+    value = f"{res['scores'][name]:.0f}"
+    return f"≈{value}" if name in res.get("approximate_scores", ()) else value
+
+APPROXIMATE_NOTE = "≈ 표시는 예상 점수입니다 (Azure 발음 평가 점수와 다를 수 있습니다)."
+
+def record_score(user_manager, chat_id, res):
+    """Queues the pronunciation score of a successful grading for the Users sheet."""
+    if res['status'] == 'success':
+        user_manager.update_user_score(chat_id, res['scores']['pronunciation'])
+
+def process_submission(audio, grader, ref_text=None, candidates=None, fmt=None, user_manager=None, chat_id=None, archive=None, source=None):
+    """Decode + trim -> (match +) grade -> score write (-> archive) for one voice submission."""
+    try:
+        pcm, _ = prepare_pcm(audio, fmt)
+    except Exception as e:
+        # Grader failures raise; a bad recording is an ordinary error result
+        return {"status": "error", "message": f"Audio conversion failed: {e}"}
+    if not pcm:
+        return dict(NO_SPEECH)
+    res = grade_pcm(grader, pcm, ref_text, candidates)
+    if user_manager is not None and chat_id is not None:
+        record_score(user_manager, chat_id, res)
+    if archive is not None and res['status'] != 'error':
+        archive.add(pcm, res, source=source, chat_id=chat_id, ref_text=ref_text, candidates=list(candidates or []), grader=grader.name)
+    return res
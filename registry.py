@@ -0,0 +1,119 @@
+"""
+Process-wide shared services for the bot.
+
+Handlers call get_user_manager() / get_homework_manager() instead of building
+new managers, so the user DB is loaded once and one authorized gspread client
+(and its HTTP session) is reused for every Sheets call.
+"""
+import os
+import logging
+import threading
+import sheets_auth
+from user_manager import UserManager
+from homework_manager import HomeworkManager
+from homework_renderer import HomeworkRenderer
+from grading_cache import GradingCache
+from azure_stt import AzureGrader
+from local_grader import LocalGrader
+from grader_base import RoutingGrader
+from async_sheets import AsyncSheetsClient
+from submission_archive import SubmissionArchive
+
+_lock = threading.RLock()
+_instances = {}
+
+def _get(name, factory):
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = factory()
+                _instances[name] = instance
+    return instance
+
+def get_sheets_client():
+    """Returns the shared gspread client, or None if Sheets credentials are unavailable."""
+    try:
+        return _get("sheets_client", sheets_auth.authorize)
+    except Exception as e:
+        # Not cached: the next call tries again
+        logging.error(f"Failed to authorize Google Sheets client: {e}")
+        return None
+
+def get_async_sheets():
+    """Returns the shared AsyncSheetsClient for handlers, or None if Sheets credentials are unavailable."""
+    try:
+        return _get("async_sheets", AsyncSheetsClient)
+    except Exception as e:
+        logging.error(f"Failed to create async Sheets client: {e}")
+        return None
+
+# If Sheets is unavailable at first, the managers retry through get_sheets_client
+# on their next connect, so they still end up on the shared client
+
+def get_user_manager():
+    return _get("user_manager", lambda: UserManager(client=get_sheets_client(), client_factory=get_sheets_client))
+
+def get_homework_manager():
+    return _get("homework_manager", lambda: HomeworkManager(client=get_sheets_client(), client_factory=get_sheets_client))
+
+def get_homework_renderer():
+    return _get("homework_renderer", lambda: HomeworkRenderer(get_homework_manager()))
+
+def get_grading_cache():
+    return _get("grading_cache", GradingCache)
+
+def get_archive():
+    """Returns the submission archive, or None unless ARCHIVE_DIR is set (opt-in)."""
+    archive_dir = os.getenv("ARCHIVE_DIR")
+    if not archive_dir:
+        return None
+    return _get("archive", lambda: SubmissionArchive(archive_dir))
+
+def get_local_grader():
+    """Returns the shared offline LocalGrader, or None if LOCAL_ASR_MODEL/onnxruntime are unavailable."""
+    if not LocalGrader.available():
+        return None
+    try:
+        return _get("local_grader", lambda: LocalGrader(cache=get_grading_cache()))
+    except Exception as e:
+        logging.error(f"Failed to load local grader: {e}")
+        return None
+
+def get_grader(speech_key=None, service_region=None):
+    """
+    Returns the long-lived grader: AzureGrader (one SpeechConfig and a pool of
+    warm recognizers, SPEECH_WARM_RECOGNIZERS), routed to the local engine on
+    slow calls or outages when LOCAL_ASR_MODEL is set. None if neither is configured.
+    """
+    speech_key = speech_key or os.getenv("AZURE_SPEECH_KEY")
+    service_region = service_region or os.getenv("AZURE_SPEECH_REGION")
+    local = get_local_grader()
+    if not speech_key or not service_region:
+        return local
+
+    warm = int(os.getenv("SPEECH_WARM_RECOGNIZERS", "2"))
+    azure = _get(
+        ("grader", speech_key, service_region),
+        lambda: AzureGrader(speech_key, service_region, cache=get_grading_cache(), warm_recognizers=warm)
+    )
+    if local is None:
+        return azure
+    return _get(("routing_grader", speech_key, service_region), lambda: RoutingGrader(azure, local))
+
+async def close_async_clients():
+    """Closes HTTP clients bound to the bot's event loop (call from post_shutdown)."""
+    sheets = _instances.get("async_sheets")
+    if sheets is not None:
+        await sheets.close()
+
+def reset():
+    """Drops all shared instances (e.g. after changing credentials)."""
+    with _lock:
+        instances = list(_instances.values())
+        _instances.clear()
+    for instance in instances:
+        pool = getattr(instance, "recognizer_pool", None)
+        if pool is not None:
+            pool.close()
@@ -0,0 +1,180 @@
+"""
+Re-grades archived submissions (ARCHIVE_DIR, see submission_archive.py) with
+the current grader settings, or with another grader, in parallel processes.
+
+Finished entries are appended to a JSONL checkpoint as they complete, so an
+interrupted run picks up where it stopped; entries that ended in an error are
+graded again. At the end all rows are written to a columnar file: Parquet
+when pyarrow is installed, CSV otherwise.
+
+    python regrade.py --grader local --processes 8 --output regrade.parquet
+"""
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from dotenv import load_dotenv
+from pipeline import grade_pcm
+from submission_archive import SubmissionArchive
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: CSV is written instead
+    pa = None
+
+COLUMNS = [
+    "entry_id", "audio_id", "created_at", "source", "chat_id", "mode",
+    "old_status", "old_reference_text", "old_pronunciation",
+    "grader", "status", "reference_text", "recognized_text", "match_confidence",
+    "pronunciation", "accuracy", "fluency", "completeness", "mispronounced_words", "error", "graded_at"
+]
+
+_grader = None
+_archive = None
+_init_error = None
+
+def _init_worker(grader_kind, archive_dir):
+    # Must not raise: Pool would respawn the worker forever and main() would hang
+    global _grader, _archive, _init_error
+    try:
+        load_dotenv()
+        _archive = SubmissionArchive(archive_dir)
+        _grader = build_grader(grader_kind)
+    except Exception as e:
+        _init_error = f"{type(e).__name__}: {e}"
+
+def build_grader(kind):
+    """Fresh grader without the result cache, so settings changes are always re-scored."""
+    if kind == "local":
+        from local_grader import LocalGrader
+        return LocalGrader()
+    from azure_stt import AzureGrader
+    return AzureGrader(os.getenv("AZURE_SPEECH_KEY"), os.getenv("AZURE_SPEECH_REGION"))
+
+def regrade_entry(entry):
+    if _init_error is not None:
+        raise RuntimeError(f"Worker could not build the grader: {_init_error}")
+    row = {
+        "entry_id": entry["entry_id"],
+        "audio_id": entry["audio_id"],
+        "created_at": entry.get("created_at"),
+        "source": entry.get("source"),
+        "chat_id": None if entry.get("chat_id") is None else str(entry["chat_id"]),
+        "mode": "reference" if entry.get("ref_text") else "candidates",
+        "old_status": entry.get("status"),
+        "old_reference_text": entry.get("reference_text"),
+        "old_pronunciation": entry.get("pronunciation"),
+        "grader": _grader.name,
+        "graded_at": time.time()
+    }
+    try:
+        pcm = _archive.load_pcm(entry["audio_id"])
+        res = grade_pcm(_grader, pcm, entry.get("ref_text"), entry.get("candidates"))
+    except Exception as e:
+        res = {"status": "error", "message": str(e)}
+
+    scores = res.get("scores") or {}
+    row.update({
+        "status": res["status"],
+        "reference_text": res.get("reference_text") or entry.get("ref_text"),
+        "recognized_text": res.get("recognized_text"),
+        "match_confidence": res.get("match_confidence"),
+        "pronunciation": scores.get("pronunciation"),
+        "accuracy": scores.get("accuracy"),
+        "fluency": scores.get("fluency"),
+        "completeness": scores.get("completeness"),
+        "mispronounced_words": sum(1 for w in res.get("word_details", []) if w["error_type"] != "None"),
+        "error": res.get("message") if res["status"] == "error" else None
+    })
+    return row
+
+def read_checkpoint(path):
+    rows = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue  # Torn last line from an interrupted run
+                rows[row["entry_id"]] = row
+    return rows
+
+def write_table(rows, output):
+    """Writes rows as Parquet (pyarrow) or CSV; returns the path written."""
+    if pa is not None and not output.endswith(".csv"):
+        table = pa.Table.from_pylist([{c: row.get(c) for c in COLUMNS} for row in rows])
+        pq.write_table(table, output)
+        return output
+
+    if not output.endswith(".csv"):
+        output = os.path.splitext(output)[0] + ".csv"
+        logging.warning(f"pyarrow is not installed, writing CSV instead: {output}")
+    with open(output, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    return output
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-grade archived submissions")
+    parser.add_argument("--archive-dir", default=os.getenv("ARCHIVE_DIR", "archive"))
+    parser.add_argument("--grader", choices=["azure", "local"], default="azure")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default="regrade.parquet")
+    parser.add_argument("--checkpoint", help="JSONL of finished entries (default: <output>.checkpoint.jsonl)")
+    parser.add_argument("--since", type=float, help="Only entries created after this Unix time")
+    parser.add_argument("--source", choices=["bot", "web"])
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    load_dotenv()
+
+    # Fail fast on a missing model, onnxruntime or Azure key before any worker starts
+    try:
+        build_grader(args.grader)
+    except Exception as e:
+        parser.error(f"cannot build the {args.grader} grader: {e}")
+
+    checkpoint = args.checkpoint or os.path.splitext(args.output)[0] + ".checkpoint.jsonl"
+    done = read_checkpoint(checkpoint)
+
+    entries = SubmissionArchive(args.archive_dir).entries()
+    if args.since:
+        entries = [e for e in entries if e.get("created_at", 0) >= args.since]
+    if args.source:
+        entries = [e for e in entries if e.get("source") == args.source]
+    if args.limit:
+        entries = entries[:args.limit]
+    # Error rows (e.g. Azure throttling) are graded again; the newer checkpoint line wins
+    finished = {entry_id for entry_id, row in done.items() if row.get("status") != "error"}
+    todo = [e for e in entries if e["entry_id"] not in finished]
+    retried = sum(1 for e in todo if e["entry_id"] in done)
+    logging.info(f"{len(entries)} archived submissions, {len(entries) - len(todo)} already in checkpoint, {len(todo)} to grade ({retried} retried errors)")
+
+    started = time.perf_counter()
+    if todo:
+        with open(checkpoint, "a", encoding="utf-8") as out, multiprocessing.Pool(
+            args.processes, initializer=_init_worker, initargs=(args.grader, args.archive_dir)
+        ) as pool:
+            for n, row in enumerate(pool.imap_unordered(regrade_entry, todo, chunksize=4), 1):
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                out.flush()
+                done[row["entry_id"]] = row
+                if n % 100 == 0 or n == len(todo):
+                    rate = n / (time.perf_counter() - started)
+                    logging.info(f"{n}/{len(todo)} graded ({rate:.1f}/s)")
+
+    wanted = {e["entry_id"] for e in entries}
+    rows = sorted((row for entry_id, row in done.items() if entry_id in wanted), key=lambda r: r.get("created_at") or 0)
+    path = write_table(rows, args.output)
+    print(f"✅ Wrote {len(rows)} rows to {path}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,11 +1,12 @@
 
+import os
 import subprocess
 import time
 import re
 import sys
 
-def run_cloudflared():
-    print("🚀 Starting Cloudflare Tunnel...")
+def run_cloudflared(port=8501):
+    print(f"🚀 Starting Cloudflare Tunnel (localhost:{port})...")
     # Using the 'trycloudflare' quick tunnel which requires no auth
     # We use the 'cloudflared' command which pycloudflared should have installed or made available, 
     # but sometimes it's just a wrapper. Let's try running the module directly or checking usage.
@@ -14,7 +15,14 @@ def run_cloudflared():
     from pycloudflared import try_cloudflare
     
     print("🔗 Requesting tunnel URL...")
-    tunnel_url = try_cloudflare(port=8501)
+    urls = try_cloudflare(port=port)
+    # try_cloudflare returns (tunnel, metrics, process); older versions just the URL
+    tunnel_url = getattr(urls, "tunnel", urls)
+    
+    # The bot's webhook mode reads the URL from this log when WEBHOOK_URL is unset (get_cf_url.find_tunnel_url)
+    log_file = os.getenv("CF_LOG_FILE", "cf_new.log")
+    with open(log_file, "w", encoding="utf-8") as f:
+        f.write(f"{tunnel_url}\n")
     
     print(f"✅ Tunnel Active!")
     print(f"🌍 Public URL: {tunnel_url}")
@@ -29,7 +37,8 @@ def run_cloudflared():
 
 if __name__ == "__main__":
     try:
-        run_cloudflared()
+        # Default 8501 = Streamlit app; pass the bot's WEBHOOK_PORT to expose the webhook instead
+        run_cloudflared(int(sys.argv[1]) if len(sys.argv) > 1 else 8501)
     except KeyboardInterrupt:
         print("Stopping...")
     except Exception as e:
@@ -0,0 +1,68 @@
+import json
+import os
+import gspread
+from google.oauth2 import service_account
+
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+
+def load_credentials_info(key_file="service_account.json"):
+    """Finds service account info in st.secrets or a local JSON key file (None if missing)."""
+    creds_info = None
+
+    # 1. Try Streamlit Secrets (for Web)
+    try:
+        import streamlit as st
+        if "gcp_service_account" in st.secrets:
+            creds_info = st.secrets["gcp_service_account"]
+        elif "private_key" in st.secrets:
+            creds_info = {
+                "type": st.secrets.get("type", "service_account"),
+                "project_id": st.secrets.get("project_id"),
+                "private_key_id": st.secrets.get("private_key_id"),
+                "private_key": st.secrets.get("private_key"),
+                "client_email": st.secrets.get("client_email"),
+                "client_id": st.secrets.get("client_id"),
+                "auth_uri": st.secrets.get("auth_uri"),
+                "token_uri": st.secrets.get("token_uri"),
+                "auth_provider_x509_cert_url": st.secrets.get("auth_provider_x509_cert_url"),
+                "client_x509_cert_url": st.secrets.get("client_x509_cert_url")
+            }
+    except:
+        pass
+
+    # 2. Fallback to local file (for Bot environment)
+    if not creds_info or not creds_info.get("private_key"):
+        if os.path.exists(key_file):
+            with open(key_file, "r", encoding="utf-8") as f:
+                creds_info = json.load(f)
+
+    if not creds_info:
+        return None
+
+    # Convert to plain dict to avoid any Streamlit internal class issues
+    try:
+        if hasattr(creds_info, "to_dict"):
+            creds_dict = creds_info.to_dict()
+        else:
+            creds_dict = dict(creds_info)
+    except:
+        creds_dict = creds_info
+
+    # Just in case, fix escaped newlines if they exist
+    if isinstance(creds_dict.get("private_key"), str):
+        creds_dict["private_key"] = creds_dict["private_key"].replace("\\n", "\n")
+    return creds_dict
+
+def load_credentials(key_file="service_account.json", scopes=None):
+    """Returns service account Credentials, raising ValueError when none are configured."""
+    creds_dict = load_credentials_info(key_file)
+    if not creds_dict:
+        raise ValueError(f"Credentials not found in st.secrets or {key_file}")
+    return service_account.Credentials.from_service_account_info(creds_dict, scopes=scopes or SCOPES)
+
+def authorize(key_file="service_account.json"):
+    """Returns an authorized gspread client. Reuse it: it keeps one HTTP session."""
+    return gspread.authorize(load_credentials(key_file))
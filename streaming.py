@@ -0,0 +1,88 @@
+"""
+Streaming path for Telegram voice notes: the file is downloaded in chunks,
+decoded page by page (audio_utils.OpusStreamDecoder) and written into an
+Azure push stream while recognition is already running, so download, decode
+and recognition overlap instead of running one after another.
+
+Used when opuslib is installed and VOICE_STREAMING is not "0"; otherwise the
+bot keeps the buffered download -> decode_audio -> grade path.
+"""
+import os
+import asyncio
+import logging
+import httpx
+from audio_utils import OpusStreamDecoder
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 16 * 1024
+
+_client = None
+
+def streaming_enabled():
+    if os.getenv("VOICE_STREAMING", "1").lower() in ("0", "false", "no"):
+        return False
+    return OpusStreamDecoder.available()
+
+def _get_client():
+    # One connection pool for all downloads; created lazily inside the running loop
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0), follow_redirects=True)
+    return _client
+
+async def close_client(application=None):
+    """Closes the download connection pool (usable as a PTB post_shutdown hook)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def file_url(bot, file_id):
+    """Resolves a file_id to a download URL, or None when the file is not served over HTTP."""
+    tg_file = await bot.get_file(file_id)
+    url = tg_file.file_path or ""
+    # A local Bot API server returns a filesystem path instead of a URL
+    return url if url.startswith(("http://", "https://")) else None
+
+async def stream_voice(url, sink, gate=None, chunk_size=CHUNK_SIZE):
+    """
+    Downloads an Ogg/Opus file and writes the decoded 16kHz mono PCM to `sink`
+    (an azure_stt.PcmPushStream) as it arrives. With a `gate`
+    (audio_utils.SilenceGate), leading and trailing silence is not sent.
+    Always closes the sink, so the recognizer never waits for audio that
+    will not come. Returns the raw file bytes.
+    """
+    decoder = OpusStreamDecoder()
+    raw = bytearray()
+    try:
+        async with _get_client().stream("GET", url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                raw += chunk
+                pcm = decoder.feed(chunk)
+                sink.write(gate.feed(pcm) if gate is not None else pcm)
+        if gate is not None:
+            sink.write(gate.flush())
+    finally:
+        sink.close()
+    return bytes(raw)
+
+async def stream_and_grade(run_blocking, url, sink, grade_func, gate=None):
+    """
+    Starts `grade_func(sink)` on a worker (via `run_blocking`, e.g. GradingPool.run)
+    and feeds it from the download at the same time. Returns (result, raw file bytes).
+    If the download or decode fails, the exception is raised after the recognizer
+    has been released.
+    """
+    grading = asyncio.ensure_future(run_blocking(grade_func, sink))
+    try:
+        raw = await stream_voice(url, sink, gate)
+    except BaseException:
+        # The sink is closed, so the recognizer returns shortly; drop its result
+        try:
+            await grading
+        except Exception:
+            pass
+        raise
+    return await grading, raw
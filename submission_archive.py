@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so only one process may write the archive
+    fcntl = None
+
+class SubmissionArchive:
+    """
+    Opt-in archive of graded submissions for re-scoring (see regrade.py).
+
+    Audio is stored once per recording as normalized 16kHz mono PCM under
+    pcm/<sha256>.pcm, and every grading appends one metadata line to
+    index.jsonl. The archive is capped at `max_mb` (ARCHIVE_MAX_MB). When it
+    grows past the cap, the oldest recordings are deleted, down to 90% of the cap.
+
+    The bot and every grading_worker process write here. Appends and prunes
+    hold an flock on archive.lock, and the total size lives in a `size` file,
+    so all processes see one total and the index rewrite never drops an append.
+    """
+
+    def __init__(self, archive_dir, max_mb=None):
+        self.archive_dir = archive_dir
+        self.max_bytes = int((max_mb or float(os.getenv("ARCHIVE_MAX_MB", "1024"))) * 1024 * 1024)
+        self.pcm_dir = os.path.join(archive_dir, "pcm")
+        self.index_file = os.path.join(archive_dir, "index.jsonl")
+        self.size_file = os.path.join(archive_dir, "size")
+        self.lock_file = os.path.join(archive_dir, "archive.lock")
+        self._lock = threading.Lock()
+        os.makedirs(self.pcm_dir, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Exclusive across threads (_lock) and processes (flock)."""
+        with self._lock, open(self.lock_file, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_size(self):
+        try:
+            with open(self.size_file, "r") as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return sum(os.path.getsize(path) for path in self._pcm_files())
+
+    def _write_size(self, size):
+        self._replace(self.size_file, str(size))
+
+    @staticmethod
+    def _replace(path, text):
+        # Per-process tmp name, so two writers never share one tmp file
+        tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_file, path)
+
+    def _pcm_files(self):
+        return [os.path.join(self.pcm_dir, name) for name in os.listdir(self.pcm_dir) if name.endswith(".pcm")]
+
+    def pcm_path(self, audio_id):
+        return os.path.join(self.pcm_dir, f"{audio_id}.pcm")
+
+    def add(self, pcm, result, **meta):
+        """
+        Archives one graded submission.
+
+        :param pcm: 16kHz mono 16bit PCM bytes that were graded
+        :param result: The grading result dict
+        :param meta: e.g. chat_id, source, ref_text, candidates, grader
+        """
+        pcm = bytes(pcm)
+        if not pcm:
+            return None
+        audio_id = hashlib.sha256(pcm).hexdigest()
+        scores = result.get("scores") or {}
+        entry = {
+            "entry_id": uuid.uuid4().hex,
+            "audio_id": audio_id,
+            "created_at": time.time(),
+            **meta,
+            "status": result.get("status"),
+            "reference_text": result.get("reference_text") or meta.get("ref_text"),
+            "recognized_text": result.get("recognized_text"),
+            "pronunciation": scores.get("pronunciation")
+        }
+
+        try:
+            with self._locked():
+                path = self.pcm_path(audio_id)
+                size = self._read_size()
+                if not os.path.exists(path):
+                    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(pcm)
+                    os.replace(tmp_path, path)
+                    size += len(pcm)
+                with open(self.index_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                if size > self.max_bytes:
+                    size = self._prune()
+                self._write_size(size)
+        except Exception as e:
+            logging.warning(f"Failed to archive submission: {e}")
+            return None
+        return entry["entry_id"]
+
+    def _prune(self):
+        """Deletes the oldest recordings down to 90% of the cap; returns the new size. Hold _locked()."""
+        files = sorted(((os.path.getmtime(path), os.path.getsize(path), path) for path in self._pcm_files()))
+        size = sum(file_size for _, file_size, _ in files)
+        target = int(self.max_bytes * 0.9)
+        removed = set()
+        for _, file_size, path in files:
+            if size <= target:
+                break
+            os.remove(path)
+            size -= file_size
+            removed.add(os.path.basename(path)[:-len(".pcm")])
+
+        # Drop index lines whose audio is gone
+        kept = [entry for entry in self.entries() if entry["audio_id"] not in removed]
+        self._replace(self.index_file, "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in kept))
+        logging.info(f"Pruned {len(removed)} archived recordings ({size / 1048576:.0f}MB kept)")
+        return size
+
+    def entries(self):
+        """All index entries whose audio still exists, oldest first."""
+        if not os.path.exists(self.index_file):
+            return []
+        entries = []
+        with open(self.index_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Torn last line after a crash
+                if os.path.exists(self.pcm_path(entry["audio_id"])):
+                    entries.append(entry)
+        return entries
+
+    def load_pcm(self, audio_id):
+        with open(self.pcm_path(audio_id), "rb") as f:
+            return f.read()
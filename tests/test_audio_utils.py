@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from audio_utils import (
+    MIN_SPEECH_SECONDS, TARGET_RATE, VAD_FRAME, VAD_PADDING_SECONDS, SilenceGate, speech_frames, trim_silence
+)
+
+
+def tone(seconds, amplitude=8000):
+    t = np.arange(int(seconds * TARGET_RATE)) / TARGET_RATE
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype("<i2")
+
+
+def silence(seconds):
+    return np.zeros(int(seconds * TARGET_RATE), dtype="<i2")
+
+
+def clip(*parts):
+    return np.concatenate(parts).tobytes()
+
+
+def gate(pcm, chunk):
+    g = SilenceGate()
+    out = b"".join(g.feed(pcm[i:i + chunk]) for i in range(0, len(pcm), chunk))
+    return out + g.flush(), g
+
+
+def test_speech_frames_ignores_partial_frame():
+    samples = np.concatenate([silence(0.1), tone(0.1)])
+    mask = speech_frames(samples[:len(samples) - 5])
+    assert len(mask) == len(samples) // VAD_FRAME - 1
+    assert not mask[0] and mask[-1]
+
+
+def test_trim_keeps_padding_around_speech():
+    pcm = clip(silence(1.0), tone(0.5), silence(1.0))
+    trimmed, seconds = trim_silence(pcm)
+    assert len(trimmed) == int((0.5 + 2 * VAD_PADDING_SECONDS) * TARGET_RATE) * 2
+    assert seconds == pytest.approx(2.5 - 0.5 - 2 * VAD_PADDING_SECONDS)
+
+
+def test_trim_leaves_speech_without_silence_alone():
+    pcm = clip(tone(0.6))
+    assert trim_silence(pcm) == (pcm, 0.0)
+
+
+@pytest.mark.parametrize("pcm", [b"", clip(silence(2.0)), clip(silence(1.0), tone(MIN_SPEECH_SECONDS / 2), silence(1.0))])
+def test_trim_rejects_clips_without_enough_speech(pcm):
+    trimmed, seconds = trim_silence(pcm)
+    assert trimmed == b""
+    assert seconds == pytest.approx(len(pcm) / (TARGET_RATE * 2))
+
+
+@pytest.mark.parametrize("chunk", [640, 1000, 4096, 32000])
+def test_gate_matches_trim(chunk):
+    pcm = clip(silence(0.8), tone(0.4), silence(0.6), tone(0.3), silence(0.9))
+    trimmed, seconds = trim_silence(pcm)
+    streamed, g = gate(pcm, chunk)
+    assert streamed == trimmed
+    assert g.trimmed_seconds == pytest.approx(seconds)
+    assert g.has_speech
+
+
+@pytest.mark.parametrize("pcm", [b"", clip(silence(2.0))])
+def test_gate_passes_nothing_for_silence(pcm):
+    streamed, g = gate(pcm, 1000)
+    assert streamed == b""
+    assert not g.has_speech
+    assert not g.started
+
+
+def test_gate_has_speech_needs_min_speech_seconds():
+    _, g = gate(clip(silence(0.5), tone(MIN_SPEECH_SECONDS / 2), silence(0.5)), 1000)
+    assert g.started
+    assert not g.has_speech
@@ -0,0 +1,86 @@
+import os
+from grading_cache import GradingCache
+
+PCM = b"\x01\x00" * 800
+RESULT = {"status": "success", "scores": {"pronunciation": 87.0}, "word_details": []}
+
+
+def test_key_is_stable_and_covers_every_input():
+    key = GradingCache.make_key(PCM, "안녕하세요", "azure|ko-KR")
+    assert key == GradingCache.make_key(bytearray(PCM), "안녕하세요", "azure|ko-KR")
+    assert key != GradingCache.make_key(PCM + b"\x00\x00", "안녕하세요", "azure|ko-KR")
+    assert key != GradingCache.make_key(PCM, "안녕히 가세요", "azure|ko-KR")
+    assert key != GradingCache.make_key(PCM, "안녕하세요", "local|ko-KR")
+
+
+def test_candidate_list_key_differs_from_joined_text():
+    candidates = ["가", "나"]
+    key = GradingCache.make_key(PCM, candidates, "s")
+    assert key == GradingCache.make_key(PCM, tuple(candidates), "s")
+    assert key != GradingCache.make_key(PCM, ["가나"], "s")
+    assert key != GradingCache.make_key(PCM, "가\x1e나", "s")
+
+
+def test_file_key_does_not_collide_with_pcm_key():
+    file_key = GradingCache.make_file_key("AgADxyz", "안녕", "azure")
+    assert file_key == GradingCache.make_file_key("AgADxyz", "안녕", "azure")
+    assert file_key != GradingCache.make_key(b"file:AgADxyz", "안녕", "azure")
+
+
+def test_get_returns_copies():
+    cache = GradingCache(max_entries=4, cache_dir="")
+    cache.put("k", RESULT)
+    cached = cache.get("k")
+    assert cached == RESULT
+    cached["scores"]["pronunciation"] = 0
+    assert cache.get("k") == RESULT
+    assert (cache.hits, cache.misses) == (2, 0)
+
+
+def test_lru_evicts_least_recently_used():
+    cache = GradingCache(max_entries=2, cache_dir="")
+    cache.put("a", RESULT)
+    cache.put("b", RESULT)
+    cache.get("a")
+    cache.put("c", RESULT)
+    assert cache.get("b") is None
+    assert cache.get("a") == RESULT
+    assert cache.get("c") == RESULT
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    GradingCache(max_entries=1, cache_dir=str(tmp_path)).put("a", RESULT)
+    cache = GradingCache(max_entries=1, cache_dir=str(tmp_path))
+    assert cache.get("a") == RESULT
+    assert cache.get("missing") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evicted_memory_entry_is_reloaded_from_disk(tmp_path):
+    cache = GradingCache(max_entries=1, cache_dir=str(tmp_path))
+    cache.put("a", RESULT)
+    cache.put("b", RESULT)
+    assert "a" not in cache._entries
+    assert cache.get("a") == RESULT
+
+
+def test_unreadable_disk_entry_is_a_miss(tmp_path):
+    cache = GradingCache(cache_dir=str(tmp_path))
+    (tmp_path / "bad.json").write_text("{not json", encoding="utf-8")
+    assert cache.get("bad") is None
+
+
+def test_prune_disk_drops_oldest_files(tmp_path):
+    cache = GradingCache(cache_dir=str(tmp_path), max_disk_entries=3)
+    for i in range(5):
+        cache.put(f"k{i}", RESULT)
+        os.utime(tmp_path / f"k{i}.json", (1000 + i, 1000 + i))
+    cache._prune_disk()
+    assert sorted(os.listdir(tmp_path)) == ["k2.json", "k3.json", "k4.json"]
+
+
+def test_disk_is_pruned_every_hundred_writes(tmp_path):
+    cache = GradingCache(cache_dir=str(tmp_path), max_disk_entries=10)
+    for i in range(100):
+        cache.put(f"k{i}", RESULT)
+    assert len(os.listdir(tmp_path)) == 10
@@ -0,0 +1,158 @@
+import asyncio
+import pytest
+from grading_pool import GradingPool, GradingQueueFull, GradingSuperseded
+
+
+def run_jobs(pool, jobs, duration=0.02):
+    """Starts (chat_id, key, name) jobs one loop tick apart; returns the event log."""
+    log = []
+
+    async def job(chat_id, key, name):
+        try:
+            async with pool.chat_turn(chat_id, key):
+                log.append(("start", name))
+                await asyncio.sleep(duration)
+                log.append(("end", name))
+        except GradingSuperseded:
+            log.append(("superseded", name))
+        except GradingQueueFull:
+            log.append(("full", name))
+
+    async def main():
+        tasks = []
+        for chat_id, key, name in jobs:
+            tasks.append(asyncio.create_task(job(chat_id, key, name)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    return log
+
+
+def starts(log):
+    return [name for event, name in log if event == "start"]
+
+
+def test_chat_turn_is_fifo_per_chat():
+    pool = GradingPool(max_workers=1, max_per_chat=5)
+    log = run_jobs(pool, [(1, "a", "a"), (1, "b", "b"), (1, "c", "c")])
+    assert starts(log) == ["a", "b", "c"]
+    # One at a time: each ends before the next starts
+    assert log == [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b"), ("start", "c"), ("end", "c")]
+    assert pool._lanes == {}
+
+
+def test_chats_do_not_wait_for_each_other():
+    pool = GradingPool(max_workers=1, max_per_chat=5)
+    log = run_jobs(pool, [(1, "a", "one"), (2, "a", "two")])
+    assert log[:2] == [("start", "one"), ("start", "two")]
+
+
+def test_newer_submission_supersedes_waiting_same_key():
+    pool = GradingPool(max_workers=1, max_per_chat=5)
+    log = run_jobs(pool, [(1, "a", "a1"), (1, "a", "a2"), (1, "b", "b1"), (1, "a", "a3")])
+    assert ("superseded", "a2") in log
+    assert starts(log) == ["a1", "b1", "a3"]
+
+
+def test_running_submission_is_not_superseded():
+    pool = GradingPool(max_workers=1, max_per_chat=5)
+    log = run_jobs(pool, [(1, "a", "a1"), (1, "a", "a2")])
+    assert starts(log) == ["a1", "a2"]
+
+
+def test_no_key_never_supersedes():
+    pool = GradingPool(max_workers=1, max_per_chat=5)
+    log = run_jobs(pool, [(1, None, "x1"), (1, None, "x2"), (1, None, "x3")])
+    assert starts(log) == ["x1", "x2", "x3"]
+
+
+def test_per_chat_cap():
+    pool = GradingPool(max_workers=1, max_per_chat=2)
+    log = run_jobs(pool, [(1, "a", "a"), (1, "b", "b"), (1, "c", "c"), (1, "d", "d"), (2, "e", "e")])
+    assert ("full", "d") in log
+    assert starts(log) == ["a", "e", "b", "c"]
+
+
+def test_reserve_fixes_order_before_waiting():
+    pool = GradingPool(max_workers=1, max_per_chat=5)
+    log = []
+
+    async def job(turn, name, delay):
+        # The later reservation gets to chat_turn first, but still runs second
+        await asyncio.sleep(delay)
+        async with pool.chat_turn(1, turn=turn):
+            log.append(name)
+
+    async def main():
+        first = pool.reserve(1, "a")
+        second = pool.reserve(1, "b")
+        await asyncio.gather(job(first, "first", 0.02), job(second, "second", 0))
+
+    asyncio.run(main())
+    assert log == ["first", "second"]
+
+
+def test_released_reservation_hands_over():
+    pool = GradingPool(max_workers=1, max_per_chat=5)
+
+    async def main():
+        first = pool.reserve(1, "a")
+        second = pool.reserve(1, "b")
+        first.release()
+        await asyncio.wait_for(second.future, 1)
+        second.release()
+
+    asyncio.run(main())
+    assert pool._lanes == {}
+
+
+def test_cancelled_holder_hands_over():
+    pool = GradingPool(max_workers=1, max_per_chat=5)
+    log = []
+
+    async def holder():
+        async with pool.chat_turn(1, "a"):
+            await asyncio.sleep(10)
+
+    async def waiter():
+        async with pool.chat_turn(1, "b"):
+            log.append("waiter")
+
+    async def main():
+        held = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        held.cancel()
+        await asyncio.wait_for(waiting, 1)
+        with pytest.raises(asyncio.CancelledError):
+            await held
+
+    asyncio.run(main())
+    assert log == ["waiter"]
+    assert pool._lanes == {}
+
+
+def test_cancelled_waiter_does_not_block_lane():
+    pool = GradingPool(max_workers=1, max_per_chat=5)
+    log = []
+
+    async def job(key, name, duration):
+        async with pool.chat_turn(1, key):
+            log.append(name)
+            await asyncio.sleep(duration)
+
+    async def main():
+        first = asyncio.create_task(job("a", "first", 0.02))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(job("b", "cancelled", 0))
+        await asyncio.sleep(0)
+        third = asyncio.create_task(job("c", "third", 0))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(first, third)
+
+    asyncio.run(main())
+    assert log == ["first", "third"]
+    assert pool._lanes == {}
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from local_grader import LONG_PAUSE_SECONDS, LocalGrader, ctc_force_align, log_softmax
+
+VOCAB = ["<pad>", "|", "가", "나", "다", "라"]
+BLANK, DELIM, GA, NA, DA, RA = range(len(VOCAB))
+FRAME_SECONDS = 0.02
+
+
+def posteriors(frames, confidence=0.9):
+    """T x V log posteriors putting `confidence` on each frame's token."""
+    probs = np.full((len(frames), len(VOCAB)), (1 - confidence) / (len(VOCAB) - 1))
+    probs[np.arange(len(frames)), frames] = confidence
+    return np.log(probs)
+
+
+def pcm_for(log_probs):
+    # 16kHz 16bit PCM lasting FRAME_SECONDS per frame
+    return b"\x00\x00" * int(len(log_probs) * FRAME_SECONDS * 16000)
+
+
+@pytest.fixture
+def grader():
+    # Scoring only needs the vocabulary, not the ONNX session
+    grader = LocalGrader.__new__(LocalGrader)
+    grader._set_vocab(VOCAB)
+    grader.cache = None
+    return grader
+
+
+def test_log_softmax_normalizes():
+    out = log_softmax(np.array([[1.0, 2.0, 3.0]]))
+    assert np.exp(out).sum() == pytest.approx(1.0)
+
+
+def test_align_follows_the_posteriors():
+    alignment = ctc_force_align(posteriors([GA, GA, BLANK, NA, NA, BLANK]), [GA, NA], BLANK)
+    assert alignment.tolist() == [0, 0, -1, 1, 1, -1]
+
+
+def test_align_repeated_label_needs_a_blank_between():
+    alignment = ctc_force_align(posteriors([GA, BLANK, GA]), [GA, GA], BLANK)
+    assert alignment.tolist() == [0, -1, 1]
+    assert ctc_force_align(posteriors([GA, GA]), [GA, GA], BLANK) is None
+
+
+def test_align_rejects_too_few_frames_or_no_labels():
+    assert ctc_force_align(posteriors([GA]), [GA, NA], BLANK) is None
+    assert ctc_force_align(posteriors([GA, NA]), [], BLANK) is None
+
+
+def test_vocab_map_is_ordered_by_id(grader):
+    grader._set_vocab({token: i for i, token in reversed(list(enumerate(VOCAB)))})
+    assert grader.tokens == VOCAB
+    assert (grader.blank, grader.delimiter) == (BLANK, DELIM)
+
+
+def test_clean_reading_scores_high(grader):
+    log_probs = posteriors([BLANK, GA, NA, DELIM, DA, RA, BLANK])
+    res = grader._score(pcm_for(log_probs), log_probs, "가나 다라", "가나 다라")
+    assert res["status"] == "success"
+    assert [w["error_type"] for w in res["word_details"]] == ["None", "None"]
+    assert res["scores"]["accuracy"] == pytest.approx(100.0)
+    assert res["scores"]["completeness"] == pytest.approx(100.0)
+    assert res["scores"]["fluency"] == pytest.approx(100.0)
+    assert "pronunciation" in res["approximate_scores"]
+
+
+def test_word_the_model_never_heard_is_an_omission(grader):
+    # 다라 frames carry 가 instead: the forced alignment finds no evidence for them
+    log_probs = posteriors([GA, NA, DELIM, GA, GA, BLANK], confidence=0.99)
+    res = grader._score(pcm_for(log_probs), log_probs, "가나 다라", "가나")
+    assert [w["error_type"] for w in res["word_details"]] == ["None", "Omission"]
+    assert res["scores"]["completeness"] == pytest.approx(50.0)
+    assert res["scores"]["accuracy"] == pytest.approx(100.0)
+
+
+def test_unaligned_reference_is_an_error(grader):
+    log_probs = posteriors([GA])
+    assert grader._score(pcm_for(log_probs), log_probs, "가나 다라", "가")["status"] == "error"
+    assert grader._score(pcm_for(log_probs), log_probs, "xyz", "가")["status"] == "error"
+
+
+@pytest.mark.parametrize("gap_token", [BLANK, DELIM])
+def test_long_pause_between_words_lowers_fluency(grader, gap_token):
+    gap = int(2 * LONG_PAUSE_SECONDS / FRAME_SECONDS)
+    frames = [GA, NA] + [DELIM] + [gap_token] * gap + [DA, RA]
+    log_probs = posteriors(frames)
+    res = grader._score(pcm_for(log_probs), log_probs, "가나 다라", "가나 다라")
+    # Every gap frame, the delimiter included, is part of one long pause
+    assert res["scores"]["fluency"] == pytest.approx(100.0 * 4 / len(frames))
+
+
+def test_short_pause_is_not_penalized(grader):
+    gap = int(LONG_PAUSE_SECONDS / FRAME_SECONDS) - 2
+    log_probs = posteriors([GA, NA, DELIM] + [BLANK] * gap + [DA, RA])
+    res = grader._score(pcm_for(log_probs), log_probs, "가나 다라", "가나 다라")
+    assert res["scores"]["fluency"] == pytest.approx(100.0)
@@ -0,0 +1,74 @@
+import pytest
+from matcher import CandidateMatcher, MIN_CONFIDENCE, get_matcher, normalize, read_sino_korean
+
+
+@pytest.mark.parametrize("number, reading", [
+    (0, "영"),
+    (3, "삼"),
+    (10, "십"),
+    (25, "이십오"),
+    (100, "백"),
+    (1111, "천백십일"),
+    (10000, "만"),
+    (20000, "이만"),
+    (10001, "만일"),
+    (110000, "십일만"),
+    (100000000, "일억"),
+])
+def test_read_sino_korean(number, reading):
+    assert read_sino_korean(number) == reading
+
+
+def test_normalize_reads_numbers_and_drops_spacing():
+    assert normalize("사과 3개!") == normalize("사과삼개")
+    assert normalize("1,000원") == normalize("천원")
+
+
+CANDIDATES = [
+    "저는 학교에 갑니다.",
+    "오늘 날씨가 정말 좋네요.",
+    "사과 3개 주세요.",
+]
+
+
+def test_picks_the_candidate_that_was_read():
+    match = CandidateMatcher(CANDIDATES).match("오늘 날씨가 정말 좋네요")
+    assert match.index == 1
+    assert match.text == CANDIDATES[1]
+    assert match.confident
+    assert match.margin > 0
+
+
+def test_spelled_out_number_matches_digits():
+    match = CandidateMatcher(CANDIDATES).match("사과 삼 개 주세요")
+    assert match.index == 2
+    assert match.score == pytest.approx(1.0)
+
+
+def test_identical_text_scores_one_and_unrelated_scores_zero():
+    scores = CandidateMatcher(CANDIDATES).scores(CANDIDATES[0])
+    assert scores[0] == pytest.approx(1.0)
+    assert CandidateMatcher(["가나다라"]).scores("hello")[0] == 0.0
+
+
+def test_below_min_confidence_is_not_confident():
+    match = CandidateMatcher(CANDIDATES).match("비행기가 하늘을 날아요")
+    assert match.score < MIN_CONFIDENCE
+    assert not match.confident
+
+
+def test_min_confidence_override():
+    spoken = "저는 학교에"
+    score = CandidateMatcher(CANDIDATES).match(spoken).score
+    assert CandidateMatcher(CANDIDATES, min_confidence=score).match(spoken).confident
+    assert not CandidateMatcher(CANDIDATES, min_confidence=score + 0.01).match(spoken).confident
+
+
+def test_empty_inputs():
+    assert CandidateMatcher([]).match("아무거나") is None
+    assert CandidateMatcher(CANDIDATES).match("").score == 0.0
+
+
+def test_get_matcher_is_shared_per_candidate_list():
+    assert get_matcher(CANDIDATES) is get_matcher(list(CANDIDATES))
+    assert get_matcher(CANDIDATES) is not get_matcher(CANDIDATES[:2])
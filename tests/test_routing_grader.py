@@ -0,0 +1,132 @@
+import threading
+import time
+import pytest
+from grader_base import BaseGrader, RoutingGrader
+
+PCM = b"\x00\x00" * 1600
+
+
+class FakeGrader(BaseGrader):
+    """Answers with `result`; `gate` (an Event) makes calls wait, `error` makes them raise."""
+
+    def __init__(self, name, result=None, gate=None, error=None):
+        self.name = name
+        self.result = result or {"status": "success", "engine": name}
+        self.gate = gate
+        self.error = error
+        self.calls = 0
+
+    def grade(self, audio, reference_text):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return dict(self.result)
+
+    def recognize_and_grade(self, audio, candidates):
+        return self.grade(audio, candidates)
+
+
+@pytest.fixture
+def gate():
+    gate = threading.Event()
+    yield gate
+    gate.set()  # Lets abandoned primary calls finish
+
+
+def test_healthy_primary_answers():
+    primary, fallback = FakeGrader("azure"), FakeGrader("local")
+    router = RoutingGrader(primary, fallback, budget=1)
+    assert router.grade(PCM, "가")["engine"] == "azure"
+    assert router.recognize_and_grade(PCM, ["가"])["engine"] == "azure"
+    assert fallback.calls == 0
+
+
+def test_over_budget_falls_back(gate):
+    primary, fallback = FakeGrader("azure", gate=gate), FakeGrader("local")
+    router = RoutingGrader(primary, fallback, budget=0.05)
+    started = time.monotonic()
+    assert router.grade(PCM, "가")["engine"] == "local"
+    assert time.monotonic() - started < 1
+
+
+@pytest.mark.parametrize("primary", [
+    FakeGrader("azure", result={"status": "error", "message": "quota", "service_error": True}),
+    FakeGrader("azure", error=RuntimeError("connection reset")),
+])
+def test_service_errors_fall_back(primary):
+    router = RoutingGrader(primary, FakeGrader("local"), budget=1)
+    assert router.grade(PCM, "가")["engine"] == "local"
+
+
+def test_audio_errors_are_not_retried_on_fallback():
+    primary = FakeGrader("azure", result={"status": "error", "message": "No speech"})
+    fallback = FakeGrader("local")
+    router = RoutingGrader(primary, fallback, budget=1)
+    assert router.grade(PCM, "가")["message"] == "No speech"
+    assert fallback.calls == 0
+
+
+def test_breaker_trips_and_recovers():
+    primary = FakeGrader("azure", error=RuntimeError("down"))
+    router = RoutingGrader(primary, FakeGrader("local"), budget=1, max_failures=2, cooldown=0.1)
+    for _ in range(2):
+        router.grade(PCM, "가")
+    assert primary.calls == 2
+
+    # Open: primary is skipped
+    assert router.grade(PCM, "가")["engine"] == "local"
+    assert primary.calls == 2
+
+    # After the cooldown primary is tried again, and a success closes the breaker
+    time.sleep(0.15)
+    primary.error = None
+    assert router.grade(PCM, "가")["engine"] == "azure"
+    assert router._failures == 0
+
+
+def test_saturated_primary_goes_straight_to_fallback(monkeypatch, gate):
+    monkeypatch.setenv("GRADING_WORKERS", "1")
+    primary, fallback = FakeGrader("azure", gate=gate), FakeGrader("local")
+    router = RoutingGrader(primary, fallback, budget=0.05, max_failures=100)
+    assert router.max_in_flight == 2
+
+    for _ in range(2):
+        router.grade(PCM, "가")
+    assert primary.calls == 2
+
+    # Both primary threads still hang: no new call waits behind them
+    started = time.monotonic()
+    assert router.grade(PCM, "가")["engine"] == "local"
+    assert time.monotonic() - started < 0.05
+    assert primary.calls == 2
+
+    # Once the hung calls return, primary takes gradings again
+    gate.set()
+    deadline = time.monotonic() + 2
+    while router._in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert router.grade(PCM, "가")["engine"] == "azure"
+
+
+def test_streams_go_to_primary():
+    primary = FakeGrader("azure")
+    router = RoutingGrader(primary, FakeGrader("local"), budget=1)
+    assert router.grade(object(), "가")["engine"] == "azure"
+
+
+def test_file_cache_follows_the_engine_that_graded():
+    primary, fallback = FakeGrader("azure"), FakeGrader("local")
+    remembered = []
+    primary.remember_file = lambda *args: remembered.append("azure")
+    fallback.remember_file = lambda *args: remembered.append("local")
+    router = RoutingGrader(primary, fallback)
+    router.remember_file("file", "가", {"status": "success", "engine": "local"})
+    router.remember_file("file", "가", {"status": "success"})
+    assert remembered == ["local", "azure"]
+
+
+def test_base_grader_is_abstract():
+    with pytest.raises(TypeError):
+        BaseGrader()
@@ -0,0 +1,44 @@
+import pytest
+from user_store import JsonUserStore, SqliteUserStore
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def stores(request, tmp_path):
+    """Two store instances on one file, like the bot and the web app."""
+    if request.param == "sqlite":
+        path = str(tmp_path / "users.db")
+        pair = SqliteUserStore(path), SqliteUserStore(path)
+    else:
+        path = str(tmp_path / "users.json")
+        pair = JsonUserStore(path), JsonUserStore(path)
+    yield pair
+    for store in pair:
+        store.close()
+
+
+def test_add_user_only_once(stores):
+    bot, web = stores
+    assert bot.add_user("1", {"current_day": 1, "last_homework_date": None})
+    assert not web.add_user("1", {"current_day": 5, "last_homework_date": None})
+    assert web.get_user("1") == {"current_day": 1, "last_homework_date": None}
+
+
+def test_advance_day_builds_on_the_other_instance(stores):
+    bot, web = stores
+    bot.add_user("1", {"current_day": 1, "last_homework_date": None})
+    assert bot.advance_day("1", "2026-01-01")["current_day"] == 2
+    assert web.advance_day("1", "2026-01-02") == {"current_day": 3, "last_homework_date": "2026-01-02"}
+    assert bot.get_user("1")["current_day"] == 3
+
+
+def test_set_day_keeps_last_homework_date(stores):
+    bot, web = stores
+    bot.add_user("1", {"current_day": 4, "last_homework_date": "2026-01-01"})
+    assert web.set_day("1", 9) == {"current_day": 9, "last_homework_date": "2026-01-01"}
+
+
+def test_unknown_users(stores):
+    bot, _ = stores
+    assert bot.get_user("404") is None
+    assert bot.advance_day("404", "2026-01-01") is None
+    assert bot.set_day("404", 3) is None
@@ -1,28 +1,176 @@
 
-import json
 import os
+import re
+import time
+import atexit
+import weakref
 import datetime
 import logging
+import threading
 import gspread
-from google.oauth2 import service_account
+from gspread.utils import rowcol_to_a1
 from dotenv import load_dotenv
+import sheets_auth
+from user_store import open_user_store
+from metrics import timed
 
 # Load env file for standalone/bot usage
 load_dotenv()
 
+# Buffers still holding writes are flushed once at interpreter exit
+_live_buffers = weakref.WeakSet()
+
+@atexit.register
+def _flush_live_buffers():
+    for buffer in list(_live_buffers):
+        buffer.flush()
+
+class SheetWriteBuffer:
+    """
+    Write-behind buffer for the 'Users' worksheet.
+
+    Cell updates are merged per user (latest value per column wins) and written
+    with a single batch_update, either every `flush_interval` seconds or as soon as
+    `max_pending` users are waiting. Quota (429) and server errors are retried with
+    exponential backoff; callers never wait on the Sheets API.
+    """
+
+    RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, manager, flush_interval=None, max_pending=None, max_retries=5):
+        self.manager = manager
+        self.flush_interval = flush_interval or float(os.getenv("SHEET_FLUSH_INTERVAL", "5"))
+        self.max_pending = max_pending or int(os.getenv("SHEET_FLUSH_SIZE", "50"))
+        self.max_retries = max_retries
+
+        self._pending = {}  # user_id -> {"cells": {col: value}, "new_row": list or None}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        _live_buffers.add(self)
+
+    def enqueue(self, user_id, cells, new_row=None):
+        """
+        Queues cell updates for a user's row.
+
+        :param cells: {column number: value}
+        :param new_row: Row to append if the user is not in the sheet yet (None = skip)
+        """
+        with self._lock:
+            entry = self._pending.setdefault(str(user_id), {"cells": {}, "new_row": None})
+            entry["cells"].update(cells)
+            if new_row is not None:
+                entry["new_row"] = new_row
+            size = len(self._pending)
+
+            # The writer thread only lives while there is something to write
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sheet-writer", daemon=True)
+                self._thread.start()
+
+        if size >= self.max_pending:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+
+    def flush(self):
+        """Writes everything pending now. Safe to call from any thread."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+
+            try:
+                with timed("sheet_flush"):
+                    self._write_with_retry(batch)
+            except Exception as e:
+                logging.error(f"Sheet flush failed for {len(batch)} users, will retry later: {e}")
+                # Rows may have moved under us; re-read them before the next attempt
+                self.manager.invalidate_row_index()
+                self._requeue(batch)
+
+    def _requeue(self, batch):
+        # Anything queued after the failed batch is newer and wins
+        with self._lock:
+            for user_id, entry in batch.items():
+                pending = self._pending.get(user_id)
+                if pending is None:
+                    self._pending[user_id] = entry
+                else:
+                    entry["cells"].update(pending["cells"])
+                    pending["cells"] = entry["cells"]
+                    pending["new_row"] = pending["new_row"] or entry["new_row"]
+
+    def _write_with_retry(self, batch):
+        delay = 1.0
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                return self._write(batch)
+            except gspread.exceptions.APIError as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status not in self.RETRYABLE_STATUS or attempt == self.max_retries:
+                    raise
+                logging.warning(f"Sheets API error {status}, retrying in {delay:.0f}s ({attempt}/{self.max_retries})")
+                time.sleep(delay)
+                delay *= 2
+
+    def _write(self, batch):
+        sheet = self.manager.get_sheet()
+        if not sheet:
+            # flush() requeues the batch, so the next interval reconnects and retries
+            raise RuntimeError("no connection to the Users sheet")
+
+        data = []
+        new_rows = []
+        new_row_ids = []
+        for user_id, entry in batch.items():
+            row = self.manager.find_user_row(user_id)
+            if row:
+                for col, value in sorted(entry["cells"].items()):
+                    data.append({"range": rowcol_to_a1(row, col), "values": [[value]]})
+            elif entry["new_row"] is not None:
+                new_row = list(entry["new_row"])
+                for col, value in entry["cells"].items():
+                    new_row.extend([""] * (col - len(new_row)))
+                    new_row[col - 1] = value
+                new_rows.append(new_row)
+                new_row_ids.append(user_id)
+            else:
+                logging.warning(f"User {user_id} not found in sheet for score update.")
+
+        if data:
+            sheet.batch_update(data, value_input_option="USER_ENTERED")
+        if new_rows:
+            response = sheet.append_rows(new_rows)
+            self.manager.record_appended_rows(new_row_ids, response)
+        logging.info(f"Flushed {len(data)} cell updates and {len(new_rows)} new rows to Users sheet")
+
 class UserManager:
-    def __init__(self, db_file="users.json", key_file="service_account.json"):
+    def __init__(self, db_file="users.json", key_file="service_account.json", client=None, store=None, client_factory=None):
         self.db_file = db_file
+        # Local progress DB; USER_STORE picks SQLite (default) or the users.json file
+        self.store = store or open_user_store(db_file)
         self.users = self.load_users()
         
-        # Google Sheet Config
+        # Google Sheet Config (pass a shared gspread client to reuse its HTTP session;
+        # client_factory, e.g. registry.get_sheets_client, supplies it later if it was unavailable)
         self.key_file = key_file
-        self.scope = [
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/drive'
-        ]
-        self.client = None
+        self.client = client
+        self.client_factory = client_factory
         self.sheet = None
+        self.write_buffer = SheetWriteBuffer(self)
+        self._row_index = None  # user_id -> row number in the Users sheet
+        self._row_index_lock = threading.Lock()
         
         # 1. Check environment variable first (for Bot)
         # 2. Then check Streamlit secrets (for Web)
@@ -36,142 +184,146 @@ class UserManager:
 
     def connect_sheet(self):
         """Connects to 'Users' worksheet using st.secrets or local key file."""
-        if self.client is None:
-            creds_info = None
-            
-            # 1. Try Streamlit Secrets
+        if self.sheet is None:
             try:
-                import streamlit as st
-                if "gcp_service_account" in st.secrets:
-                    creds_info = dict(st.secrets["gcp_service_account"])
-                elif "private_key" in st.secrets:
-                    creds_info = {
-                        "type": st.secrets.get("type", "service_account"),
-                        "project_id": st.secrets.get("project_id"),
-                        "private_key_id": st.secrets.get("private_key_id"),
-                        "private_key": st.secrets.get("private_key"),
-                        "client_email": st.secrets.get("client_email"),
-                        "client_id": st.secrets.get("client_id"),
-                        "auth_uri": st.secrets.get("auth_uri"),
-                        "token_uri": st.secrets.get("token_uri"),
-                        "auth_provider_x509_cert_url": st.secrets.get("auth_provider_x509_cert_url"),
-                        "client_x509_cert_url": st.secrets.get("client_x509_cert_url")
-                    }
-            except:
-                pass
-
-            # 2. Fallback to local file
-            if not creds_info or not creds_info.get("private_key"):
-                if os.path.exists(self.key_file):
-                    try:
-                        with open(self.key_file, "r", encoding="utf-8") as f:
-                            creds_info = json.load(f)
-                    except Exception as e:
-                        logging.error(f"Failed to read key file: {e}")
-
-            # Validation & Connection
-            try:
-                if not creds_info:
-                    logging.warning("User Manager: No credentials found.")
-                    return
-                
-                # Convert to plain dict
-                creds_dict = {}
-                try:
-                    if hasattr(creds_info, "to_dict"):
-                        creds_dict = creds_info.to_dict()
-                    else:
-                        creds_dict = dict(creds_info)
-                except:
-                    creds_dict = creds_info
-
-                if isinstance(creds_dict.get("private_key"), str):
-                    creds_dict["private_key"] = creds_dict["private_key"].replace("\\n", "\n")
-
-                creds = service_account.Credentials.from_service_account_info(
-                    creds_dict, scopes=self.scope
-                )
-                self.client = gspread.authorize(creds)
+                if self.client is None:
+                    self.client = self.client_factory() if self.client_factory else sheets_auth.authorize(self.key_file)
+                if self.client is None:
+                    raise RuntimeError("Google Sheets client unavailable")
                 self.sheet = self.client.open(self.sheet_name).worksheet("Users")
             except Exception as e:
                 logging.error(f"User Manager connection failed: {e}")
                 self.sheet = None
 
-    def sync_to_sheet(self, user_id, current_day, last_updated):
-        """Sync a single user's status to Google Sheet."""
+    def get_sheet(self):
+        """Returns the connected 'Users' worksheet (None if unavailable)."""
         self.connect_sheet()
-        if not self.sheet:
-            return
+        return self.sheet
+
+    def find_user_row(self, user_id):
+        """Returns the sheet row number for a user, or None."""
+        with self._row_index_lock:
+            if self._row_index is None:
+                self._row_index = self._load_row_index()
+            return self._row_index.get(str(user_id))
+
+    def _load_row_index(self):
+        # One read of column A instead of a sheet.find() per lookup.
+        # Exact matches only, so a score equal to an ID can never be hit.
+        index = {}
+        for row, value in enumerate(self.sheet.col_values(1), 1):
+            key = str(value).strip()
+            if key and key not in index:
+                index[key] = row
+        logging.info(f"Loaded row index for {len(index)} users")
+        return index
 
+    def record_appended_rows(self, user_ids, response):
+        """Adds rows created by append_rows() to the row index."""
         try:
-            cell = self.sheet.find(str(user_id))
-            if cell:
-                self.sheet.update_cell(cell.row, 2, current_day)
-                self.sheet.update_cell(cell.row, 3, last_updated)
-            else:
-                self.sheet.append_row([str(user_id), current_day, last_updated])
-        except Exception as e:
-            logging.error(f"Sheet Sync Error for {user_id}: {e}")
+            # e.g. {"updates": {"updatedRange": "Users!A12:D13"}}
+            updated_range = response["updates"]["updatedRange"]
+            first_row = int(re.search(r"![A-Z]+(\d+)", updated_range).group(1))
+        except Exception:
+            self.invalidate_row_index()
+            return
+
+        with self._row_index_lock:
+            if self._row_index is None:
+                return
+            for offset, user_id in enumerate(user_ids):
+                self._row_index[str(user_id)] = first_row + offset
+
+    def invalidate_row_index(self):
+        """Forces the next lookup to re-read the user ID column."""
+        with self._row_index_lock:
+            self._row_index = None
+
+    def sync_to_sheet(self, user_id, current_day, last_updated):
+        """Queues a single user's status for the Google Sheet (written by the write buffer)."""
+        with timed("sync_to_sheet"):
+            self.write_buffer.enqueue(
+                user_id,
+                {2: current_day, 3: last_updated},
+                new_row=[str(user_id), current_day, last_updated]
+            )
 
     def update_user_score(self, chat_id, score):
-        """Updates the user's score in the linked Google Sheet (Column D)."""
-        self.connect_sheet()
-        if not self.sheet:
-            return
+        """Queues the user's score for the linked Google Sheet (Column D)."""
+        with timed("update_user_score"):
+            self.write_buffer.enqueue(chat_id, {4: str(score)})
 
-        try:
-            str_id = str(chat_id)
-            cell = self.sheet.find(str_id)
-            if cell:
-                self.sheet.update_cell(cell.row, 4, str(score))
-            else:
-                logging.warning(f"User {str_id} not found in sheet for score update.")
-        except Exception as e:
-            logging.error(f"Failed to update score for {chat_id}: {e}")
+    def flush_sheet(self):
+        """Writes all queued sheet updates immediately."""
+        self.write_buffer.flush()
 
     def load_users(self):
-        if not os.path.exists(self.db_file):
-            return {}
         try:
-            with open(self.db_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return self.store.load_all()
         except Exception as e:
             logging.error(f"Failed to load users DB: {e}")
             return {}
 
-    def save_users(self):
+    def refresh_users(self):
+        """Re-reads every user from the store, including ones another process registered."""
         try:
-            with open(self.db_file, 'w', encoding='utf-8') as f:
-                json.dump(self.users, f, indent=4, ensure_ascii=False)
+            self.users = self.store.load_all()
         except Exception as e:
-            logging.error(f"Failed to save users DB: {e}")
+            logging.error(f"Failed to reload users DB, keeping the cached users: {e}")
+        return self.users
+
+    def save_users(self):
+        """Persists every user. Prefer save_user() when only one record changed."""
+        self.store.save_all(self.users)
+
+    def save_user(self, chat_id):
+        """Persists a single user's record."""
+        str_id = str(chat_id)
+        if str_id in self.users:
+            self.store.save_user(str_id, self.users[str_id])
+
+    # The bot and the web app share the store, so the mutators below change the
+    # stored record in place and then refresh self.users from it.
 
     def register_user(self, chat_id):
         str_id = str(chat_id)
-        if str_id not in self.users:
-            today = datetime.date.today().isoformat()
-            self.users[str_id] = {
-                "current_day": 1,
-                "last_homework_date": None
-            }
-            self.save_users()
-            self.sync_to_sheet(str_id, 1, today)
-            return True
-        return False
+        if str_id in self.users:
+            return False
+        record = {"current_day": 1, "last_homework_date": None}
+        if not self.store.add_user(str_id, record):
+            # Registered by the other process
+            self.users[str_id] = self.store.get_user(str_id)
+            return False
+        self.users[str_id] = record
+        self.sync_to_sheet(str_id, 1, datetime.date.today().isoformat())
+        return True
 
     def get_user_progress(self, chat_id):
         str_id = str(chat_id)
-        return self.users.get(str_id, {"current_day": 1})
+        record = self.store.get_user(str_id)
+        if record is None:
+            return self.users.get(str_id, {"current_day": 1})
+        self.users[str_id] = record
+        return record
 
     def advance_user_day(self, chat_id):
         str_id = str(chat_id)
-        if str_id in self.users:
-            self.users[str_id]["current_day"] += 1
-            today = datetime.date.today().isoformat()
-            self.users[str_id]["last_homework_date"] = today
-            self.save_users()
-            self.sync_to_sheet(str_id, self.users[str_id]["current_day"], today)
-            return self.users[str_id]["current_day"]
-        else:
-            self.register_user(chat_id)
-            return self.advance_user_day(chat_id)
+        today = datetime.date.today().isoformat()
+        record = self.store.advance_day(str_id, today)
+        if record is None:
+            self.store.add_user(str_id, {"current_day": 1, "last_homework_date": None})
+            record = self.store.advance_day(str_id, today)
+        self.users[str_id] = record
+        self.sync_to_sheet(str_id, record["current_day"], today)
+        return record["current_day"]
+
+    def set_user_day(self, chat_id, day):
+        """Sets a user's current day; returns False for unregistered users."""
+        str_id = str(chat_id)
+        record = self.store.set_day(str_id, day)
+        if record is None:
+            return False
+        self.users[str_id] = record
+        # Reuse the last homework date, or today's if there is none
+        self.sync_to_sheet(str_id, day, record.get("last_homework_date") or datetime.date.today().isoformat())
+        return True
@@ -0,0 +1,283 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+class UserStore(ABC):
+    """
+    Storage backend for UserManager.
+
+    Records are dicts like {"current_day": 1, "last_homework_date": None}
+    keyed by the user ID as a string. The bot and the web app may share one
+    store, so changes to a single user go through get_user/add_user/advance_day/
+    set_day, which act on the stored record rather than a cached copy.
+    """
+
+    @abstractmethod
+    def load_all(self):
+        """Returns {user_id: record} for every stored user."""
+
+    @abstractmethod
+    def save_user(self, user_id, record):
+        """Persists a single user's record."""
+
+    @abstractmethod
+    def save_all(self, users):
+        """Persists every record in `users`."""
+
+    @abstractmethod
+    def get_user(self, user_id):
+        """Returns the stored record, or None."""
+
+    @abstractmethod
+    def add_user(self, user_id, record):
+        """Stores `record` unless the user exists; returns whether it was added."""
+
+    @abstractmethod
+    def advance_day(self, user_id, today):
+        """Moves the user one day on, dated `today`; returns the new record (None for unknown users)."""
+
+    @abstractmethod
+    def set_day(self, user_id, day):
+        """Sets the user's current day; returns the new record (None for unknown users)."""
+
+    def close(self):
+        pass
+
+class JsonUserStore(UserStore):
+    """Whole-file JSON store. Fine for small deployments; every save rewrites the file."""
+
+    def __init__(self, db_file="users.json"):
+        self.db_file = db_file
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def load_all(self):
+        if not os.path.exists(self.db_file):
+            return self._users
+        try:
+            with open(self.db_file, 'r', encoding='utf-8') as f:
+                self._users = json.load(f)
+        except Exception as e:
+            logging.error(f"Failed to load users DB: {e}")
+        return self._users
+
+    def get_user(self, user_id):
+        return self.load_all().get(str(user_id))
+
+    def add_user(self, user_id, record):
+        with self._lock:
+            self.load_all()
+            if str(user_id) in self._users:
+                return False
+            self._users[str(user_id)] = dict(record)
+            self._write()
+            return True
+
+    def advance_day(self, user_id, today):
+        def advance(record):
+            record["current_day"] = record.get("current_day", 1) + 1
+            record["last_homework_date"] = today
+        return self._modify(user_id, advance)
+
+    def set_day(self, user_id, day):
+        return self._modify(user_id, lambda record: record.update(current_day=day))
+
+    def _modify(self, user_id, change):
+        # Re-reads the file first; only safe within one process (use SQLite to share)
+        with self._lock:
+            self.load_all()
+            record = self._users.get(str(user_id))
+            if record is None:
+                return None
+            change(record)
+            self._write()
+            return dict(record)
+
+    def save_user(self, user_id, record):
+        with self._lock:
+            self._users[str(user_id)] = record
+            self._write()
+
+    def save_all(self, users):
+        with self._lock:
+            self._users = users
+            self._write()
+
+    def _write(self):
+        # Write to a temp file and swap it in so a crash never leaves a truncated DB
+        tmp_file = f"{self.db_file}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._users, f, indent=4, ensure_ascii=False)
+            os.replace(tmp_file, self.db_file)
+        except Exception as e:
+            logging.error(f"Failed to save users DB: {e}")
+
+class SqliteUserStore(UserStore):
+    """SQLite store in WAL mode: one row per user, updated in place."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            chat_id INTEGER,
+            current_day INTEGER NOT NULL DEFAULT 1,
+            last_homework_date TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_chat_id ON users (chat_id);
+    """
+
+    def __init__(self, db_file="users.db", migrate_from=None):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        # Shared across handler and worker threads; access is serialized by _lock
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+        if migrate_from:
+            self.migrate_from_json(migrate_from)
+
+    @staticmethod
+    def _chat_id(user_id):
+        try:
+            return int(user_id)
+        except (TypeError, ValueError):
+            return None
+
+    def _row(self, user_id, record):
+        return (
+            str(user_id),
+            self._chat_id(user_id),
+            record.get("current_day", 1),
+            record.get("last_homework_date"),
+        )
+
+    _UPSERT = """
+        INSERT INTO users (user_id, chat_id, current_day, last_homework_date)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            chat_id = excluded.chat_id,
+            current_day = excluded.current_day,
+            last_homework_date = excluded.last_homework_date
+    """
+
+    def load_all(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, current_day, last_homework_date FROM users ORDER BY rowid"
+            ).fetchall()
+        return {
+            user_id: {"current_day": current_day, "last_homework_date": last_date}
+            for user_id, current_day, last_date in rows
+        }
+
+    def save_user(self, user_id, record):
+        try:
+            with self._lock:
+                self._conn.execute(self._UPSERT, self._row(user_id, record))
+        except Exception as e:
+            logging.error(f"Failed to save user {user_id}: {e}")
+
+    def save_all(self, users):
+        try:
+            self._write_all(users)
+        except Exception as e:
+            logging.error(f"Failed to save users DB: {e}")
+
+    def get_user(self, user_id):
+        with self._lock:
+            return self._select(user_id)
+
+    def _select(self, user_id):
+        row = self._conn.execute(
+            "SELECT current_day, last_homework_date FROM users WHERE user_id = ?", (str(user_id),)
+        ).fetchone()
+        return None if row is None else {"current_day": row[0], "last_homework_date": row[1]}
+
+    def add_user(self, user_id, record):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO users (user_id, chat_id, current_day, last_homework_date) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(user_id) DO NOTHING",
+                self._row(user_id, record)
+            )
+        return cursor.rowcount == 1
+
+    def advance_day(self, user_id, today):
+        return self._update(
+            user_id,
+            "UPDATE users SET current_day = current_day + 1, last_homework_date = ? WHERE user_id = ?",
+            (today, str(user_id))
+        )
+
+    def set_day(self, user_id, day):
+        return self._update(user_id, "UPDATE users SET current_day = ? WHERE user_id = ?", (day, str(user_id)))
+
+    def _update(self, user_id, sql, params):
+        # The change is computed by SQLite from the stored row, so another process's write is never lost
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = self._conn.execute(sql, params).rowcount
+                record = self._select(user_id) if updated else None
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return record
+
+    def _write_all(self, users):
+        """Upserts every record in one transaction; raises on failure."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(self._UPSERT, [self._row(u, r) for u, r in users.items()])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def migrate_from_json(self, json_file):
+        """One-time import of an existing users.json into an empty database."""
+        if not os.path.exists(json_file):
+            return 0
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        if count:
+            return 0
+
+        users = JsonUserStore(json_file).load_all()
+        if not users:
+            return 0
+
+        # Raises on failure: users.json stays in place and the import is retried on the next start
+        self._write_all(users)
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        if count != len(users):
+            raise RuntimeError(f"Migrated {count} of {len(users)} users from {json_file}; keeping it for a retry")
+
+        # Keep the original around, but make sure it is never imported twice
+        os.replace(json_file, f"{json_file}.migrated")
+        logging.info(f"Migrated {len(users)} users from {json_file} to {self.db_file}")
+        return len(users)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def open_user_store(json_file="users.json"):
+    """
+    Opens the backend selected by USER_STORE: 'sqlite' (default) or 'json'.
+    The SQLite file is USER_DB_FILE (default users.db) and imports `json_file` once.
+    """
+    backend = os.getenv("USER_STORE", "sqlite").lower()
+    if backend == "json":
+        return JsonUserStore(json_file)
+    if backend != "sqlite":
+        raise ValueError(f"Unknown USER_STORE backend: {backend}")
+    return SqliteUserStore(os.getenv("USER_DB_FILE", "users.db"), migrate_from=json_file)